@@ -17,17 +17,24 @@
 """
 Script for searching for AWS resources that can be removed.
  * Search for Packer resources that are not cleanned up correctly
- * Search for old AMIs that are no longer used
+ * Search for old AMIs that are no longer used, deleting their snapshots too
 """
 
 import re
 import os
+import json
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
 
 import alter_path
 from lib import configuration
 from lib import console
 
+# Maximum number of instances to terminate per API call
+TERMINATE_BATCH_SIZE = 100
+
 def items(d):
     ks = list(d.keys())
     ks.sort()
@@ -40,6 +47,86 @@ def get_name(tags):
             return tag['Value']
     return None
 
+def chunks(xs, size):
+    for i in range(0, len(xs), size):
+        yield xs[i:i+size]
+
+def get_snapshots(img):
+    return [bdm['Ebs']['SnapshotId']
+            for bdm in img.get('BlockDeviceMappings', [])
+            if 'SnapshotId' in bdm.get('Ebs', {})]
+
+def image_report(img, in_use):
+    """Describe the image and the snapshots that deleting it would reclaim"""
+    return {
+        'image_id': img['ImageId'],
+        'name': img['Name'],
+        'created': img['CreationDate'],
+        'snapshots': [snapshot for snapshot in get_snapshots(img) if snapshot not in in_use],
+        'deregistered': False,
+        'error': None,
+    }
+
+def snapshot_reports(images, reports):
+    """Describe the unique snapshots of the images that can be deleted
+
+    A snapshot can be shared by several of the images (ex: copied AMIs), so
+    it is only reported (and deleted) once.  Snapshots of an image that could
+    not be deregistered are skipped, as the image still uses them.
+
+    Note: Snapshot sizes are the volume size, actual snapshot storage is
+          usually smaller as only used blocks are stored
+
+    Args:
+        images (list[dict]): Images being deleted
+        reports (list[dict]): image_report() for each image
+
+    Returns:
+        (list[dict]): Report for each snapshot
+    """
+    sizes = {bdm['Ebs']['SnapshotId']: bdm['Ebs'].get('VolumeSize', 0)
+             for img in images
+             for bdm in img.get('BlockDeviceMappings', [])
+             if 'SnapshotId' in bdm.get('Ebs', {})}
+
+    still_used = set(snapshot
+                     for img, report in zip(images, reports) if report['error'] is not None
+                     for snapshot in get_snapshots(img))
+
+    snapshots = {}
+    for report in reports:
+        for snapshot in report['snapshots']:
+            if snapshot in still_used:
+                continue
+            if snapshot not in snapshots:
+                snapshots[snapshot] = {
+                    'snapshot_id': snapshot,
+                    'size_gb': sizes[snapshot],
+                    'images': [],
+                    'deleted': False,
+                    'error': None,
+                }
+            snapshots[snapshot]['images'].append(report['image_id'])
+    return [snapshots[snapshot] for snapshot in sorted(snapshots)]
+
+def deregister_image(client, img, in_use):
+    """Deregister the image, its snapshots are deleted separately"""
+    report = image_report(img, in_use)
+    try:
+        client.deregister_image(ImageId = img['ImageId'])
+        report['deregistered'] = True
+    except ClientError as ex:
+        report['error'] = str(ex)
+    return report
+
+def delete_snapshot(client, report):
+    try:
+        client.delete_snapshot(SnapshotId = report['snapshot_id'])
+        report['deleted'] = True
+    except ClientError as ex:
+        report['error'] = str(ex)
+    return report
+
 exclude_regex = []
 def is_excluded(resource):
     for regex in exclude_regex:
@@ -65,6 +152,13 @@ if __name__ == '__main__':
     parser.add_argument('--quiet', '-q',
                         action = 'store_true',
                         help = 'Suppress warnings')
+    parser.add_argument('--workers',
+                        type = int,
+                        default = 8,
+                        help = 'Number of AMIs to delete concurrently')
+    parser.add_argument('--report',
+                        metavar = 'FILE',
+                        help = 'Save a JSON report of the AMIs and the storage reclaimed')
     parser.add_argument('resource',
                         choices = ['ec2', 'sg', 'keypair', 'ami'],
                         help = 'The AWS resource to cleanup')
@@ -86,9 +180,7 @@ if __name__ == '__main__':
         stopped = {}
         unlabled = []
 
-        kwargs = {}
-        while kwargs.get('NextToken', '') is not None:
-            resp = client.describe_instances(**kwargs)
+        for resp in client.get_paginator('describe_instances').paginate():
             for res in resp['Reservations']:
                 for inst in res['Instances']:
                     name = get_name(inst.get('Tags', []))
@@ -101,7 +193,6 @@ if __name__ == '__main__':
                         stopped[name] = inst
                     elif state == 'running':
                         running[name] = inst
-            kwargs['NextToken'] = resp.get('NextToken')
 
         if len(running) == 0:
             console.info("No unexpected running EC2 instances exist")
@@ -115,8 +206,9 @@ if __name__ == '__main__':
             for name, inst in items(running):
                 console.debug('Deleting EC2 instance {} ({})'.format(inst['InstanceId'], name))
             if console.confirm('Are you sure', default = False):
-                for inst in running.values():
-                    client.terminate_instances(InstanceIds = [inst['InstanceId']])
+                ids = [inst['InstanceId'] for inst in running.values()]
+                for batch in chunks(ids, TERMINATE_BATCH_SIZE):
+                    client.terminate_instances(InstanceIds = batch)
         else:
             for name, inst in items(running):
                 console.debug('Instance {} ({})'.format(inst['InstanceId'], name))
@@ -179,16 +271,18 @@ if __name__ == '__main__':
                 console.debug('Deleting keypair: {}'.format(kp['KeyName']))
             if console.confirm('Are you sure', default = False):
                 for kp in packer_keys:
-                    client.delete_key_pair(KeyName = pk['KeyName'])
+                    client.delete_key_pair(KeyName = kp['KeyName'])
         else:
             for kp in packer_keys:
                 console.debug('Packer keypair: {}'.format(kp['KeyName']))
     elif args.resource == 'ami':
         suffix = args.bosslet_config.AMI_SUFFIX
         client = args.bosslet_config.session.client('ec2')
-        resp = client.describe_images(Owners=['self'])
+        images = [img
+                  for resp in client.get_paginator('describe_images').paginate(Owners=['self'])
+                  for img in resp['Images']]
         lookup = {}
-        for img in resp['Images']:
+        for img in images:
             if suffix in img['Name']:
                 name, version = img['Name'].split(suffix)
                 name += suffix
@@ -220,14 +314,57 @@ if __name__ == '__main__':
                 to_delete = [img for img in to_delete if not is_excluded(img['Name'])]
                 all_delete.extend(to_delete)
 
+            # Snapshots can be shared between images (ex: copied AMIs)
+            deleting = set(img['ImageId'] for img in all_delete)
+            in_use = set(snapshot
+                         for img in images if img['ImageId'] not in deleting
+                         for snapshot in get_snapshots(img))
+
+            deleted = False
             if args.delete:
                 for img in all_delete:
                     console.debug('Deleting AMI: {}'.format(img['Name']))
                 if console.confirm('Are you sure', default = False):
-                    for img in all_delete:
-                        client.deregister_image(ImageId = img['ImageId'])
+                    deleted = True
+                    with ThreadPoolExecutor(max_workers = args.workers) as executor:
+                        # Snapshots can only be deleted once every image using them is deregistered
+                        results = list(executor.map(lambda img: deregister_image(client, img, in_use),
+                                                    all_delete))
+                        snapshots = list(executor.map(lambda snap: delete_snapshot(client, snap),
+                                                      snapshot_reports(all_delete, results)))
             else:
                 for img in all_delete:
                     console.debug('Boss AMI: {}'.format(img['Name']))
+
+            if not deleted:
+                results = [image_report(img, in_use) for img in all_delete]
+                snapshots = snapshot_reports(all_delete, results)
+
+            reclaimed = sum(r['size_gb'] for r in snapshots if r['deleted'])
+            if deleted:
+                console.info('Deregistered {} of {} AMIs and deleted {} of {} snapshots ({} GiB)'.format(
+                    len([r for r in results if r['deregistered']]),
+                    len(results),
+                    len([r for r in snapshots if r['deleted']]),
+                    len(snapshots),
+                    reclaimed))
+            for r in results:
+                if r['error'] is not None:
+                    console.error('Problem deregistering AMI {}: {}'.format(r['name'], r['error']))
+            for r in snapshots:
+                if r['error'] is not None:
+                    console.error('Problem deleting snapshot {} of AMI(s) {}: {}'.format(
+                        r['snapshot_id'], ', '.join(r['images']), r['error']))
+
+            if args.report:
+                report = {
+                    'deleted': deleted,
+                    'images': results,
+                    'snapshots': snapshots,
+                    'reclaimed_gb': reclaimed,
+                    'candidate_gb': sum(r['size_gb'] for r in snapshots),
+                }
+                with open(args.report, 'w') as fh:
+                    json.dump(report, fh, indent=2)
     else:
         print("Not supported")
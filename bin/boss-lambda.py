@@ -54,12 +54,27 @@ class LambdaBuildCLI(configuration.BossCLI):
     def get_parser(self, ParentParser=configuration.BossParser):
         self.parser = ParentParser(description = "Script for build lambda code zip",
                                    help = 'Build lambda code zip')
+        self.parser.add_argument('--all',
+                                 action='store_true',
+                                 help='Build the code zips for all lambdas')
+        self.parser.add_argument('--workers',
+                                 type=int,
+                                 default=lambdas.MAX_CONCURRENT_BUILDS,
+                                 help='Number of code zips to build at the same time')
         self.parser.add_bosslet()
         self.parser.add_argument('lambda_name',
-                                 help='Name of lambda to build')
+                                 nargs='*',
+                                 help='Name of lambda(s) to build')
 
     def run(self, args):
-        lambdas.load_lambdas_on_s3(args.bosslet_config, args.lambda_name)
+        if args.all:
+            lambda_names = lambdas.lambda_dirs(args.bosslet_config).keys()
+        else:
+            lambda_names = args.lambda_name
+
+        lambdas.load_all_lambdas_on_s3(args.bosslet_config,
+                                       lambda_names,
+                                       args.workers)
 
 class LambdaFreshenCLI(configuration.BossCLI):
     def get_parser(self, ParentParser=configuration.BossParser):
@@ -85,12 +100,29 @@ class LambdaFreshenCLI(configuration.BossCLI):
         for lambda_name in lambda_names:
             lambdas.freshen_lambda(args.bosslet_config, lambda_name)
 
+class LambdaAnalyzeCLI(configuration.BossCLI):
+    def get_parser(self, ParentParser=configuration.BossParser):
+        self.parser = ParentParser(description = "Script for reporting the uncompressed " +
+                                   "size of a lambda code zip and its layers",
+                                   help = 'Analyze the size of a lambda code zip')
+        self.parser.add_argument('--zip', '-z',
+                                 help='Local code zip to analyze instead of the code zip in S3')
+        self.parser.add_bosslet()
+        self.parser.add_argument('lambda_name',
+                                 help='Name of lambda to analyze')
+
+    def run(self, args):
+        return lambdas.analyze_lambda_zip(args.bosslet_config,
+                                          args.lambda_name,
+                                          args.zip)
+
 class LambdaCLI(configuration.NestedBossCLI):
     COMMANDS = {
         'download': LambdaDownloadCLI,
         'upload': LambdaUploadCLI,
         'build': LambdaBuildCLI,
         'freshen': LambdaFreshenCLI,
+        'analyze': LambdaAnalyzeCLI,
     }
 
     PARSER_ARGS = {
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Script for reporting the performance of a Resolution.Hierarchy (downsample)
+execution.
+
+The execution history is used to find the time spent downsampling each
+resolution level (the RunDownSampleActivity state).  For each level the
+DownsampleVolumeLambda invocation count, errors, and duration percentiles,
+and the number of messages sent to the downsample dead letter topic, are read
+from CloudWatch for the level's time window.
+
+Executions started by the execution (the StartNewSfnInstance lambda starts a
+new Resolution.Hierarchy for the next queued downsample job) are reported too,
+unless --no-children is given.
+
+Note: CloudWatch metrics have a one minute resolution and are not per
+      execution, so the lambda numbers include any other downsamples running
+      at the same time.
+
+Sample usage:
+
+    ./downsample_report.py integration.boss --latest
+    ./downsample_report.py integration.boss arn:aws:states:...:execution:... --json report.json
+"""
+
+import json
+import math
+from datetime import datetime, timedelta
+
+import alter_path
+from lib import configuration
+
+# Name of the Resolution.Hierarchy state that downsamples one resolution level
+DOWNSAMPLE_STATE = 'RunDownSampleActivity'
+
+PERCENTILES = ['p50', 'p90', 'p99']
+
+def get_history(sfn, arn):
+    """Get all of the events in an execution's history"""
+    paginator = sfn.get_paginator('get_execution_history')
+    return [event
+            for page in paginator.paginate(executionArn=arn)
+            for event in page['events']]
+
+def find_levels(events):
+    """
+    Find the time spent in each resolution level of an execution.
+
+    Args:
+        events (list[dict]): Execution history events.
+
+    Returns:
+        (list[dict]): Per level {'resolution', 'start', 'stop', 'attempts'}.
+    """
+    levels = []
+    current = None
+    for event in events:
+        if event['type'] == 'TaskStateEntered' and \
+           event['stateEnteredEventDetails']['name'] == DOWNSAMPLE_STATE:
+            input_ = json.loads(event['stateEnteredEventDetails'].get('input', '{}'))
+            resolution = input_.get('msg', input_).get('resolution', len(levels))
+            current = {'resolution': resolution,
+                       'start': event['timestamp'],
+                       'stop': None,
+                       'attempts': 0}
+            levels.append(current)
+        elif event['type'] == 'ActivityScheduled' and current is not None:
+            current['attempts'] += 1
+        elif event['type'] == 'TaskStateExited' and current is not None and \
+             event['stateExitedEventDetails']['name'] == DOWNSAMPLE_STATE:
+            current['stop'] = event['timestamp']
+            current = None
+    return levels
+
+def find_children(events):
+    """Find the ARNs of executions started by an execution"""
+    children = []
+    for event in events:
+        for details in event.values():
+            if isinstance(details, dict) and 'output' in details:
+                try:
+                    output = json.loads(details['output'])
+                except (TypeError, ValueError):
+                    continue
+                if isinstance(output, dict) and 'executionArn' in output:
+                    children.append(output['executionArn'])
+    return children
+
+def get_metric(cw, namespace, metric, dimensions, start, stop, statistics=None, extended=None):
+    """
+    Get a single datapoint covering the whole window.
+
+    Returns:
+        (dict|None): CloudWatch datapoint, or None if there is no data.
+    """
+    # Align to CloudWatch's one minute resolution
+    start = start.replace(second=0, microsecond=0)
+    period = max(60, int(math.ceil((stop - start).total_seconds() / 60)) * 60)
+
+    kwargs = {}
+    if statistics:
+        kwargs['Statistics'] = statistics
+    if extended:
+        kwargs['ExtendedStatistics'] = extended
+
+    resp = cw.get_metric_statistics(Namespace=namespace,
+                                    MetricName=metric,
+                                    Dimensions=dimensions,
+                                    StartTime=start,
+                                    EndTime=start + timedelta(seconds=period),
+                                    Period=period,
+                                    **kwargs)
+    points = resp['Datapoints']
+    return points[0] if len(points) > 0 else None
+
+def level_metrics(bosslet_config, level, memory):
+    """Add the CloudWatch lambda and DLQ metrics for a level's time window"""
+    names = bosslet_config.names
+    cw = bosslet_config.session.client('cloudwatch')
+    function = [{'Name': 'FunctionName', 'Value': names.downsample_volume.lambda_}]
+    stop = level['stop'] or datetime.now(level['start'].tzinfo)
+
+    invocations = get_metric(cw, 'AWS/Lambda', 'Invocations', function, level['start'], stop, ['Sum'])
+    errors = get_metric(cw, 'AWS/Lambda', 'Errors', function, level['start'], stop, ['Sum'])
+    duration = get_metric(cw, 'AWS/Lambda', 'Duration', function, level['start'], stop,
+                          ['Average', 'Maximum'], PERCENTILES)
+
+    topic = [{'Name': 'TopicName', 'Value': names.downsample_dlq.sns}]
+    dlq = get_metric(cw, 'AWS/SNS', 'NumberOfMessagesPublished', topic, level['start'], stop, ['Sum'])
+
+    level['seconds'] = (stop - level['start']).total_seconds()
+    level['invocations'] = int(invocations['Sum']) if invocations else 0
+    level['errors'] = int(errors['Sum']) if errors else 0
+    level['dlq_messages'] = int(dlq['Sum']) if dlq else 0
+    level['duration_ms'] = {}
+    if duration:
+        level['duration_ms'] = dict(duration.get('ExtendedStatistics', {}),
+                                    avg = duration['Average'],
+                                    max = duration['Maximum'])
+        level['gb_seconds'] = level['invocations'] * duration['Average'] / 1000 * memory / 1024
+
+def report_execution(bosslet_config, arn, children=True):
+    """
+    Build the report for an execution and (optionally) its children.
+
+    Returns:
+        (list[dict]): A report for each execution.
+    """
+    sfn = bosslet_config.session.client('stepfunctions')
+    lambda_ = bosslet_config.session.client('lambda')
+    memory = lambda_.get_function_configuration(
+                FunctionName=bosslet_config.names.downsample_volume.lambda_)['MemorySize']
+
+    reports = []
+    seen = set()
+    pending = [arn]
+    while len(pending) > 0:
+        arn = pending.pop(0)
+        if arn in seen:
+            continue
+        seen.add(arn)
+
+        execution = sfn.describe_execution(executionArn=arn)
+        events = get_history(sfn, arn)
+        levels = find_levels(events)
+        for level in levels:
+            level_metrics(bosslet_config, level, memory)
+
+        reports.append({
+            'execution_arn': arn,
+            'status': execution['status'],
+            'start': execution['startDate'],
+            'stop': execution.get('stopDate'),
+            'lambda_memory': memory,
+            'levels': levels,
+        })
+
+        if children:
+            pending.extend(find_children(events))
+
+    return reports
+
+def latest_execution(bosslet_config):
+    """Find the ARN of the most recent Resolution.Hierarchy execution"""
+    sfn = bosslet_config.session.client('stepfunctions')
+    arn = 'arn:aws:states:{}:{}:stateMachine:{}'.format(bosslet_config.REGION,
+                                                        bosslet_config.ACCOUNT_ID,
+                                                        bosslet_config.names.resolution_hierarchy.sfn)
+    resp = sfn.list_executions(stateMachineArn=arn, maxResults=1)
+    if len(resp['executions']) == 0:
+        raise Exception("No {} executions".format(bosslet_config.names.resolution_hierarchy.sfn))
+    return resp['executions'][0]['executionArn']
+
+def print_report(reports):
+    fmt = '{:>4} {:>10} {:>8} {:>12} {:>7} {:>9} {:>9} {:>9} {:>5}'
+    for report in reports:
+        print('{} ({}, {}MB)'.format(report['execution_arn'], report['status'], report['lambda_memory']))
+        print(fmt.format('Res', 'Wall Time', 'Attempts', 'Invocations', 'Errors',
+                         'p50 ms', 'p90 ms', 'p99 ms', 'DLQ'))
+        for level in report['levels']:
+            duration = level['duration_ms']
+            print(fmt.format(level['resolution'],
+                             str(timedelta(seconds=int(level['seconds']))),
+                             level['attempts'],
+                             level['invocations'],
+                             level['errors'],
+                             *['{:.0f}'.format(duration[p]) if p in duration else '-' for p in PERCENTILES],
+                             level['dlq_messages']))
+        print()
+
+if __name__ == '__main__':
+    parser = configuration.BossParser(description = "Report the performance of a Resolution.Hierarchy execution")
+    parser.add_bosslet()
+    parser.add_argument('execution_arn',
+                        nargs = '?',
+                        default = None,
+                        help = 'ARN of the Resolution.Hierarchy execution')
+    parser.add_argument('--latest',
+                        action = 'store_true',
+                        help = 'Report on the most recent execution')
+    parser.add_argument('--no-children',
+                        action = 'store_true',
+                        help = "Don't report on executions started by the execution")
+    parser.add_argument('--json',
+                        default = None,
+                        help = 'File to save the report to as JSON')
+    args = parser.parse_args()
+
+    if args.execution_arn is None and not args.latest:
+        parser.print_usage()
+        parser.exit(1, 'Error: must specify an execution_arn or --latest\n')
+
+    arn = args.execution_arn or latest_execution(args.bosslet_config)
+    reports = report_execution(args.bosslet_config, arn, not args.no_children)
+    print_report(reports)
+
+    if args.json:
+        with open(args.json, 'w') as fh:
+            json.dump(reports, fh, indent=2, default=str)
@@ -19,6 +19,12 @@ Script that extracts all the messages from the Indexdeadletter queue and
 starts Index.IdWriters for the messages with operation == 'write_id_index'.
 For Index.IdWriters that successfully start, the corresponding message is
 deleted from the queue.
+
+A pool of workers receives and validates the messages.  Step functions are
+started through a token bucket rate limiter, so the id index Dynamo table is
+not overwhelmed.  By default the rate is derived from the table's provisioned
+write capacity.  Use --dry-run to only count the messages in the queue; the
+messages are hidden while they are counted and made visible again afterwards.
 """
 
 import argparse
@@ -26,7 +32,10 @@ import botocore
 import boto3
 import json
 import os
+import threading
 import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from hashlib import md5
 
 import alter_path
@@ -35,12 +44,96 @@ from lib import configuration
 
 MAX_SQS_RECEIVE = 10
 
+# Fraction of the id index table's write capacity to use when starting
+# Index.IdWriters, if --rate is not given
+DEFAULT_UTILIZATION = 0.5
+
+# Seconds messages are hidden while a dry run scans the queue
+DRY_RUN_VISIBILITY = 300
+
+# Rate used if the id index table doesn't have provisioned capacity (on demand)
+DEFAULT_RATE = 10
+
 class CorruptSqsResponseError(Exception):
     """
     Indicate that the response from SQS was corrupted.
     """
     pass
 
+class TokenBucket(object):
+    """
+    Thread safe token bucket rate limiter.
+
+    Tokens are added at a constant rate, up to the capacity of the bucket.
+    Each acquire() removes a token, blocking until one is available.
+    """
+
+    def __init__(self, rate, capacity=None):
+        """
+        Args:
+            rate (float): Tokens added per second.
+            capacity (float): Max number of tokens (burst size), defaults to one second of tokens.
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                time.sleep((1 - self.tokens) / self.rate)
+
+class Summary(object):
+    """
+    Thread safe per outcome message counts.  Messages are counted once, even
+    if they are received multiple times.
+    """
+
+    def __init__(self):
+        self.counts = Counter()
+        self.seen = set()
+        self.hidden = {} # MessageId -> ReceiptHandle of messages kept hidden by a dry run
+        self.lock = threading.Lock()
+
+    def add(self, msg_id, outcome):
+        with self.lock:
+            if (msg_id, outcome) not in self.seen:
+                self.seen.add((msg_id, outcome))
+                self.counts[outcome] += 1
+
+    def hide(self, messages):
+        """
+        Record messages that a dry run keeps hidden until the scan is done.
+
+        Returns:
+            (bool): False if any message was already received, meaning the
+                    whole queue has been scanned.
+        """
+        with self.lock:
+            repeat = False
+            for msg in messages:
+                if msg.get('MessageId') in self.hidden:
+                    repeat = True
+                elif 'ReceiptHandle' in msg:
+                    self.hidden[msg.get('MessageId')] = msg['ReceiptHandle']
+            return not repeat
+
+    def display(self):
+        print()
+        print('{:<70} {:>10}'.format('Outcome', 'Messages'))
+        for outcome, count in sorted(self.counts.items()):
+            print('{:<70} {:>10}'.format(outcome, count))
+
 def check_response(msg):
     """
     Make sure message contains all the expected keys and the MD5 hash is good.
@@ -67,94 +160,215 @@ def check_response(msg):
         raise CorruptSqsResponseError('Message corrupt - MD5 mismatch')
 
 
-def start(bosslet_config, spacing):
+def parse_message(msg):
     """
-    Main entry point of script.  Step functions are started as fast as
-    possible but the first state is a delay.  The spacing argument is added to
-    the total delay time, so the first step function's delay is 0 * spacing.
-    The nth's step function's delay is (n-1) * spacing.
+    Validate a dead letter message and extract the Index.IdWriter input.
+
+    Args:
+        msg (dict): A message contained in the response returned by SQS.Client.receive_message().
+
+    Returns:
+        (dict|None, str): Step function input (None if the message should be
+                          skipped) and the outcome to record in the Summary.
+    """
+    try:
+        check_response(msg)
+    except CorruptSqsResponseError as ex:
+        return None, 'Skipped: {}'.format(ex)
+
+    try:
+        body = json.loads(msg['Body'])
+    except ValueError:
+        return None, 'Skipped: Message body is not JSON'
+
+    if 'operation' not in body:
+        return None, 'Skipped: Message without operation field'
+
+    if body['operation'] != 'write_id_index':
+        return None, 'Skipped: Operation {}'.format(body['operation'])
+
+    result = body.pop('result', None)
+    if result is not None:
+        reason = result.get('Error', 'unknown reasons')
+    else:
+        reason = 'unknown reasons'
+
+    return body, 'Retried: Failed because of {}'.format(reason)
+
+
+def get_rate(bosslet_config, utilization):
+    """
+    Compute the rate to start Index.IdWriters at from the id index table's
+    provisioned write capacity.  Each Index.IdWriter updates a single item,
+    which consumes at least one write capacity unit.
 
     Args:
         bosslet_config (BossConfiguration): Configuration for the target Bosslet
-        spacing (int): Space start of step function's lambda task by this many seconds.
+        utilization (float): Fraction of the write capacity to use.
+
+    Returns:
+        (float): Step functions to start per second.
     """
-    sfn_arn_prefix = 'arn:aws:states:{}:{}:stateMachine:'.format(bosslet_config.REGION,
-                                                                 bosslet_config.ACCOUNT_ID)
-    arn = '{}{}'.format(sfn_arn_prefix, bosslet_config.names.index_id_writer.sfn)
-    queue_name = names.index_deadletter.sqs
+    ddb = bosslet_config.session.client('dynamodb')
+    resp = ddb.describe_table(TableName=bosslet_config.names.id_index.ddb)
+    capacity = resp['Table'].get('ProvisionedThroughput', {}).get('WriteCapacityUnits', 0)
 
-    sqs = bosslet_config.session.client('sqs')
-    resp = sqs.get_queue_url(QueueName=queue_name)
-    queue_url = resp['QueueUrl']
+    if capacity == 0:
+        print('{} has no provisioned write capacity, using {}/s'.format(
+            bosslet_config.names.id_index.ddb, DEFAULT_RATE))
+        return DEFAULT_RATE
 
-    sfn = bosslet_config.session.client('stepfunctions')
+    return capacity * utilization
 
-    wait_secs = 0
 
+def worker(sqs, sfn, queue_url, arn, bucket, summary, dry_run, visibility):
+    """
+    Receive messages from the dead letter queue until it is empty, starting an
+    Index.IdWriter for each valid message.
+
+    Args:
+        sqs (SQS.Client): SQS client shared by all workers.
+        sfn (SFN.Client): Step functions client shared by all workers.
+        queue_url (str): URL of the dead letter queue.
+        arn (str): ARN of Index.IdWriter.
+        bucket (TokenBucket): Rate limiter shared by all workers.
+        summary (Summary): Counts shared by all workers.
+        dry_run (bool): Only count the messages.
+        visibility (int): Visibility timeout used when receiving messages.
+    """
     while True:
         resp = sqs.receive_message(
             QueueUrl=queue_url,
             MaxNumberOfMessages=MAX_SQS_RECEIVE,
             WaitTimeSeconds=5,
-            VisibilityTimeout=60)
+            VisibilityTimeout=visibility)
 
         if 'Messages' not in resp or len(resp['Messages']) == 0:
             break
 
+        processed = []
         for msg in resp['Messages']:
-            try:
-                check_response(msg)
-            except CorruptSqsResponseError as ex:
-                print('Skipping bad message: {}'.format(ex))
+            body, outcome = parse_message(msg)
+            if body is None or dry_run:
+                summary.add(msg.get('MessageId'), outcome)
                 continue
 
-            body = json.loads(msg['Body']) 
-            if 'operation' not in body:
-                print('Skipping message without operation field.')
-                continue
+            bucket.acquire()
+            try:
+                sfn.start_execution(stateMachineArn=arn, input=json.dumps(body))
+                summary.add(msg['MessageId'], outcome)
+                processed.append(msg)
+            except botocore.exceptions.ClientError as ex:
+                code = ex.response['Error']['Code']
+                summary.add(msg['MessageId'], 'Failed to start Index.IdWriter: {}'.format(code))
+
+        if dry_run:
+            # Messages stay hidden until the scan is done, so each receive
+            # returns new messages.  If the visibility timeout expires first a
+            # repeated message means the whole queue has been seen.
+            if not summary.hide(resp['Messages']):
+                break
+            continue
+
+        if len(processed) > 0:
+            entries = [{'Id': str(i), 'ReceiptHandle': msg['ReceiptHandle']}
+                       for i, msg in enumerate(processed)]
+            resp = sqs.delete_message_batch(QueueUrl=queue_url, Entries=entries)
+            for failed in resp.get('Failed', []):
+                msg = processed[int(failed['Id'])]
+                summary.add(msg['MessageId'], 'Failed to delete message: {}'.format(failed['Code']))
+
+
+def reset_visibility(sqs, queue_url, receipt_handles):
+    """
+    Make the messages hidden by a dry run visible again.
 
-            if body['operation'] != 'write_id_index':
-                print('Skipping message with operation: {}'.format(body['operation']))
-                continue
+    Args:
+        sqs (SQS.Client): SQS client.
+        queue_url (str): URL of the dead letter queue.
+        receipt_handles (list[str]): Receipt handles of the hidden messages.
+    """
+    for i in range(0, len(receipt_handles), MAX_SQS_RECEIVE):
+        entries = [{'Id': str(j), 'ReceiptHandle': handle, 'VisibilityTimeout': 0}
+                   for j, handle in enumerate(receipt_handles[i:i + MAX_SQS_RECEIVE])]
+        sqs.change_message_visibility_batch(QueueUrl=queue_url, Entries=entries)
 
-            result = body.pop('result', None)
-            if result is not None:
-                print('Retrying Index.IdWriter that failed because: {}'.format(result['Error']))
-            else:
-                print('Retrying Index.IdWriter that failed because of unknown reasons.') 
 
-            # Stagger startup of Index.IdWriters so Dynamo has more time to scale
-            # if necessary.
-            body['wait_secs'] = wait_secs
+def start(bosslet_config, rate=None, workers=4, dry_run=False, utilization=DEFAULT_UTILIZATION):
+    """
+    Main entry point of script.
 
-            try:
-                sfn.start_execution(stateMachineArn=arn, input=json.dumps(body))
-                wait_secs += spacing
-            except botocore.exception.ClientError as ex:
-                print('Failed to start Index.IdWriter: {}'.format(ex))
-                continue
+    Args:
+        bosslet_config (BossConfiguration): Configuration for the target Bosslet
+        rate (float|None): Max Index.IdWriters to start per second, defaults to a
+                           rate based on the id index table's write capacity.
+        workers (int): Number of concurrent workers receiving messages.
+        dry_run (bool): Only count the messages in the queue.
+        utilization (float): Fraction of the id index table's write capacity to
+                             use if rate is not given.
+
+    Returns:
+        (Summary): Per outcome message counts.
+    """
+    sfn_arn_prefix = 'arn:aws:states:{}:{}:stateMachine:'.format(bosslet_config.REGION,
+                                                                 bosslet_config.ACCOUNT_ID)
+    arn = '{}{}'.format(sfn_arn_prefix, bosslet_config.names.index_id_writer.sfn)
+    queue_url = aws.sqs_lookup_url(bosslet_config.session, bosslet_config.names.index_deadletter.sqs)
 
-            try:
-                sqs.delete_message(QueueUrl=queue_url, ReceiptHandle=msg['ReceiptHandle'])
-            except:
-                print('Failed to delete message {} from queue'.format(
-                    msg['MessageId']))
-                continue
+    if rate is None:
+        rate = get_rate(bosslet_config, utilization)
+    print('Starting Index.IdWriters at up to {:.1f}/s'.format(rate))
+
+    # Keep received messages hidden long enough for the rate limiter to start
+    # all of the workers' messages
+    visibility = max(60, int(2 * workers * MAX_SQS_RECEIVE / rate))
+    if dry_run:
+        # Keep the messages hidden for the whole scan
+        visibility = DRY_RUN_VISIBILITY
+
+    # DP NOTE: Sessions are not thread safe, so the clients are created here.
+    #          Clients are thread safe, so they are shared by the workers
+    sqs = bosslet_config.session.client('sqs')
+    sfn = bosslet_config.session.client('stepfunctions')
+
+    bucket = TokenBucket(rate)
+    summary = Summary()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(worker, sqs, sfn, queue_url, arn, bucket, summary, dry_run, visibility)
+                   for _ in range(workers)]
+        try:
+            for future in futures:
+                future.result()
+        finally:
+            if dry_run:
+                reset_visibility(sqs, queue_url, list(summary.hidden.values()))
+
+    return summary
 
 
 if __name__ == '__main__':
-    parser = configuration.BossParser(description='Script for retrying Index.IdWriters that failed' + 
+    parser = configuration.BossParser(description='Script for retrying Index.IdWriters that failed. ' + 
                                       'To supply arguments from a file, provide the filename prepended with an `@`.',
                                       fromfile_prefix_chars = '@')
     parser.add_bosslet()
-    parser.add_argument('wait_secs',
-                        nargs='?',
+    parser.add_argument('--rate',
+                        type=float,
+                        default=None,
+                        help='Max # of step functions to start per second (default: based on the id index write capacity)')
+    parser.add_argument('--utilization',
+                        type=float,
+                        default=DEFAULT_UTILIZATION,
+                        help='Fraction of the id index write capacity to use if --rate is not given (default: {})'.format(DEFAULT_UTILIZATION))
+    parser.add_argument('--workers',
                         type=int,
-                        default=10,
-                        help='# seconds to space starting of step functions (default: 10)')
+                        default=4,
+                        help='# of concurrent queue readers (default: 4)')
+    parser.add_argument('--dry-run',
+                        action='store_true',
+                        help='Only count the messages in the queue, do not start any step functions')
 
     args = parser.parse_args()
 
-    start(args.bosslet_config, args.wait_secs)
+    summary = start(args.bosslet_config, args.rate, args.workers, args.dry_run, args.utilization)
+    summary.display()
     print('Done.')
-
@@ -20,13 +20,50 @@ A script that manually creates Data Pipelines to restore a backup
 
 import sys
 import os
+import json
 import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from botocore.exceptions import ClientError
+from botocore.validate import validate_parameters
 
 import alter_path
 from lib import aws
+from lib import constants as const
 from lib.datapipeline import DataPipeline, Ref
 from lib.configuration import BossParser
 
+# Written last by ddb.py / rds.py, marks a complete DynamoDB table / RDS backup
+MANIFEST = 'manifest.json'
+
+# Number of concurrent scan segments used when deleting table data
+DDB_DELETE_SEGMENTS = 16
+
+# Seconds between progress messages when deleting table data
+DDB_PROGRESS_INTERVAL = 30
+
+# Seconds between checks on the restore pipelines
+PIPELINE_POLL_MIN = 30
+PIPELINE_POLL_MAX = 300
+
+# Data Pipeline object states
+PIPELINE_FAILED = ('FAILED', 'CASCADE_FAILED', 'TIMEDOUT', 'CANCELED')
+PIPELINE_DONE = ('FINISHED', 'MARKED_FINISHED', 'SKIPPED') + PIPELINE_FAILED
+
+# AWS::DynamoDB::Table properties that map directly to CreateTable arguments
+# DP NOTE: ProvisionedThroughput is taken from the live table, so capacity changed
+#          after the stack was deployed is kept. StreamSpecification and
+#          SSESpecification have different shapes in CloudFormation and are translated
+DDB_CREATE_PROPERTIES = ('KeySchema', 'AttributeDefinitions', 'BillingMode',
+                         'GlobalSecondaryIndexes', 'LocalSecondaryIndexes')
+DDB_INDEX_PROPERTIES = ('IndexName', 'KeySchema', 'Projection', 'ProvisionedThroughput')
+
+# Tag keys with this prefix are reserved for AWS (CloudFormation adds
+# aws:cloudformation:* tags) and are rejected by CreateTable
+AWS_TAG_PREFIX = 'aws:'
+
 def list_s3_bucket(session, bucket, prefix):
     client = session.client('s3')
 
@@ -72,58 +109,289 @@ def vault_pipeline(bosslet_config, directory):
     pipeline.add_s3_bucket("VaultBucket", s3_backup + "/vault")
     return pipeline
 
-def ddb_delete_data(session, table_name):
-    response = None
-
-    ddb = session.resource('dynamodb')
-    tbl = ddb.Table(table_name)
-
+class Counter(object):
+    """Thread safe counter"""
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def add(self, count):
+        with self.lock:
+            self.value += count
+
+def ddb_delete_segment(table, keys, segment, segments, progress):
+    """Delete all of the items in one segment of a parallel scan
+
+    Args:
+        table (DynamoDB.Table): Table resource, owned by the calling thread
+        keys (list[str]): Names of the table's key attributes
+        segment (int): Scan segment to delete
+        segments (int): Total number of scan segments
+        progress (Counter): Shared count of deleted items
+    """
+    kwargs = {
+        'ProjectionExpression': ', '.join('#k{}'.format(i) for i in range(len(keys))),
+        'ExpressionAttributeNames': {'#k{}'.format(i): k for i, k in enumerate(keys)},
+        'Segment': segment,
+        'TotalSegments': segments,
+    }
+
+    # batch_writer resubmits any UnprocessedItems returned by BatchWriteItem
+    # and botocore retries throttled requests
+    with table.batch_writer() as batch:
+        while True:
+            resp = table.scan(**kwargs)
+            for item in resp['Items']:
+                batch.delete_item(Key = item)
+            progress.add(len(resp['Items']))
+
+            if 'LastEvaluatedKey' not in resp:
+                break
+            kwargs['ExclusiveStartKey'] = resp['LastEvaluatedKey']
+
+def ddb_delete_data(session, table_name, segments=DDB_DELETE_SEGMENTS):
+    """Delete all of the items in a table using a parallel scan
+
+    Args:
+        session (Session): boto3.session.Session object
+        table_name (str): Name of the DynamoDB table
+        segments (int): Number of scan segments to delete concurrently
+    """
     print("Deleting data in {} table".format(table_name))
 
-    # Get the current schema keys for the table
-    keys = [k['AttributeName'] for k in tbl.key_schema]
-
-    while response is None or 'LastEvaluatedKey' in response:
-        if response is None:
-            response = tbl.scan()
-        else:
-            response = tbl.scan(ExclusiveStartKey = response['LastEvaluatedKey'])
-
-        for item in response['Items']:
-            # calculate the key for the item, ignoring data elements
-            key = { k: v for k,v in item.items() if k in keys }
-            tbl.delete_item(Key = key)
+    # Resources are not thread safe, so each worker gets its own
+    tables = [session.resource('dynamodb').Table(table_name) for _ in range(segments)]
+    keys = [k['AttributeName'] for k in tables[0].key_schema]
+    print("Approximately {} items".format(tables[0].item_count))
+
+    progress = Counter()
+    with ThreadPoolExecutor(max_workers = segments) as executor:
+        futures = [executor.submit(ddb_delete_segment, tables[i], keys, i, segments, progress)
+                   for i in range(segments)]
+
+        while True:
+            done, pending = wait(futures, timeout = DDB_PROGRESS_INTERVAL)
+            print("Deleted {} items".format(progress.value))
+            if len(pending) == 0:
+                break
+
+    for future in futures:
+        future.result() # raise any exceptions
+
+def live_throughput(description):
+    """Get the ProvisionedThroughput argument for CreateTable from a DescribeTable result"""
+    throughput = description['ProvisionedThroughput']
+    return {'ReadCapacityUnits': throughput['ReadCapacityUnits'],
+            'WriteCapacityUnits': throughput['WriteCapacityUnits']}
+
+def ddb_create_arguments(properties, table, tags):
+    """Build the CreateTable arguments to recreate a table
+
+    Args:
+        properties (dict): AWS::DynamoDB::Table properties from the CloudFormation template
+        table (dict): DescribeTable result for the existing table
+        tags (list[dict]): Tags of the existing table
+
+    Returns:
+        (dict): Keyword arguments for CreateTable
+    """
+    kwargs = {k: v for k, v in properties.items() if k in DDB_CREATE_PROPERTIES}
+    kwargs['TableName'] = table['TableName']
+
+    billing = table.get('BillingModeSummary', {}).get('BillingMode', 'PROVISIONED')
+    kwargs['BillingMode'] = billing
+    if billing == 'PROVISIONED':
+        kwargs['ProvisionedThroughput'] = live_throughput(table)
+
+    live_indexes = {index['IndexName']: index for index in table.get('GlobalSecondaryIndexes', [])}
+    for key in ('GlobalSecondaryIndexes', 'LocalSecondaryIndexes'):
+        if key not in kwargs:
+            continue
 
-def ddb_pipeline(bosslet_config, directory):
+        indexes = []
+        for index in kwargs[key]:
+            index = {k: v for k, v in index.items() if k in DDB_INDEX_PROPERTIES}
+            if key == 'LocalSecondaryIndexes' or billing != 'PROVISIONED':
+                index.pop('ProvisionedThroughput', None)
+            elif index['IndexName'] in live_indexes:
+                index['ProvisionedThroughput'] = live_throughput(live_indexes[index['IndexName']])
+            indexes.append(index)
+        kwargs[key] = indexes
+
+    stream = properties.get('StreamSpecification')
+    if stream is not None:
+        kwargs['StreamSpecification'] = {'StreamEnabled': True,
+                                         'StreamViewType': stream['StreamViewType']}
+
+    sse = properties.get('SSESpecification')
+    if sse is not None:
+        kwargs['SSESpecification'] = {'Enabled': sse['SSEEnabled']}
+        for k in ('SSEType', 'KMSMasterKeyId'):
+            if k in sse:
+                kwargs['SSESpecification'][k] = sse[k]
+
+    tags = [tag for tag in tags if not tag['Key'].startswith(AWS_TAG_PREFIX)]
+    if len(tags) > 0:
+        kwargs['Tags'] = tags
+
+    return kwargs
+
+def ddb_recreate_table(session, table_name):
+    """Delete a table and recreate it from its CloudFormation definition
+
+    Faster than deleting the items in a large table. The definition is read
+    from the deployed template of the stack that owns the table, so the new
+    table matches what CloudFormation expects. The CreateTable arguments are
+    validated before the table is deleted.
+
+    Args:
+        session (Session): boto3.session.Session object
+        table_name (str): Name of the DynamoDB table
+
+    Raises:
+        ParamValidationError: If the table definition is not valid for CreateTable
+    """
+    cf = session.client('cloudformation')
+    ddb = session.client('dynamodb')
+
+    resource = cf.describe_stack_resources(PhysicalResourceId = table_name)['StackResources'][0]
+    template = cf.get_template(StackName = resource['StackName'])['TemplateBody']
+    if isinstance(template, str):
+        template = json.loads(template)
+    properties = template['Resources'][resource['LogicalResourceId']]['Properties']
+
+    table = ddb.describe_table(TableName = table_name)['Table']
+    tags = ddb.list_tags_of_resource(ResourceArn = table['TableArn']).get('Tags', [])
+
+    kwargs = ddb_create_arguments(properties, table, tags)
+    shape = ddb.meta.service_model.operation_model('CreateTable').input_shape
+    validate_parameters(kwargs, shape)
+
+    print("Recreating {} table from stack {}".format(table_name, resource['StackName']))
+    aws.dynamodb_delete_table(session, table_name)
+
+    ddb.create_table(**kwargs)
+    ddb.get_waiter('table_exists').wait(TableName = table_name)
+
+    ttl = properties.get('TimeToLiveSpecification')
+    if ttl is not None:
+        ddb.update_time_to_live(TableName = table_name,
+                                TimeToLiveSpecification = ttl)
+
+def ddb_pipeline(bosslet_config, directory, recreate=False):
     names = bosslet_config.names
     s3_backup = "s3://" + names.backup.s3 + "/" + directory
     s3_log = "s3://" + names.backup.s3 + "/restore-logs/"
 
-    pipeline = DataPipeline(fmt="DP", log_uri = s3_log)
-    pipeline.add_emr_cluster("RestoreCluster", region = bosslet_config.REGION)
-
     tables, _ = list_s3_bucket(bosslet_config.session, names.backup.s3, directory + "/DDB")
-    for table in tables:
-        name = table.split('.', 1)[0]
-        if name == 'vault':
-            name = 'VaultData'
-        pipeline.add_s3_bucket(name + "Bucket", s3_backup + "/DDB/" + table)
-        pipeline.add_ddb_table(name, table)
-        pipeline.add_emr_copy(name+"Copy",
-                              Ref(name + "Bucket"),
-                              Ref(name),
-                              runs_on = Ref("RestoreCluster"),
-                              region = bosslet_config.REGION,
-                              export=False)
+    manifests = [MANIFEST in list_s3_bucket(bosslet_config.session, names.backup.s3, directory + "/DDB/" + table)[1]
+                 for table in tables]
+
+    if len(tables) > 0 and all(manifests):
+        # Backups made by ddb.py
+        cmd = "/usr/local/bin/python3 ~/ddb.py restore {}/DDB {} --region {}".format(
+                s3_backup, " ".join(tables), bosslet_config.REGION)
+        pipeline = DataPipeline(fmt="DP", log_uri = s3_log, resource_role="backup")
+        pipeline.add_shell_command("DDBRestore",
+                                   cmd,
+                                   runs_on = Ref("DDBInstance"))
+        pipeline.add_ec2_instance("DDBInstance",
+                                  type = const.DDB_BACKUP_TYPE,
+                                  subnet = subnet_id_lookup(bosslet_config),
+                                  image = aws.ami_lookup(bosslet_config, names.backup.ami)[0],
+                                  duration = const.DDB_BACKUP_DURATION)
+    else:
+        # Older backups made by an EMR copy
+        pipeline = DataPipeline(fmt="DP", log_uri = s3_log)
+        pipeline.add_emr_cluster("RestoreCluster", region = bosslet_config.REGION)
+
+        for table in tables:
+            name = table.split('.', 1)[0]
+            if name == 'vault':
+                name = 'VaultData'
+            pipeline.add_s3_bucket(name + "Bucket", s3_backup + "/DDB/" + table)
+            pipeline.add_ddb_table(name, table)
+            pipeline.add_emr_copy(name+"Copy",
+                                  Ref(name + "Bucket"),
+                                  Ref(name),
+                                  runs_on = Ref("RestoreCluster"),
+                                  region = bosslet_config.REGION,
+                                  export=False)
 
     for table in tables:
         name = table.split('.', 1)[0]
         resp = input("Delete existing data in {} table? [y/N] ".format(name))
         if resp and len(resp) > 0 and resp[0].lower() == 'y':
-            ddb_delete_data(bosslet_config.session, table)
+            if recreate:
+                ddb_recreate_table(bosslet_config.session, table)
+            else:
+                ddb_delete_data(bosslet_config.session, table)
 
     return pipeline
 
+def watch_pipeline(client, name, id):
+    """Poll a pipeline until all of its object instances have stopped running
+
+    Progress is printed whenever the count of objects in each state changes.
+    The polling delay doubles while nothing changes, up to PIPELINE_POLL_MAX.
+
+    Args:
+        client (DataPipeline.Client): boto3 datapipeline client
+        name (str): Name to use in progress messages
+        id (str): Data Pipeline id
+
+    Returns:
+        (list[str]): Errors from the failed objects, empty if the pipeline succeeded
+    """
+    delay = PIPELINE_POLL_MIN
+    last = None
+    while True:
+        time.sleep(delay)
+
+        try:
+            objects = aws.data_pipeline_objects(client, id)
+        except ClientError as ex:
+            print("{}: problem querying pipeline: {}".format(name, ex))
+            delay = min(delay * 2, PIPELINE_POLL_MAX)
+            continue
+
+        states = {}
+        for obj in objects:
+            state = obj.get('@status', 'PENDING')
+            states[state] = states.get(state, 0) + 1
+
+        if states != last:
+            print("{}: {}".format(name, ', '.join('{} {}'.format(state, count)
+                                                 for state, count in sorted(states.items()))))
+            last = states
+            delay = PIPELINE_POLL_MIN
+        else:
+            delay = min(delay * 2, PIPELINE_POLL_MAX)
+
+        if len(objects) > 0 and all(state in PIPELINE_DONE for state in states):
+            return ["{}: {}".format(obj['@name'], obj.get('@failureReason', obj['@status']))
+                    for obj in objects
+                    if obj['@status'] in PIPELINE_FAILED]
+
+def watch_pipelines(session, pipeline_ids):
+    """Concurrently wait for all of the pipelines to finish
+
+    Args:
+        session (Session): boto3.session.Session object
+        pipeline_ids (dict): Mapping of pipeline name to Data Pipeline id
+
+    Returns:
+        (dict): Mapping of pipeline name to list of errors
+    """
+    if len(pipeline_ids) == 0:
+        return {}
+
+    client = session.client('datapipeline') # clients are thread safe
+    with ThreadPoolExecutor(max_workers = len(pipeline_ids)) as executor:
+        futures = {name: executor.submit(watch_pipeline, client, name, id)
+                   for name, id in pipeline_ids.items()}
+        return {name: future.result() for name, future in futures.items()}
+
 def rds_pipeline(bosslet_config, directory, component, rds_name):
     names = bosslet_config.names
     subnet = subnet_id_lookup(bosslet_config)
@@ -138,14 +406,23 @@ def rds_pipeline(bosslet_config, directory, component, rds_name):
         return None
 
     pipeline = DataPipeline(fmt="DP", log_uri = s3_log, resource_role="backup")
-    pipeline.add_shell_command("RDSRestore",
-                               "bash ~/rds.sh restore {}".format(rds_name),
-                               source = Ref("RDSBucket"),
-                               runs_on = Ref("RDSInstance"))
     pipeline.add_ec2_instance("RDSInstance",
                               subnet = subnet,
                               image = aws.ami_lookup(bosslet_config, names.backup.ami)[0])
-    pipeline.add_s3_bucket("RDSBucket", s3_backup + "/RDS/" + rds_name)
+    if MANIFEST in data:
+        # Backups made by rds.py
+        cmd = "/usr/local/bin/python3 ~/rds.py restore {} {}/RDS/{} --region {}".format(
+                rds_name, s3_backup, rds_name, bosslet_config.REGION)
+        pipeline.add_shell_command("RDSRestore",
+                                   cmd,
+                                   runs_on = Ref("RDSInstance"))
+    else:
+        # Older backups made by rds.sh
+        pipeline.add_shell_command("RDSRestore",
+                                   "bash ~/rds.sh restore {}".format(rds_name),
+                                   source = Ref("RDSBucket"),
+                                   runs_on = Ref("RDSInstance"))
+        pipeline.add_s3_bucket("RDSBucket", s3_backup + "/RDS/" + rds_name)
 
     return pipeline
 
@@ -168,6 +445,9 @@ if __name__ == '__main__':
                         metavar = "<ami-version>",
                         default = "latest",
                         help = "The AMI version to use when selecting images (default: latest)")
+    parser.add_argument("--recreate-tables",
+                        action = "store_true",
+                        help = "Delete and recreate DynamoDB tables instead of deleting their data")
     parser.add_bosslet()
     parser.add_argument("backup_date", help="Year and week of the backup to restore (format: YYYY-ww")
     parser.add_argument("type",
@@ -188,7 +468,7 @@ if __name__ == '__main__':
 
     bosslet_config.ami_version = args.ami_version
 
-    pipeline_ids = []
+    pipeline_ids = {}
     pipeline_args = (bosslet_config, args.backup_date)
     print("Creating and activating restoration data pipelines")
     for name, build in [
@@ -196,7 +476,7 @@ if __name__ == '__main__':
                         #       restored before the other restores are executed
                         ('vault', vault_pipeline),
 
-                        ('dynamo', ddb_pipeline),
+                        ('dynamo', lambda *a: ddb_pipeline(*a, recreate = args.recreate_tables)),
                         ('endpoint', endpoint_rds_pipeline),
                         ('auth', auth_rds_pipeline)
                        ]:
@@ -208,19 +488,27 @@ if __name__ == '__main__':
             continue
 
         id = aws.create_data_pipeline(bosslet_config.session,
-                                      name + '-restore.' + bosslet_config.INTERNAL_DOMAIN
+                                      name + '-restore.' + bosslet_config.INTERNAL_DOMAIN,
                                       pipeline)
         if id is None:
             print("Problem creating {} pipeline, cannot restore".format(name))
             continue
 
         aws.activate_data_pipeline(bosslet_config.session, id)
-        pipeline_ids.append(id)
+        pipeline_ids[name] = id
 
     print("Pipelines all activated, waiting for restore to finish...")
-    # Cannot currently find a method to query pipeline execution status that will
-    # tell us when they are finished
-    input("Press any key to delete pipelines, after verifying that they have finished")
-
-    for id in pipeline_ids:
-        aws.delete_data_pipeline(bosslet_config.session, id)
+    errors = watch_pipelines(bosslet_config.session, pipeline_ids)
+
+    for name, id in pipeline_ids.items():
+        if len(errors[name]) == 0:
+            print("Deleting {} pipeline".format(name))
+            aws.delete_data_pipeline(bosslet_config.session, id)
+
+    failed = [name for name in pipeline_ids if len(errors[name]) > 0]
+    if len(failed) > 0:
+        for name in failed:
+            print("Errors restoring {} (pipeline {}):".format(name, pipeline_ids[name]))
+            for error in errors[name]:
+                print("\t> {}".format(error))
+        sys.exit(1)
@@ -18,26 +18,46 @@
 By default, start the annotation indexing of a channel.  Invokes the 
 Index.FindCuboids step function on the given channel.
 
+Many channels can be indexed with the --channels flag or by only giving a
+collection name.  Channels are started as capacity allows, and the state of
+the batch is saved so an interrupted batch can be continued.
+
 Can also stop a running indexing process or resume one that's been stopped via
-the --stop and --resume flags, respectively.
+the --stop and --resume flags, respectively, or display the progress of a
+running indexing process with the --status flag.
 """
 
 import argparse
 import boto3
 import os
+import sys
 import json
-from collections import namedtuple
+import time
+from collections import namedtuple, deque, Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 
 import alter_path
+from lib import aws
+from lib import boss_rds
 from lib import configuration
-
-# When this number of number of write units is consumed updating an entry in
-# the id index, a new entry will be created to reduce the cost of adding
-# additional morton ids to that id.
-NEW_CHUNK_THRESHOLD = 100
+from lib import index_tuning
 
 RESOLUTION = 0
 
+# Batch mode concurrency limits.  Approximate id index write capacity used by
+# indexing a single channel, and the dead letter queue depths at which fewer /
+# no new channels are started.
+MAX_CONCURRENT_CHANNELS = 8
+WRITE_CAPACITY_PER_CHANNEL = 200
+DEADLETTER_THROTTLE_DEPTH = 100
+DEADLETTER_PAUSE_DEPTH = 1000
+
+# Seconds a channel can be draining before batch mode stops starting new
+# channels, so that the indexing process can go idle and the draining
+# channels can finish.
+DRAIN_HOLD = 3600
+
 # Format string for building the first part of step function's arn.
 SFN_ARN_PREFIX_FORMAT = 'arn:aws:states:{}:{}:stateMachine:'
 
@@ -102,16 +122,19 @@ def get_lookup_key_from_db(bosslet_config, channel_params):
         coll_set[0][0], exp_set[0][0], chan_set[0][0], RESOLUTION)
 
 
-def get_common_args(bosslet_config):
+def get_common_args(bosslet_config, params=None):
     """
     Get common arguments for starting step functions related to indexing.
 
     Args:
         bosslet_config (BossConfiguration): Bosslet configuration object
+        params (dict|None): Fan-out parameters from index_tuning.tune_params(),
+                            defaults to index_tuning.DEFAULT_PARAMS.
 
     Returns:
         (dict): Arguments.
     """
+    params = dict(index_tuning.DEFAULT_PARAMS, **(params or {}))
     account = bosslet_config.ACCOUNT_ID
     sfn_arn_prefix = SFN_ARN_PREFIX_FORMAT.format(bosslet_config.REGION,
                                                   bosslet_config.ACCOUNT_ID)
@@ -128,7 +151,7 @@ def get_common_args(bosslet_config):
             "s3_index_table": n.s3_index.ddb,
             "id_index_table": n.id_index.ddb,
             "s3_flush_queue": 'https://queue.amazonaws.com/{}/{}'.format(account, n.s3flush.sqs),
-            "id_index_new_chunk_threshold": NEW_CHUNK_THRESHOLD,
+            "id_index_new_chunk_threshold": params['id_index_new_chunk_threshold'],
             "index_deadletter_queue": make_sqs_url(account, n.index_deadletter.sqs),
             "index_cuboids_keys_queue": make_sqs_url(account, n.index_cuboids_keys.sqs)
           },
@@ -143,27 +166,29 @@ def get_common_args(bosslet_config):
           }
         },
         "fanout_id_writers_step_fcn": '{}{}'.format(sfn_arn_prefix, n.index_fanout_id_writers.sfn),
-        "id_chunk_size": 20,
+        "id_chunk_size": params['id_chunk_size'],
         "id_cuboid_supervisor_step_fcn": '{}{}'.format(sfn_arn_prefix, n.index_cuboid_supervisor.sfn),
         "id_find_cuboids_step_fcn": f'{sfn_arn_prefix}{n.index_find_cuboids.sfn}',
         "id_index_step_fcn": '{}{}'.format(sfn_arn_prefix, n.index_id_writer.sfn),
         "index_ids_sqs_url": make_sqs_url(account, n.index_ids_queue.sqs),
         # Max number of cuboid keys to pull from s3index Dynamo table in 1 request.
-        "max_items": 200,
+        "max_items": params['max_items'],
         # Number of object ids to include in a single SQS message.
-        "num_ids_per_msg": 20,
-        "wait_time": 5,
+        "num_ids_per_msg": params['num_ids_per_msg'],
+        "wait_time": params['wait_time'],
     }
 
     return common_args
 
 
-def get_start_args(bosslet_config, lookup_key):
+def get_start_args(bosslet_config, lookup_key, params=None):
     """
     Get all arguments needed to start Index.FindCuboids.
 
     Args:
         bosslet_config (BossConfiguration): Bosslet configuration object
+        lookup_key (str): Lookup key of the channel.
+        params (dict|None): Fan-out parameters, see get_common_args().
 
     Returns:
         (str, str): [0] is the ARN of Index.FindCuboids; [1] are the step function arguments as a JSON string.
@@ -173,23 +198,22 @@ def get_start_args(bosslet_config, lookup_key):
                                                   bosslet_config.ACCOUNT_ID)
     arn = '{}{}'.format(sfn_arn_prefix, bosslet_config.names.index_start.sfn)
 
-    find_cuboid_args = get_common_args(bosslet_config)
+    find_cuboid_args = get_common_args(bosslet_config, params)
     find_cuboid_args['lookup_key'] = lookup_key
     return arn, json.dumps(find_cuboid_args)
 
 
-def get_running_step_fcns(bosslet_config, arn):
+def get_running_step_fcns(sfn, arn):
     """
     Retrive execution arns of running step functions.
 
     Args:
-        bosslet_config (BossConfiguration): Bosslet configuration object
+        sfn (StepFunctions.Client): Step functions client.
         arn (str): Specifies step function of interest.
 
     Yields:
         (str): Execution arn of running step function.
     """
-    sfn = bosslet_config.session.client('stepfunctions')
     list_args = dict(
         stateMachineArn=arn, statusFilter='RUNNING', maxResults=100)
 
@@ -224,49 +248,715 @@ def start_indexing(bosslet_config, args):
                                             channel_params) 
         print('lookup_key is: {}'.format(lookup_key))
 
-    start_args = get_start_args(bosslet_config, lookup_key)
-    #print(start_args[1])
+    params = tune_channel(bosslet_config, lookup_key) if args.tune else None
 
     print('Starting Index.Start . . .')
+    resp = start_execution(bosslet_config, lookup_key, params)
+    print(resp)
+
+
+def tune_channel(bosslet_config, lookup_key):
+    """
+    Pick fan-out parameters for the channel by sampling the s3index table.
+
+    Args:
+        bosslet_config (BossConfiguration): Bosslet configuration object
+        lookup_key (str): Lookup key of the channel.
+
+    Returns:
+        (dict): Fan-out parameters.
+    """
+    profile = index_tuning.estimate_channel(bosslet_config, lookup_key)
+    params = index_tuning.tune_params(profile)
+
+    print('{}: {}{} cuboids, {} ids per cuboid ({} sampled)'.format(
+        lookup_key,
+        '' if profile['cuboids_exact'] else 'at least ',
+        profile['cuboids'],
+        'unknown' if profile['ids_per_cuboid'] is None else '{:.1f}'.format(profile['ids_per_cuboid']),
+        profile['sampled']))
+    for key, value in params.items():
+        print('    {:<30} {:>6} (default {})'.format(key, value, index_tuning.DEFAULT_PARAMS[key]))
+
+    return params
+
+
+def start_execution(bosslet_config, lookup_key, params=None):
+    """
+    Start Index.Start for the given channel.
+
+    Args:
+        bosslet_config (BossConfiguration): Bosslet configuration object
+        lookup_key (str): Lookup key of the channel.
+        params (dict|None): Fan-out parameters, see get_common_args().
+
+    Returns:
+        (dict): Response from StepFunctions.Client.start_execution().
+    """
+    start_args = get_start_args(bosslet_config, lookup_key, params)
+    #print(start_args[1])
+
     sfn = bosslet_config.session.client('stepfunctions')
-    resp = sfn.start_execution(
+    return sfn.start_execution(
         stateMachineArn=start_args[0],
         input=start_args[1]
     )
-    print(resp)
 
 
-def resume_indexing(bosslet_config):
+def get_collection_channels(cursor, collection):
+    """
+    Get all of the annotation channels in a collection.
+
+    Args:
+        cursor: Connection to the endpoint DB.
+        collection (str): Collection name.
+
+    Returns:
+        (list[str]): Channels as 'collection/experiment/channel'.
+    """
+    query = ("SELECT e.name, ch.name FROM channel ch "
+             "JOIN experiment e ON ch.experiment_id = e.id "
+             "JOIN collection c ON e.collection_id = c.id "
+             "WHERE c.name = %s AND ch.type = 'annotation' AND ch.to_be_deleted IS NULL "
+             "ORDER BY e.name, ch.name")
+    cursor.execute(query, (collection,))
+    return ['{}/{}/{}'.format(collection, exp, chan) for exp, chan in cursor.fetchall()]
+
+
+def resolve_lookup_keys(bosslet_config, channels=None, collection=None):
+    """
+    Resolve the lookup keys of many channels using a single DB session.
+
+    Args:
+        bosslet_config (BossConfiguration): Bosslet configuration object
+        channels (list[str]|None): Channels as 'collection/experiment/channel'.
+        collection (str|None): Collection name, to index all of its annotation channels.
+
+    Returns:
+        (dict): Channel => lookup key.
+    """
+    keys = {}
+    with bosslet_config.call.connect_rds() as cursor:
+        if collection is not None:
+            channels = get_collection_channels(cursor, collection)
+
+        for channel in channels:
+            if len(channel.split('/')) != 3:
+                raise ValueError("Channel '{}' is not in the form collection/experiment/channel".format(channel))
+
+            lookup_key = boss_rds.sql_resource_lookup_key_cursor(bosslet_config, channel, cursor)
+            keys[channel] = '{}&{}'.format(lookup_key, RESOLUTION)
+    return keys
+
+
+def get_concurrency_cap(bosslet_config, max_concurrent):
+    """
+    Compute the number of channels that can be indexed at the same time.
+
+    The cap is based on the id index table's provisioned write capacity and
+    is reduced while messages are collecting in the index dead letter queue,
+    which indicates that the id index table is being throttled.
+
+    Args:
+        bosslet_config (BossConfiguration): Bosslet configuration object
+        max_concurrent (int): Upper limit for the cap.
+
+    Returns:
+        (int, str): Concurrency cap and the reason for it.
+    """
+    ddb = bosslet_config.session.client('dynamodb')
+    resp = ddb.describe_table(TableName=bosslet_config.names.id_index.ddb)
+    capacity = resp['Table'].get('ProvisionedThroughput', {}).get('WriteCapacityUnits', 0)
+
+    if capacity == 0: # On demand table
+        cap = max_concurrent
+        reason = 'on demand id index'
+    else:
+        cap = max(1, min(max_concurrent, capacity // WRITE_CAPACITY_PER_CHANNEL))
+        reason = '{} WCU id index'.format(capacity)
+
+    dlq = bosslet_config.names.index_deadletter.sqs
+    sqs = bosslet_config.session.client('sqs')
+    depth = get_queue_depths(sqs, get_queue_urls(bosslet_config, [dlq]))[dlq]['visible']
+    if depth >= DEADLETTER_PAUSE_DEPTH:
+        return 0, '{} dead letters, paused'.format(depth)
+    elif depth >= DEADLETTER_THROTTLE_DEPTH:
+        return max(1, cap // 2), '{}, {} dead letters'.format(reason, depth)
+    return cap, reason
+
+
+def load_batch_state(state_file):
+    if state_file is None or not os.path.exists(state_file):
+        return {}
+    with open(state_file) as fh:
+        return json.load(fh)
+
+
+def save_batch_state(state_file, state):
+    # Write to a temporary file first, so an interrupt cannot corrupt the state
+    with open(state_file + '.tmp', 'w') as fh:
+        json.dump(state, fh, indent=2)
+    os.replace(state_file + '.tmp', state_file)
+
+
+def get_execution_history(sfn, arn):
+    """Get all of the events in an execution's history"""
+    paginator = sfn.get_paginator('get_execution_history')
+    return [event
+            for page in paginator.paginate(executionArn=arn)
+            for event in page['events']]
+
+
+def find_started_execution(sfn, arn, state_machine_arn):
+    """
+    Find the execution of a state machine started by an execution (through
+    the startSfnLambda).
+
+    Args:
+        sfn (StepFunctions.Client): Step functions client.
+        arn (str): Execution arn to search the history of.
+        state_machine_arn (str): State machine of the started execution.
+
+    Returns:
+        (str|None): Execution arn of the started execution.
+    """
+    prefix = state_machine_arn.replace(':stateMachine:', ':execution:') + ':'
+    for event in get_execution_history(sfn, arn):
+        for details in event.values():
+            if isinstance(details, dict) and 'output' in details:
+                try:
+                    output = json.loads(details['output'])
+                except (TypeError, ValueError):
+                    continue
+                if isinstance(output, dict) and \
+                   str(output.get('executionArn', '')).startswith(prefix):
+                    return output['executionArn']
+    return None
+
+
+def parse_lookup_key(key):
+    """
+    Get the lookup key from a lookup key or a cuboid object key.
+
+    Args:
+        key (str|None): Lookup key ('<coll>&<exp>&<chan>&<res>') or cuboid
+                        object key ('<hash>&<coll>&<exp>&<chan>&<res>&<t>&<morton>').
+
+    Returns:
+        (str|None): Lookup key, or None if the key has neither format.
+    """
+    if not isinstance(key, str):
+        return None
+
+    parts = key.split('&')
+    if len(parts) == 4:
+        return key
+    elif len(parts) >= 7:
+        return '&'.join(parts[1:5])
+    return None
+
+
+def get_failed_lookup_keys(bosslet_config, since):
+    """
+    Find the channels that the failed downstream executions (EnqueueCuboids,
+    CuboidSupervisor, FanoutIdWriters, IdWriter) started since the given time
+    belonged to.
+
+    The channel is taken from the lookup key or the cuboid object key in the
+    execution's input.
+
+    Args:
+        bosslet_config (BossConfiguration): Bosslet configuration object
+        since (datetime): Only check executions started after this time.
+
+    Returns:
+        (dict): Execution arn => lookup key, or None if the execution could
+                not be matched to a channel.
+    """
+    sfn = bosslet_config.session.client('stepfunctions')
+    n = bosslet_config.names
+    step_fcns = get_index_step_fcns(bosslet_config)
+    downstream = [n.index_enqueue_cuboids.sfn,
+                  n.index_cuboid_supervisor.sfn,
+                  n.index_fanout_id_writers.sfn,
+                  n.index_id_writer.sfn]
+
+    failures = {}
+    for name in downstream:
+        paginator = sfn.get_paginator('list_executions')
+        pages = paginator.paginate(stateMachineArn=step_fcns[name], statusFilter='FAILED')
+        for exe in (exe for page in pages for exe in page['executions']):
+            if exe['startDate'] < since:
+                break # Executions are listed newest first
+
+            input_ = json.loads(sfn.describe_execution(executionArn=exe['executionArn'])['input'])
+            key = (input_.get('lookup_key') or
+                   input_.get('cuboid_object_key') or
+                   input_.get('cuboid', {}).get('object-key', {}).get('S'))
+            failures[exe['executionArn']] = parse_lookup_key(key)
+    return failures
+
+
+def channel_failures(failures, lookup_key):
+    """Number of failures from get_failed_lookup_keys() for the channel"""
+    return sum(1 for key in failures.values() if key == lookup_key)
+
+
+def batch_indexing(bosslet_config, channels=None, collection=None, state_file=None,
+                   max_concurrent=MAX_CONCURRENT_CHANNELS, interval=60, retry_failed=False,
+                   tune=False, drain_hold=DRAIN_HOLD):
+    """
+    Index many channels, starting an Index.Start for each channel while
+    limiting the number of channels being indexed at the same time.
+
+    A channel moves through these states:
+        pending: Not started yet.
+        running: Index.Start or its chain of Index.FindCuboids executions is
+                 still running, enqueuing the channel's cuboids.
+        draining: All cuboids are enqueued, the rest of the indexing process
+                  (EnqueueCuboids, CuboidSupervisor, IdWriter) is still working
+                  through them.
+        succeeded / failed: Done.
+
+    Running and draining channels count against the cap.  The indexing queues
+    and downstream executions are shared by all channels, and a queued
+    message cannot be matched to its channel, so draining channels are
+    finished once the indexing queues are empty and no indexing step functions
+    are running.  To bound that wait, once a channel has been draining for
+    drain_hold seconds no new channels are started until the draining
+    channels finish.  Channels therefore finish in groups.
+
+    A channel fails if any of its executions failed.  Failed downstream
+    executions that cannot be matched to a channel are reported separately
+    and do not fail any channel.
+
+    The state of each channel is saved to state_file after every change, so
+    that an interrupted batch can be continued by running the same command
+    again.
+
+    Args:
+        bosslet_config (BossConfiguration): Bosslet configuration object
+        channels (list[str]|None): Channels as 'collection/experiment/channel'.
+        collection (str|None): Collection name, to index all of its annotation channels.
+        state_file (str): File to save the state of each channel to.
+        max_concurrent (int): Max number of channels to index at the same time.
+        interval (int): Seconds between checks of the running executions.
+        retry_failed (bool): Restart channels that failed in a previous run.
+        tune (bool): Pick the fan-out parameters for each channel, see tune_channel().
+        drain_hold (int): Seconds a channel can be draining before new channels are held.
+
+    Returns:
+        (bool): If all channels were indexed successfully.
+    """
+    state = load_batch_state(state_file)
+
+    new = [c for c in (channels or []) if c not in state]
+    if collection is not None or len(new) > 0:
+        print('Resolving lookup keys . . .')
+        keys = resolve_lookup_keys(bosslet_config, new, collection)
+        for channel, lookup_key in keys.items():
+            if channel not in state:
+                state[channel] = {'lookup_key': lookup_key, 'status': 'pending'}
+        save_batch_state(state_file, state)
+
+    if retry_failed:
+        for channel in state.values():
+            if channel['status'] == 'failed':
+                channel['status'] = 'pending'
+                channel.pop('error', None)
+
+    find_cuboids_arn = get_index_step_fcns(bosslet_config)[bosslet_config.names.index_find_cuboids.sfn]
+    sfn = bosslet_config.session.client('stepfunctions')
+    unmatched = set() # Failed executions that cannot be matched to a channel
+    while True:
+        for name, channel in state.items():
+            if channel['status'] != 'running':
+                continue
+
+            resp = sfn.describe_execution(executionArn=channel['execution_arn'])
+            if resp['status'] == 'RUNNING':
+                continue
+            elif resp['status'] != 'SUCCEEDED':
+                channel.update(status = 'failed',
+                               error = '{} {}'.format(channel['execution_arn'], resp['status']),
+                               finished = resp['stopDate'].isoformat())
+                print('{}: {}'.format(name, channel['error']))
+                continue
+
+            # Follow Index.Start -> Index.FindCuboids -> Index.FindCuboids ...
+            child = find_started_execution(sfn, channel['execution_arn'], find_cuboids_arn)
+            if child is not None:
+                channel['execution_arn'] = child
+            else:
+                channel.update(status = 'draining',
+                               draining = datetime.now(timezone.utc).isoformat())
+                print('{}: All cuboids enqueued'.format(name))
+
+        draining = [c for c in state.values() if c['status'] == 'draining']
+        if len(draining) > 0 and indexing_done(take_snapshot(bosslet_config)):
+            since = min(datetime.fromisoformat(c['started']) for c in draining)
+            failures = get_failed_lookup_keys(bosslet_config, since)
+            finished = datetime.now(timezone.utc).isoformat()
+            for name, channel in state.items():
+                if channel['status'] != 'draining':
+                    continue
+
+                count = channel_failures(failures, channel['lookup_key'])
+                if count > 0:
+                    channel.update(status = 'failed',
+                                   error = '{} failed executions'.format(count))
+                else:
+                    channel['status'] = 'succeeded'
+                channel['finished'] = finished
+                print('{}: {}'.format(name, channel.get('error', 'SUCCEEDED')))
+
+            for arn, key in failures.items():
+                if key is None and arn not in unmatched:
+                    unmatched.add(arn)
+                    print('Failed execution not matched to a channel: {}'.format(arn))
+
+        active = [c for c in state.values() if c['status'] in ('running', 'draining')]
+        pending = [n for n, c in state.items() if c['status'] == 'pending']
+        if len(active) == 0 and len(pending) == 0:
+            break
+
+        cap, reason = get_concurrency_cap(bosslet_config, max_concurrent)
+        now = datetime.now(timezone.utc)
+        held = [c for c in state.values()
+                if c['status'] == 'draining' and
+                   'draining' in c and # Channels from a state file without the field
+                   (now - datetime.fromisoformat(c['draining'])).total_seconds() >= drain_hold]
+        if len(held) > 0:
+            cap, reason = 0, '{} channels draining for over {}s, holding'.format(len(held), drain_hold)
+
+        for name in pending[:max(0, cap - len(active))]:
+            if tune and 'params' not in state[name]:
+                state[name]['params'] = tune_channel(bosslet_config, state[name]['lookup_key'])
+            resp = start_execution(bosslet_config, state[name]['lookup_key'], state[name].get('params'))
+            state[name].update(status = 'running',
+                               execution_arn = resp['executionArn'],
+                               started = resp['startDate'].isoformat())
+            print('{}: Started {}'.format(name, resp['executionArn']))
+        save_batch_state(state_file, state)
+
+        counts = Counter(c['status'] for c in state.values())
+        print('{} pending, {} running, {} draining (cap {}: {}), {} succeeded, {} failed'.format(
+            counts['pending'], counts['running'], counts['draining'], cap, reason,
+            counts['succeeded'], counts['failed']))
+
+        time.sleep(interval)
+
+    save_batch_state(state_file, state)
+    failed = [n for n, c in state.items() if c['status'] == 'failed']
+    for name in failed:
+        print('Failed: {} ({})'.format(name, state[name].get('error')))
+    if len(unmatched) > 0:
+        print('{} failed executions could not be matched to a channel:'.format(len(unmatched)))
+        for arn in sorted(unmatched):
+            print('    {}'.format(arn))
+    return len(failed) == 0
+
+
+def get_index_queues(bosslet_config):
+    """
+    Get the queues that feed the indexing process.  Both are connected to the
+    start step function lambda, which starts a step function for each message.
+
+    Args:
+        bosslet_config (BossConfiguration): Bosslet configuration object
+
+    Returns:
+        (list[str]): Queue names.
+    """
+    n = bosslet_config.names
+    return [n.index_cuboids_keys.sqs, n.index_ids_queue.sqs]
+
+
+def get_index_step_fcns(bosslet_config):
+    """
+    Get the ARNs of the step functions used by the indexing process.
+
+    Args:
+        bosslet_config (BossConfiguration): Bosslet configuration object
+
+    Returns:
+        (dict): Step function name => ARN.
+    """
+    sfn_arn_prefix = SFN_ARN_PREFIX_FORMAT.format(bosslet_config.REGION,
+                                                  bosslet_config.ACCOUNT_ID)
+    n = bosslet_config.names
+    names = [n.index_start.sfn,
+             n.index_find_cuboids.sfn,
+             n.index_enqueue_cuboids.sfn,
+             n.index_cuboid_supervisor.sfn,
+             n.index_fanout_id_writers.sfn,
+             n.index_id_writer.sfn]
+    return { name: '{}{}'.format(sfn_arn_prefix, name) for name in names }
+
+
+def get_queue_urls(bosslet_config, queue_names):
     """
-    Rework required.  Probably want to reconnect cuboids keys queue and the
-    ids queues to their respective lambdas to resume.
+    Look up the urls of the given queues.
 
     Args:
         bosslet_config (BossConfiguration): Bosslet configuration object
+        queue_names (list[str]): Queues to look up.
+
+    Returns:
+        (dict): Queue name => url.
+    """
+    return { name: aws.sqs_lookup_url(bosslet_config.session, name)
+             for name in queue_names }
+
+
+def get_queue_depths(sqs, queue_urls):
     """
-    #resume_args = get_common_args(bosslet_config)
-    raise NotImplementedError()
+    Get the approximate number of messages in the given queues.
 
+    Args:
+        sqs (SQS.Client): SQS client.
+        queue_urls (dict): Queue name => url, from get_queue_urls().
 
-def stop_indexing(bosslet_config):
+    Returns:
+        (dict): Queue name => {'visible': int, 'in_flight': int}.
     """
-    This needs to be reworked.  Once the cuboid keys queue is populated, the
-    process is going to spawn many more step functions.  Probably want to
-    temporary disable the lambda event source connections of the cuboid keys
-    queue and the ids queue to stop progress.
+    depths = {}
+    for name, url in queue_urls.items():
+        resp = sqs.get_queue_attributes(
+            QueueUrl=url,
+            AttributeNames=['ApproximateNumberOfMessages',
+                            'ApproximateNumberOfMessagesNotVisible'])
+        depths[name] = {
+            'visible': int(resp['Attributes']['ApproximateNumberOfMessages']),
+            'in_flight': int(resp['Attributes']['ApproximateNumberOfMessagesNotVisible']),
+        }
+    return depths
+
+
+def take_snapshot(bosslet_config):
+    """
+    Record the queue depths and running executions of the indexing process.
 
     Args:
         bosslet_config (BossConfiguration): Bosslet configuration object
+
+    Returns:
+        (dict): {'time': str, 'queues': {...}, 'executions': {name: count}}.
     """
-    #stop_args = get_common_args(bosslet_config)
+    queues = get_index_queues(bosslet_config) + [bosslet_config.names.index_deadletter.sqs]
+    queue_urls = get_queue_urls(bosslet_config, queues)
+    step_fcns = get_index_step_fcns(bosslet_config)
+
+    # Sessions are not thread safe, so the clients are created before the
+    # workers start and shared (clients are thread safe)
+    sfn = bosslet_config.session.client('stepfunctions')
+    sqs = bosslet_config.session.client('sqs')
 
-    # This error could optionally be caught inside a step function if special
-    # shutdown behavior required.
-    #error = 'ManualAbort'
-    #cause = 'User initiated abort'
+    # Paginating through the running executions of each state machine is the
+    # slow part, so the state machines are counted concurrently
+    count = lambda arn: sum(1 for _ in get_running_step_fcns(sfn, arn))
+    with ThreadPoolExecutor(max_workers=len(step_fcns) + 1) as pool:
+        depths = pool.submit(get_queue_depths, sqs, queue_urls)
+        counts = { name: pool.submit(count, arn) for name, arn in step_fcns.items() }
 
-    #print('Done.')
-    raise NotImplementedError()
+        return {
+            'time': datetime.now(timezone.utc).isoformat(),
+            'queues': depths.result(),
+            'executions': { name: future.result() for name, future in counts.items() },
+        }
+
+
+def print_snapshot(snapshot):
+    """
+    Print a snapshot from take_snapshot().
+
+    Args:
+        snapshot (dict): Snapshot to display.
+    """
+    print('Snapshot at {}'.format(snapshot['time']))
+    for name, depth in snapshot['queues'].items():
+        print('    {:<40} {:>10} messages ({} in flight)'.format(
+            name, depth['visible'], depth['in_flight']))
+    for name, count in snapshot['executions'].items():
+        print('    {:<40} {:>10} running'.format(name, count))
+
+
+def compute_rates(window):
+    """
+    Compute the processing rate and ETA of each queue over a window of
+    snapshots.
+
+    Args:
+        window (list[dict]): Snapshots from take_snapshot(), oldest first.
+
+    Returns:
+        (dict): Queue name => {'depth': int, 'rate': float|None, 'eta': float|None}.
+                Rate is messages removed per second (negative if the queue
+                is growing) and ETA is the seconds until the queue is empty.
+    """
+    first, last = window[0], window[-1]
+    elapsed = (datetime.fromisoformat(last['time']) -
+               datetime.fromisoformat(first['time'])).total_seconds()
+
+    depth = lambda snapshot, name: (snapshot['queues'][name]['visible'] +
+                                    snapshot['queues'][name]['in_flight'])
+
+    rates = {}
+    for name in last['queues']:
+        current = depth(last, name)
+        rate = None
+        eta = None
+        if elapsed > 0:
+            rate = (depth(first, name) - current) / elapsed
+            if rate > 0:
+                eta = current / rate
+        rates[name] = {'depth': current, 'rate': rate, 'eta': eta}
+    return rates
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return '-'
+    return str(timedelta(seconds=int(seconds)))
+
+
+def print_status(snapshot, rates):
+    """
+    Print the status table for one snapshot.
+
+    Args:
+        snapshot (dict): Latest snapshot from take_snapshot().
+        rates (dict): Result of compute_rates().
+    """
+    print('Indexing status at {}'.format(snapshot['time']))
+    print()
+    print('{:<40} {:>10} {:>10} {:>10} {:>10}'.format('Queue', 'Messages', 'In Flight', 'Msgs/s', 'ETA'))
+    for name, depth in snapshot['queues'].items():
+        rate = rates[name]['rate']
+        print('{:<40} {:>10} {:>10} {:>10} {:>10}'.format(
+            name,
+            depth['visible'],
+            depth['in_flight'],
+            '-' if rate is None else '{:.1f}'.format(rate),
+            format_duration(rates[name]['eta'])))
+    print()
+    print('{:<40} {:>10}'.format('Step Function', 'Running'))
+    for name, count in snapshot['executions'].items():
+        print('{:<40} {:>10}'.format(name, count))
+
+
+def indexing_done(snapshot):
+    """Whether all of the queues (except the dead letter queue) are empty and
+    no step functions are running"""
+    return (all(depth['visible'] + depth['in_flight'] == 0
+                for name, depth in snapshot['queues'].items()
+                if 'deadletter' not in name.lower()) and
+            all(count == 0 for count in snapshot['executions'].values()))
+
+
+def monitor_indexing(bosslet_config, interval=30, window=10, json_file=None, once=False):
+    """
+    Display the progress of a running indexing process until it finishes.
+
+    Args:
+        bosslet_config (BossConfiguration): Bosslet configuration object
+        interval (int): Seconds between polls.
+        window (int): Number of polls used to compute the rates and ETAs.
+        json_file (str|None): File to append each snapshot to, as JSON lines.
+        once (bool): Only poll once.
+    """
+    samples = deque(maxlen=max(window, 2))
+
+    try:
+        while True:
+            snapshot = take_snapshot(bosslet_config)
+            samples.append(snapshot)
+            rates = compute_rates(list(samples))
+
+            if sys.stdout.isatty() and not once:
+                print('\033[2J\033[H', end='') # Clear the screen
+            print_status(snapshot, rates)
+
+            if json_file is not None:
+                with open(json_file, 'a') as fh:
+                    fh.write(json.dumps(dict(snapshot, rates=rates)) + '\n')
+
+            if once:
+                break
+
+            if indexing_done(snapshot):
+                print()
+                print('Indexing complete')
+                break
+
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+
+
+def set_queues_enabled(bosslet_config, enabled):
+    """
+    Enable or disable the event source mappings between the indexing queues
+    and the start step function lambda.
+
+    Args:
+        bosslet_config (BossConfiguration): Bosslet configuration object
+        enabled (bool): Whether the queues should be connected.
+    """
+    session = bosslet_config.session
+    lambda_name = bosslet_config.names.start_sfn.lambda_
+    for queue in get_index_queues(bosslet_config):
+        print('{} {} => {}'.format('Enabling' if enabled else 'Disabling', queue, lambda_name))
+        arn = aws.sqs_lookup_arn(session, queue)
+        aws.lambda_enable_sqs(session, lambda_name, arn, enabled=enabled)
+
+
+def resume_indexing(bosslet_config, snapshot_file=None):
+    """
+    Resume an indexing process stopped with stop_indexing() by reconnecting
+    the cuboid keys queue and the ids queue to their lambda.  Work continues
+    from the messages still in the queues, so the s3index table is not
+    rescanned.
+
+    Args:
+        bosslet_config (BossConfiguration): Bosslet configuration object
+        snapshot_file (str|None): Snapshot saved by stop_indexing() to compare against.
+    """
+    if snapshot_file is not None:
+        with open(snapshot_file) as fh:
+            print('Stopped at:')
+            print_snapshot(json.load(fh))
+
+    snapshot = take_snapshot(bosslet_config)
+    print_snapshot(snapshot)
+
+    set_queues_enabled(bosslet_config, True)
+    print('Done.')
+
+
+def stop_indexing(bosslet_config, snapshot_file=None):
+    """
+    Pause an indexing process by disabling the lambda event source
+    connections of the cuboid keys queue and the ids queue.  No new
+    Index.CuboidSupervisor or Index.IdWriter step functions are started, and
+    queued messages are kept so the process can be resumed.  Step functions
+    that are already running will finish.
+
+    Args:
+        bosslet_config (BossConfiguration): Bosslet configuration object
+        snapshot_file (str|None): File to save the queue depths and running executions to.
+    """
+    set_queues_enabled(bosslet_config, False)
+
+    snapshot = take_snapshot(bosslet_config)
+    print_snapshot(snapshot)
+
+    if snapshot_file is not None:
+        with open(snapshot_file, 'w') as fh:
+            json.dump(snapshot, fh, indent=2)
+        print('Saved snapshot to {}'.format(snapshot_file))
+
+    print('Done. Running step functions will finish, use --resume to continue indexing.')
 
 
 def parse_args():
@@ -292,6 +982,55 @@ def parse_args():
         '--resume',
         action='store_true',
         help='Resume indexing operation (if CuboidKeys queue still has messages, indexing will resume)')
+    parser.add_argument(
+        '--channels',
+        nargs='+',
+        default=None,
+        metavar='COLL/EXP/CHAN',
+        help='Index multiple channels (batch mode)')
+    parser.add_argument(
+        '--state',
+        default=None,
+        help='Batch mode state file, used to continue an interrupted batch (default: run_indexing.<bosslet>.json)')
+    parser.add_argument(
+        '--max-concurrent',
+        type=int,
+        default=MAX_CONCURRENT_CHANNELS,
+        help='Max # of channels to index at once in batch mode (default: {})'.format(MAX_CONCURRENT_CHANNELS))
+    parser.add_argument(
+        '--retry-failed',
+        action='store_true',
+        help='Restart channels that failed in a previous batch run')
+    parser.add_argument(
+        '--tune',
+        action='store_true',
+        help='Pick fan-out parameters for each channel by sampling the s3index table')
+    parser.add_argument(
+        '--status',
+        action='store_true',
+        help='Display the progress of a running indexing operation')
+    parser.add_argument(
+        '--interval',
+        type=int,
+        default=30,
+        help='Seconds between --status polls and batch mode checks (default: 30)')
+    parser.add_argument(
+        '--window',
+        type=int,
+        default=10,
+        help='Number of --status polls used to compute rates and ETAs (default: 10)')
+    parser.add_argument(
+        '--once',
+        action='store_true',
+        help='Only poll --status once')
+    parser.add_argument(
+        '--json',
+        default=None,
+        help='File to append each --status poll to as JSON lines, for graphing')
+    parser.add_argument(
+        '--snapshot',
+        default=None,
+        help='File to save queue depths and running executions to on --stop, or compare with on --resume')
     parser.add_bosslet("Bosslet name where the lambda functions live")
     parser.add_argument(
         'collection',
@@ -311,12 +1050,19 @@ def parse_args():
 
     args = parser.parse_args()
 
-    if args.stop and args.resume:
+    if sum([args.stop, args.resume, args.status]) > 1:
         parser.print_usage()
         parser.exit(
-            1, 'Error: cannot specify --stop and --resume simultaneously')
+            1, 'Error: can only specify one of --stop, --resume, and --status')
+
+    # Only a collection name means index the whole collection
+    args.batch = (args.channels is not None or
+                  (args.lookup_key is None and args.collection is not None and args.experiment is None))
+    if args.batch and args.state is None:
+        args.state = 'run_indexing.{}.json'.format(args.bosslet_name)
 
-    if (args.lookup_key is None and not args.stop and not args.resume and
+    if (args.lookup_key is None and not args.stop and not args.resume and not args.status and
+        not args.batch and
         (args.collection is None or args.experiment is None or args.channel is None)
     ):
         parser.print_usage()
@@ -334,9 +1080,16 @@ if __name__ == '__main__':
     args = parse_args()
 
     if args.stop:
-        stop_indexing(args.bosslet_config)
+        stop_indexing(args.bosslet_config, args.snapshot)
     elif args.resume:
-        resume_indexing(args.bosslet_config)
+        resume_indexing(args.bosslet_config, args.snapshot)
+    elif args.status:
+        monitor_indexing(args.bosslet_config, args.interval, args.window, args.json, args.once)
+    elif args.batch:
+        collection = args.collection if args.channels is None else None
+        if not batch_indexing(args.bosslet_config, args.channels, collection, args.state,
+                              args.max_concurrent, args.interval, args.retry_failed, args.tune):
+            sys.exit(1)
     else:
         start_indexing(args.bosslet_config, args)
 
@@ -15,140 +15,233 @@
 # limitations under the License.
 
 """
-Simple script to scale up/down ASG. 
-DO NOT USE ON PRODUCTION. 
-
-Order of scaling up:
-    bastion 
-    vault 
-    activities
-    endpoint
-    cachemanager
-
-Order of scaling down:
-    cachemanager
-    endpoint
-    activities
-    vault
-    bastion
+Simple script to scale up/down ASG.
+DO NOT USE ON PRODUCTION.
+
+The order of scaling is described by SCALE_PLAN. When scaling up a service is
+started once all of the services it runs after are ready, and services that
+don't depend on each other are scaled at the same time:
+
+    bastion -> vault -> endpoint
+                     -> activities
+                     -> cachemanager
+
+Scaling down follows the same edges in reverse.
+
+A service is ready once its health check passes:
+    vault: Vault responds to a status check (through the bastion)
+    ASGs behind a load balancer: all instances are healthy in the target group / ELB
+    Other ASGs: the desired number of instances are InService
+    EC2 instances: the instance status checks pass
 """
 
-import boto3
 import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
 import alter_path
 from lib import configuration
 
 PRODUCTION = ["bossdb.boss"]
 
+# Service -> how it is scaled and the services it must run after
+SCALE_PLAN = {
+    'bastion': {'type': 'ec2', 'after': []},
+    'vault': {'type': 'asg', 'after': ['bastion']},
+    'endpoint': {'type': 'asg', 'after': ['vault']},
+    'activities': {'type': 'asg', 'after': ['vault']},
+    'cachemanager': {'type': 'ec2', 'after': ['vault']},
+}
+
+# Seconds between readiness checks
+POLL_INTERVAL = 15
+
+# Seconds to wait for a service to become ready
+DEFAULT_TIMEOUT = 900
+
+class Scaler(object):
+    """Scales the services of a bosslet and waits for them to be ready"""
+
+    def __init__(self, bosslet_config, timeout=DEFAULT_TIMEOUT):
+        self.bosslet_config = bosslet_config
+        self.timeout = timeout
+        self.start = time.time()
+
+        # Clients are thread safe, so they are shared between the workers
+        session = bosslet_config.session
+        self.ec2 = session.client('ec2')
+        self.asg = session.client('autoscaling')
+        self.elb = session.client('elb')
+        self.elbv2 = session.client('elbv2')
+
+    def log(self, service, msg):
+        print("[{:>4}s] {}: {}".format(int(time.time() - self.start), service, msg))
+
+    def hostname(self, service):
+        return getattr(self.bosslet_config.names, service).dns
+
+    def lookup_asgs(self):
+        """Find the ASGs for the plan's services using the instance Name tag
+
+        Returns:
+            (dict): Mapping of service to ASG description
+        """
+        hostnames = {self.hostname(service): service
+                     for service, step in SCALE_PLAN.items()
+                     if step['type'] == 'asg'}
+
+        asgs = {}
+        for page in self.asg.get_paginator('describe_auto_scaling_groups').paginate():
+            for asg in page['AutoScalingGroups']:
+                for tag in asg['Tags']:
+                    if tag['Key'] == 'Name' and tag['Value'] in hostnames:
+                        asgs[hostnames[tag['Value']]] = asg
+
+        for hostname, service in hostnames.items():
+            if service not in asgs:
+                raise Exception(f"Could not locate the ASG for {hostname}")
+            # Check if any of the ASGs have suspended processes. Abort if they do.
+            if asgs[service]['SuspendedProcesses']:
+                raise Exception(f"Suspended Processes set for ASG {asgs[service]['AutoScalingGroupName']}. Aborting.")
+        return asgs
+
+    def lookup_instances(self):
+        """Find the EC2 instance ids for the plan's non-ASG services
+
+        Returns:
+            (dict): Mapping of service to instance id
+        """
+        instances = {}
+        for service, step in SCALE_PLAN.items():
+            if step['type'] != 'ec2':
+                continue
+
+            hostname = self.hostname(service)
+            # Filters out the instances that were previously terminated but have the same name.
+            filters = [{'Name': 'tag:Name', 'Values': [hostname]},
+                       {'Name': 'instance-state-name', 'Values': ['pending', 'running', 'stopping', 'stopped']}]
+            ids = [inst['InstanceId']
+                   for page in self.ec2.get_paginator('describe_instances').paginate(Filters=filters)
+                   for res in page['Reservations']
+                   for inst in res['Instances']]
+            if len(ids) == 0:
+                raise Exception(f"Could not locate the EC2 instance {hostname}")
+            instances[service] = ids[0]
+        return instances
+
+    def wait_for(self, service, check):
+        """Poll check() until it returns True or the timeout expires"""
+        deadline = time.time() + self.timeout
+        while not check():
+            if time.time() > deadline:
+                raise Exception(f"Timeout waiting for {service}")
+            time.sleep(POLL_INTERVAL)
+
+    def scale_ec2(self, service, instance_id, up):
+        if up:
+            self.log(service, "starting")
+            self.ec2.start_instances(InstanceIds=[instance_id])
+            waiter = self.ec2.get_waiter('instance_status_ok')
+        else:
+            self.log(service, "stopping")
+            self.ec2.stop_instances(InstanceIds=[instance_id])
+            waiter = self.ec2.get_waiter('instance_stopped')
+
+        waiter.wait(InstanceIds=[instance_id],
+                    WaiterConfig={'Delay': POLL_INTERVAL,
+                                  'MaxAttempts': max(1, self.timeout // POLL_INTERVAL)})
+
+    def asg_instances(self, name):
+        asg = self.asg.describe_auto_scaling_groups(AutoScalingGroupNames=[name])['AutoScalingGroups'][0]
+        return asg['Instances']
+
+    def asg_healthy(self, asg, capacity):
+        instances = [inst['InstanceId']
+                     for inst in self.asg_instances(asg['AutoScalingGroupName'])
+                     if inst['LifecycleState'] == 'InService']
+        if len(instances) < capacity:
+            return False
+
+        for arn in asg.get('TargetGroupARNs', []):
+            health = self.elbv2.describe_target_health(TargetGroupArn=arn)['TargetHealthDescriptions']
+            healthy = [t['Target']['Id'] for t in health if t['TargetHealth']['State'] == 'healthy']
+            if not all(inst in healthy for inst in instances):
+                return False
+
+        for name in asg.get('LoadBalancerNames', []):
+            health = self.elb.describe_instance_health(LoadBalancerName=name)['InstanceStates']
+            healthy = [i['InstanceId'] for i in health if i['State'] == 'InService']
+            if not all(inst in healthy for inst in instances):
+                return False
+
+        return True
+
+    def scale_asg(self, service, asg, up):
+        capacity = 1 if up else 0
+        name = asg['AutoScalingGroupName']
+        self.log(service, "scaling {} to {}".format("up" if up else "down", capacity))
+        self.asg.update_auto_scaling_group(AutoScalingGroupName=name,
+                                           MinSize=capacity,
+                                           MaxSize=capacity,
+                                           DesiredCapacity=capacity)
+
+        if not up:
+            self.wait_for(service, lambda: len(self.asg_instances(name)) == 0)
+        else:
+            self.wait_for(service, lambda: self.asg_healthy(asg, capacity))
+            if service == 'vault':
+                self.bosslet_config.call.check_vault(self.timeout)
+
+    def run(self, up, asg_only=False):
+        """Execute the scale plan
+
+        Args:
+            up (bool): If the services should be scaled up or down
+            asg_only (bool): Only scale the ASGs, leave the EC2 instances as they are
+        """
+        asgs = self.lookup_asgs()
+        instances = {} if asg_only else self.lookup_instances()
+
+        # For scaling down, a service waits on the services that run after it
+        deps = {service: set() for service in SCALE_PLAN}
+        for service, step in SCALE_PLAN.items():
+            for after in step['after']:
+                if up:
+                    deps[service].add(after)
+                else:
+                    deps[after].add(service)
+
+        def scale(service):
+            if SCALE_PLAN[service]['type'] == 'asg':
+                self.scale_asg(service, asgs[service], up)
+            elif asg_only:
+                return
+            else:
+                self.scale_ec2(service, instances[service], up)
+            self.log(service, "ready" if up else "stopped")
+
+        done = set()
+        pending = set(SCALE_PLAN)
+        with ThreadPoolExecutor(max_workers=len(SCALE_PLAN)) as executor:
+            running = {}
+            while pending or running:
+                for service in sorted(pending):
+                    if deps[service] <= done:
+                        running[executor.submit(scale, service)] = service
+                        pending.remove(service)
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    service = running.pop(future)
+                    future.result() # raise any errors, stopping the plan
+                    done.add(service)
+
 def scale_stack(args):
     if args.bosslet_name in PRODUCTION:
         raise Exception("Cannot scale down production environment.")
-    
-    session = args.bosslet_config.session
-    
-    ### Get instance ids and ASG ids 
-
-    ## EC2 Instances
-    instances = (f"cachemanager.{args.bosslet_name}", f"bastion.{args.bosslet_name}")
-    ec2_client = session.client('ec2')
-    if not args.asg_only:
-        instance_ids = {x: get_instance_id(ec2_client, x) for x in instances}
-
-    ## AutoScalingGroups
-    asg_client = session.client('autoscaling')
-    response = asg_client.describe_auto_scaling_groups()['AutoScalingGroups']
-    
-    # Filter those that belong to bosslet
-    bosslet_id = args.bosslet_name.split('.')[0].lower()
-    bosslet_asg = {}
-    for asg in response:
-        if bosslet_id in asg['AutoScalingGroupName'].lower() and 'auth' not in asg['AutoScalingGroupName'].lower():
-            key = asg['AutoScalingGroupName'].split('-')[1].lower()
-            bosslet_asg[key] = asg['AutoScalingGroupName']
 
-            # Check if any of the ASGs have suspended processes. Abort if they do.
-            if asg['SuspendedProcesses']:
-                raise Exception(f"Suspended Processes set for ASG {asg['AutoScalingGroupName']}. Aborting.")
-
-    if args.mode == 'up':
-        print("Starting bastion")
-        if not args.asg_only:
-            ec2_client.start_instances(InstanceIds=[instance_ids[f"bastion.{args.bosslet_name}"]])
-            time.sleep(1)
-
-        print("Waiting for bastion to initialize")
-        wait_for_instance(ec2_client, f"bastion.{args.bosslet_name}")
-
-        print("Scaling up vault")
-        asg_client.update_auto_scaling_group(AutoScalingGroupName=bosslet_asg['vault'], MinSize=1, MaxSize=1, DesiredCapacity=1)
-        time.sleep(1)
-
-        print("Waiting for vault to initialize")
-        wait_for_instance(ec2_client, f"vault.{args.bosslet_name}")
-
-        print("Scaling up endpoint") 
-        asg_client.update_auto_scaling_group(AutoScalingGroupName=bosslet_asg['endpoint'], MinSize=1, MaxSize=1, DesiredCapacity=1)
-        time.sleep(1)
-        
-        print("Scaling up activities")
-        asg_client.update_auto_scaling_group(AutoScalingGroupName=bosslet_asg['activities'], MinSize=1, MaxSize=1, DesiredCapacity=1)
-        time.sleep(1)
-
-        print("Starting cachemanager")
-        if not args.asg_only:
-            ec2_client.start_instances(InstanceIds=[instance_ids[f"cachemanager.{args.bosslet_name}"]])
-            time.sleep(1)          
-    else:
-        print("Stopping cachemanager")
-        if not args.asg_only:
-            ec2_client.stop_instances(InstanceIds=[instance_ids[f"cachemanager.{args.bosslet_name}"]])
-            time.sleep(1)
-
-        print("Scaling down activties")
-        asg_client.update_auto_scaling_group(AutoScalingGroupName=bosslet_asg['activities'], MinSize=0, MaxSize=0, DesiredCapacity=0)
-        time.sleep(1)
-
-        print("Scaling down endpoint") 
-        asg_client.update_auto_scaling_group(AutoScalingGroupName=bosslet_asg['endpoint'], MinSize=0, MaxSize=0, DesiredCapacity=0)
-        time.sleep(1)
-
-        print("Scaling down vault")
-        asg_client.update_auto_scaling_group(AutoScalingGroupName=bosslet_asg['vault'], MinSize=0, MaxSize=0, DesiredCapacity=0)
-        time.sleep(1)
-
-        print("Stopping bastion")
-        if not args.asg_only:
-            ec2_client.stop_instances(InstanceIds=[instance_ids[f"bastion.{args.bosslet_name}"]])
-            time.sleep(1)
-        
+    Scaler(args.bosslet_config, args.timeout).run(args.mode == 'up', args.asg_only)
     print('Done!')
 
-def get_instance_id(ec2_client, instance_name):
-    resp = ec2_client.describe_instances(Filters=[{"Name":"tag:Name", "Values": [instance_name]}])['Reservations']
-    return resp[0]['Instances'][0]['InstanceId']
-
-def wait_for_instance(ec2_client, instance_name):
-
-    # Filters out the instances that were previously terminated but have the same name.
-    filters = [
-        {
-            'Name': "tag:Name",
-            'Values': [instance_name], 
-        },
-        {
-            'Name': 'instance-state-name',
-            'Values': ['pending', 'running', 'stopped']
-        }
-    ]
-
-    waiter = ec2_client.get_waiter('instance_running')
-    waiter.wait(
-        Filters= filters,
-        WaiterConfig={
-            'Delay': 5
-        }
-    )
-
 if __name__ == '__main__':
     parser = configuration.BossParser(description='Script to scale up or down all EC2 autoscale groups for a BossDB stack.')
     parser.add_bosslet()
@@ -157,9 +250,12 @@ if __name__ == '__main__':
                         help="'up' to set capacities to 1, 'down' to set capacities to 0." )
     parser.add_argument('--asg-only', '-a',
                         action = 'store_true',
-                        help = 'Only scale down ASG instances, keep cachemanager and bastion up.', 
+                        help = 'Only scale down ASG instances, keep cachemanager and bastion up.',
                         default=False)
-    args = parser.parse_args() 
+    parser.add_argument('--timeout',
+                        type = int,
+                        default = DEFAULT_TIMEOUT,
+                        help = 'Seconds to wait for each service to be ready (default: {})'.format(DEFAULT_TIMEOUT))
+    args = parser.parse_args()
     scale_stack(args)
 
-
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Offline simulator for comparing annotation indexing fan-out parameters.
+
+Models the SQS messages, step function executions, and id index DynamoDB
+writes needed to index a channel of the given size and id density, using the
+default parameters, the parameters run_indexing.py --tune would pick, and any
+number of custom parameter sets.  No AWS resources are accessed.
+
+Sample usage:
+
+    ./simulate_indexing.py 100000 250
+    ./simulate_indexing.py 100000 250 --set num_ids_per_msg=50 --set num_ids_per_msg=50,wait_time=1
+    ./simulate_indexing.py 100000 250 --write-capacity 2000 --json
+"""
+
+import argparse
+import json
+
+import alter_path
+from lib import index_tuning
+
+ROWS = [
+    'find_cuboids_pages',
+    'cuboid_messages',
+    'id_messages',
+    'cuboid_supervisor_executions',
+    'id_writer_executions',
+    'state_transitions',
+    'sqs_requests',
+    'id_updates',
+    'id_index_entries',
+    'write_units',
+    'fanout_seconds',
+    'id_writer_seconds',
+    'seconds',
+    'cost',
+]
+
+def parse_set(value):
+    """Parse a 'key=value,key=value' parameter set"""
+    params = {}
+    for item in value.split(','):
+        key, _, val = item.partition('=')
+        if key not in index_tuning.DEFAULT_PARAMS:
+            raise argparse.ArgumentTypeError('Unknown parameter: {}'.format(key))
+        params[key] = int(val)
+    return params
+
+def print_table(columns):
+    names = list(columns)
+    fmt = '{:<30}' + ' {:>14}' * len(names)
+    print(fmt.format('', *names))
+    for key in index_tuning.DEFAULT_PARAMS:
+        print(fmt.format(key, *(columns[name]['params'][key] for name in names)))
+    print()
+    for row in ROWS:
+        if row in columns[names[0]]['result']:
+            print(fmt.format(row, *(columns[name]['result'][row] for name in names)))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Simulate annotation indexing with different fan-out parameters")
+    parser.add_argument('cuboids', type = int,
+                        help = 'Number of cuboids in the channel')
+    parser.add_argument('ids_per_cuboid', type = float,
+                        help = 'Average number of ids in each cuboid')
+    parser.add_argument('--cuboids-per-id', type = float, default = None,
+                        help = 'Average number of cuboids each id is in (default: ids_per_cuboid)')
+    parser.add_argument('--write-capacity', type = int, default = None,
+                        help = 'Id index write units per second, to estimate the duration')
+    parser.add_argument('--set', type = parse_set, action = 'append', default = [],
+                        metavar = 'KEY=VALUE[,KEY=VALUE]',
+                        help = 'Custom parameter set to compare (can be given multiple times)')
+    parser.add_argument('--json', action = 'store_true',
+                        help = 'Output the results as JSON')
+    args = parser.parse_args()
+
+    profile = {
+        'cuboids': args.cuboids,
+        'cuboids_exact': True,
+        'ids_per_cuboid': args.ids_per_cuboid,
+        'sampled': 0,
+    }
+    param_sets = {
+        'default': dict(index_tuning.DEFAULT_PARAMS),
+        'tuned': index_tuning.tune_params(profile),
+    }
+    for i, params in enumerate(args.set):
+        param_sets['custom {}'.format(i + 1)] = dict(index_tuning.DEFAULT_PARAMS, **params)
+
+    columns = {}
+    for name, params in param_sets.items():
+        result = index_tuning.simulate(args.cuboids,
+                                       args.ids_per_cuboid,
+                                       params,
+                                       cuboids_per_id = args.cuboids_per_id,
+                                       write_capacity = args.write_capacity)
+        columns[name] = {'params': params, 'result': result}
+
+    if args.json:
+        print(json.dumps(columns, indent=2))
+    else:
+        print_table(columns)
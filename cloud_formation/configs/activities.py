@@ -35,7 +35,7 @@ from lib import utils
 from lib import aws
 from lib import constants as const
 from lib import stepfunctions as sfn
-from lib.lambdas import load_lambdas_on_s3, update_lambda_code
+from lib.lambdas import load_all_lambdas_on_s3, update_lambda_code, freshen_lambda
 
 def STEP_FUNCTIONS(bosslet_config):
     names = bosslet_config.names
@@ -146,13 +146,13 @@ def create_config(bosslet_config, lookup=True):
                                min=1,
                                max=1)
 
+    # DP NOTE: Built as a code zip, as the code no longer fits within the
+    #          4KB limit for inline lambda code
     config.add_lambda("IngestLambda",
                       names.ingest_lambda.lambda_,
                       aws.role_arn_lookup(session, 'IngestQueueUpload'),
-                      const.INGEST_LAMBDA,
-                      handler="index.handler",
+                      handler="ingest_queue_upload.handler",
                       timeout=60 * 5,
-                      runtime='python3.7',
                       memory=3008)
 
     config.add_lambda_permission("IngestLambdaExecute", Ref("IngestLambda"))
@@ -213,13 +213,16 @@ def create(bosslet_config):
     post_init(bosslet_config)
 
 def pre_init(bosslet_config):
-    """Build multilambda zip file and put in S3."""
-    load_lambdas_on_s3(bosslet_config)
+    """Build multilambda and ingest upload zip files and put in S3."""
+    names = bosslet_config.names
+    load_all_lambdas_on_s3(bosslet_config, [names.multi_lambda.lambda_,
+                                            names.ingest_lambda.lambda_])
 
 def update(bosslet_config):
     if console.confirm('Build multilambda', default = True):
         pre_init(bosslet_config)
         update_lambda_code(bosslet_config)
+        freshen_lambda(bosslet_config, bosslet_config.names.ingest_lambda.lambda_)
 
     config = create_config(bosslet_config)
     config.update()
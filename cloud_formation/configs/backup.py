@@ -30,17 +30,19 @@ from lib.vault import POLICY_DIR as VAULT_POLICY_DIR
 import os
 import random
 
-def rds_copy(rds_name, subnet, image, s3_logs, s3_backup):
+def rds_copy(rds_name, subnet, image, s3_logs, s3_backup, region):
+    # DP NOTE: rds.py writes the backup directly to S3, so the
+    #          command doesn't need a staged output bucket
+    cmd = "/usr/local/bin/python3 ~/rds.py backup {} {}/RDS/{} --region {}".format(
+            rds_name, s3_backup, rds_name, region)
     pipeline = DataPipeline(log_uri = s3_logs, resource_role="backup")
     pipeline.add_ec2_instance("RDSInstance",
                               subnet = subnet,
                               image = image)
-    pipeline.add_s3_bucket("RDSBucket", s3_backup + "/RDS/" + rds_name)
     pipeline.add_shell_command("RDSBackup",
-                               "bash ~/rds.sh backup {}".format(rds_name),
-                               destination = Ref("RDSBucket"),
+                               cmd,
                                runs_on = Ref("RDSInstance"))
-                               
+
     return pipeline
 
 def create_config(bosslet_config):
@@ -111,18 +113,19 @@ def create_config(bosslet_config):
         "VaultData": names.vault.ddb,
     }
 
-    pipeline = DataPipeline(log_uri = s3_logs)
-    pipeline.add_emr_cluster("BackupCluster", region = bosslet_config.REGION)
-
-    for name in tables:
-        table = tables[name]
-        pipeline.add_s3_bucket(name + "Bucket", s3_backup + "/DDB/" + table)
-        pipeline.add_ddb_table(name, table)
-        pipeline.add_emr_copy(name+"Copy",
-                              Ref(name),
-                              Ref(name + "Bucket"),
-                              runs_on = Ref("BackupCluster"),
-                              region = bosslet_config.REGION)
+    # DP NOTE: ddb.py exports the tables with parallel scans, instead of
+    #          starting an EMR cluster for the copy
+    cmd = "/usr/local/bin/python3 ~/ddb.py backup {}/DDB {} --region {}".format(
+            s3_backup, " ".join(tables.values()), bosslet_config.REGION)
+    pipeline = DataPipeline(log_uri = s3_logs, resource_role="backup")
+    pipeline.add_shell_command("DDBBackup",
+                               cmd,
+                               runs_on = Ref("DDBInstance"))
+    pipeline.add_ec2_instance("DDBInstance",
+                              type = const.DDB_BACKUP_TYPE,
+                              subnet = internal_subnet,
+                              image = backup_image,
+                              duration = const.DDB_BACKUP_DURATION)
 
     config.add_data_pipeline("DDBPipeline",
                              "dynamo-backup."+bosslet_config.INTERNAL_DOMAIN,
@@ -131,7 +134,7 @@ def create_config(bosslet_config):
 
 
     # Endpoint RDS Backup
-    pipeline = rds_copy(names.endpoint_db.rds, internal_subnet, backup_image, s3_logs, s3_backup)
+    pipeline = rds_copy(names.endpoint_db.rds, internal_subnet, backup_image, s3_logs, s3_backup, bosslet_config.REGION)
     config.add_data_pipeline("EndpointPipeline",
                              "endpoint-backup."+bosslet_config.INTERNAL_DOMAIN,
                              pipeline.objects,
@@ -140,7 +143,7 @@ def create_config(bosslet_config):
 
     # Auth RDS Backup
     if bosslet_config.AUTH_RDS:
-        pipeline = rds_copy(names.auth_db.rds, internal_subnet, backup_image, s3_logs, s3_backup)
+        pipeline = rds_copy(names.auth_db.rds, internal_subnet, backup_image, s3_logs, s3_backup, bosslet_config.REGION)
         config.add_data_pipeline("AuthPipeline",
                                  "auth-backup."+bosslet_config.INTERNAL_DOMAIN,
                                  pipeline.objects,
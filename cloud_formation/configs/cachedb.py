@@ -34,7 +34,7 @@ from lib import aws
 from lib import constants as const
 from lib import utils
 from lib import console
-from lib.lambdas import load_lambdas_on_s3, freshen_lambda
+from lib.lambdas import load_all_lambdas_on_s3, freshen_lambda
 
 import botocore
 
@@ -418,8 +418,7 @@ def pre_init(bosslet_config):
     """Send spdb, bossutils, lambda, and lambda_utils to the lambda build
     server, build the lambda environment, and upload to S3.
     """
-    for lambda_name in get_lambdas(bosslet_config):
-        load_lambdas_on_s3(bosslet_config, lambda_name)
+    load_all_lambdas_on_s3(bosslet_config, get_lambdas(bosslet_config))
 
 
 def update(bosslet_config):
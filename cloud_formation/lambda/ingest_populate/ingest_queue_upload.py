@@ -1,15 +1,21 @@
 import boto3
 import json
 import time
+import random
 import hashlib
 import pprint
 import math
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 class FailedToSendMessages(Exception):
     pass
 
 SQS_BATCH_SIZE = 10
-SQS_RETRY_TIMEOUT = 15
+SQS_MAX_MESSAGE_SIZE = 256 * 1024 # bytes, also the limit for a whole send_message_batch call
+PACKED_MESSAGE_VERSION = 2 # Version 1 is the original single tile message, without a 'version' field
+SQS_MAX_IN_FLIGHT = 8 # Number of send_message_batch calls in progress at once
+SQS_RETRIES = 5
+SQS_RETRY_BACKOFF = 1 # seconds, doubled after every failed attempt
 
 def handler(args, context):
     """Populate the ingest upload SQS Queue with tile information
@@ -20,8 +26,8 @@ def handler(args, context):
     Args:
         args: {
             'job_id': '',
-            'upload_queue': ARN,
-            'ingest_queue': ARN,
+            'upload_queue': URL,
+            'ingest_queue': URL,
 
             'resolution': 0,
             'project_info': [col_id, exp_id, ch_id],
@@ -44,64 +50,147 @@ def handler(args, context):
 
             'z_chunk_size': 16,
             'MAX_NUM_ITEMS_PER_LAMBDA': 20000
-            'items_to_skip': 0
+            'items_to_skip': 0,
+
+            'packed_messages': False, # Optional, see create_messages()
         }
 
     Returns:
-        int: Number of messages put into the queue
+        int: Number of tiles put into the queue. With packed_messages this is
+             more than the number of SQS messages sent.
     """
     print("Starting to populate upload queue")
     pprint.pprint(args)
 
-    queue = boto3.resource('sqs').Queue(args['upload_queue'])
+    # DP NOTE: A client is used instead of a Queue resource, as clients are thread safe
+    sqs = boto3.client('sqs')
 
-    msgs = create_messages(args)
+    start = time.time()
     sent = 0
-
-    while True:
-        batch = []
-        for i in range(SQS_BATCH_SIZE):
-            try:
-                batch.append({
-                    'Id': str(i),
-                    'MessageBody': next(msgs),
-                    'DelaySeconds': 0
-                })
-            except StopIteration:
-                break
-
-        if len(batch) == 0:
-            break
-
-        retry = 3
-        while retry > 0:
-            resp = queue.send_messages(Entries=batch)
-            sent += len(resp['Successful'])
-
-            if 'Failed' in resp and len(resp['Failed']) > 0:
-                print("Batch failed to enqueue messages")
-                print("Retries left: {}".format(retry))
-                print("Boto3 send_messages response: {}".format(resp))
-                time.sleep(SQS_RETRY_TIMEOUT)
-
-                ids = [f['Id'] for f in resp['Failed']]
-                batch = [b for b in batch if b['Id'] in ids]
-                retry -= 1
-                if retry == 0:
-                    print("Exhausted retry count, stopping")
-                    raise FailedToSendMessages(batch) # SFN will relaunch the activity
-                continue
+    tiles = 0
+    with ThreadPoolExecutor(max_workers=SQS_MAX_IN_FLIGHT) as pool:
+        in_flight = {} # future: number of tiles in the batch
+        packed = args.get('packed_messages', False)
+        msgs = create_messages(args, packed=packed)
+        for batch in create_batches(msgs):
+            # Limit the number of queued batches, so the generator isn't run ahead
+            if len(in_flight) >= SQS_MAX_IN_FLIGHT:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for f in done:
+                    sent += f.result()
+                    tiles += in_flight.pop(f)
+
+            future = pool.submit(send_batch, sqs, args['upload_queue'], batch)
+            if packed:
+                in_flight[future] = sum(count_tiles(entry['MessageBody']) for entry in batch)
             else:
-                break
+                in_flight[future] = len(batch) # One tile per message
+
+        for f, count in in_flight.items():
+            sent += f.result()
+            tiles += count
+
+    elapsed = time.time() - start
+    print("Sent {} tiles in {} messages in {:.1f}s ({:.0f} tiles/s)".format(tiles, sent, elapsed, tiles / max(elapsed, 0.001)))
+
+    # DP NOTE: The Ingest.Upload step function compares this to the number of
+    #          tiles in the job, so it must count tiles and not messages
+    return tiles
+
+def count_tiles(msg):
+    """Count the tiles in a message created by create_messages()
+
+    Args:
+        msg (str): Version 1 or 2 message
+
+    Returns:
+        int: Number of tile keys in the message
+    """
+    start = msg.find('"tile_keys": [')
+    if start == -1:
+        return 1
+
+    # DP NOTE: Tile keys never contain quotes, so every '", "' after the start
+    #          of the list separates two tile keys
+    return msg.count('", "', start) + 1
+
+def create_batches(msgs):
+    """Group messages into send_message_batch entries
+
+    Args:
+        msgs (iterator[str]): Message bodies
+
+    Returns:
+        iterator[list[dict]]: Lists of up to SQS_BATCH_SIZE entries, with a
+                              total size of at most SQS_MAX_MESSAGE_SIZE
+    """
+    batch = []
+    size = 0
+    for msg in msgs:
+        # DP NOTE: Messages are ASCII, so the string length is the byte size
+        if len(batch) > 0 and size + len(msg) > SQS_MAX_MESSAGE_SIZE:
+            yield batch
+            batch = []
+            size = 0
+
+        size += len(msg)
+        batch.append({
+            'Id': str(len(batch)),
+            'MessageBody': msg,
+            'DelaySeconds': 0
+        })
+
+        if len(batch) == SQS_BATCH_SIZE:
+            yield batch
+            batch = []
+            size = 0
+
+    if len(batch) > 0:
+        yield batch
+
+def send_batch(sqs, queue_url, batch):
+    """Send a batch of messages, retrying only the failed entries with
+    jittered exponential backoff
+
+    Args:
+        sqs: Boto3 SQS client
+        queue_url (str): URL of the queue to send the messages to
+        batch (list[dict]): send_message_batch entries
+
+    Returns:
+        int: Number of messages sent
+
+    Raises:
+        FailedToSendMessages: If entries still failed after SQS_RETRIES attempts
+    """
+    sent = 0
+    for attempt in range(SQS_RETRIES):
+        resp = sqs.send_message_batch(QueueUrl=queue_url, Entries=batch)
+        sent += len(resp.get('Successful', []))
+
+        failed = [f['Id'] for f in resp.get('Failed', [])]
+        if len(failed) == 0:
+            return sent
 
-    return sent
+        print("Batch failed to enqueue {} messages, attempt {}: {}".format(len(failed), attempt + 1, resp['Failed']))
+        batch = [b for b in batch if b['Id'] in failed]
+        time.sleep(random.uniform(0, SQS_RETRY_BACKOFF * 2 ** attempt))
 
+    print("Exhausted retry count, stopping")
+    raise FailedToSendMessages(batch) # SFN will relaunch the activity
 
-def create_messages(args):
+
+def create_messages(args, packed=False):
     """Create all of the tile messages to be enqueued
 
+    By default every tile is a separate (version 1) message. If packed is True
+    consecutive tiles from the same chunk are combined into a single version 2
+    message, up to SQS_MAX_MESSAGE_SIZE. See docs/ingest/UploadQueueMessages.md for
+    both formats.
+
     Args:
         args (dict): Same arguments as populate_upload_queue()
+        packed (bool): If multiple tiles should be packed into each message
 
     Returns:
         list: List of strings containing Json data
@@ -210,6 +299,38 @@ def create_messages(args):
     # ... let's begin our "efficient" LOOPING! 
     #
 
+    #######################################
+    #
+    #  Precompute the parts of each message that don't change per tile
+    #
+
+    # JSON of the constant message fields, without the closing '}'
+    # DP NOTE: The result must match json.dumps() of the full message dictionary
+    msg_prefix = json.dumps({
+        'job_id': args['job_id'],
+        'upload_queue_arn': args['upload_queue'],
+        'ingest_queue_arn': args['ingest_queue'],
+    })[:-1]
+    packed_prefix = json.dumps({
+        'version': PACKED_MESSAGE_VERSION,
+        'job_id': args['job_id'],
+        'upload_queue_arn': args['upload_queue'],
+        'ingest_queue_arn': args['ingest_queue'],
+    })[:-1]
+
+    # The tile key always starts with the project info and resolution, so
+    # hash that prefix once and copy the md5 state for each tile
+    tile_base = '&'.join(map(str, args['project_info'][:3] + [args['resolution']])) + '&'
+    tile_md5 = hashlib.md5(tile_base.encode())
+
+    def tile_key(*args):
+        base = '&'.join(map(str,args))
+
+        md5 = tile_md5.copy()
+        md5.update(base.encode())
+
+        return md5.hexdigest() + '&' + tile_base + base
+
     #first, initialize vars 
     num = 0 
     bFirst = True
@@ -219,9 +340,29 @@ def create_messages(args):
         for z in new_range_z(Zns, bFirst):
             #Factor in Z chunk size
             num_of_tiles = min(args['z_chunk_size'], args['z_stop'] - z)
+            chunk_z = int(z / args['z_chunk_size'])
 
             for y in new_range('y', Yns, bFirst):
+                chunk_y = int(y / tile_size('y'))
+
                 for x in new_range('x', Xns, bFirst):
+                    chunk_x = int(x / tile_size('x'))
+
+                    # The chunk key is the same for every tile in the chunk
+                    chunk_key = hashed_key(num_of_tiles,
+                                            args['project_info'][0],
+                                            args['project_info'][1],
+                                            args['project_info'][2],
+                                            args['resolution'],
+                                            chunk_x,
+                                            chunk_y,
+                                            chunk_z,
+                                            t)
+                    if packed:
+                        chunk_prefix = packed_prefix + ', "chunk_key": ' + json.dumps(chunk_key) + ', "tile_keys": ['
+                    else:
+                        chunk_prefix = msg_prefix + ', "chunk_key": ' + json.dumps(chunk_key) + ', "tile_key": '
+                    tile_keys = []
 
                     for tile in new_range_tile(items_to_skip, z, bFirst, num_of_tiles):
                         if bFirst:
@@ -231,38 +372,41 @@ def create_messages(args):
                         if count_in_offset == 0:
                             print(" **** FINISHED SKIPPING tiles *** \n")
 
-                        chunk_x = int(x / tile_size('x'))
-                        chunk_y = int(y / tile_size('y'))
-                        chunk_z = int(z / args['z_chunk_size'])
-                        chunk_key = hashed_key(num_of_tiles,
-                                                args['project_info'][0],
-                                                args['project_info'][1],
-                                                args['project_info'][2],
-                                                args['resolution'],
-                                                chunk_x,
-                                                chunk_y,
-                                                chunk_z,
-                                                t)
-
                         count_in_offset += 1
                         if count_in_offset > args['MAX_NUM_ITEMS_PER_LAMBDA']:
+                            yield from pack_tile_keys(chunk_prefix, tile_keys)
                             return  # end the generator
 
-                        tile_key = hashed_key(args['project_info'][0],
-                                                args['project_info'][1],
-                                                args['project_info'][2],
-                                                args['resolution'],
-                                                chunk_x,
-                                                chunk_y,
-                                                tile,
-                                                t)
-
-                        msg = {
-                            'job_id': args['job_id'],
-                            'upload_queue_arn': args['upload_queue'],
-                            'ingest_queue_arn': args['ingest_queue'],
-                            'chunk_key': chunk_key,
-                            'tile_key': tile_key,
-                        }
-
-                        yield json.dumps(msg)
+                        if packed:
+                            tile_keys.append(json.dumps(tile_key(chunk_x, chunk_y, tile, t)))
+                        else:
+                            yield chunk_prefix + json.dumps(tile_key(chunk_x, chunk_y, tile, t)) + '}'
+
+                    yield from pack_tile_keys(chunk_prefix, tile_keys)
+
+def pack_tile_keys(chunk_prefix, tile_keys):
+    """Combine JSON encoded tile keys into as few version 2 messages as possible
+
+    Args:
+        chunk_prefix (str): JSON of the message up to and including the opening
+                            '[' of the tile_keys list
+        tile_keys (list[str]): JSON encoded tile keys
+
+    Returns:
+        iterator[str]: Messages of at most SQS_MAX_MESSAGE_SIZE bytes
+    """
+    suffix = ']}'
+    budget = SQS_MAX_MESSAGE_SIZE - len(chunk_prefix) - len(suffix)
+
+    packed = []
+    size = 0
+    for key in tile_keys:
+        size += len(key) + (2 if len(packed) > 0 else 0) # ', ' separator
+        if len(packed) > 0 and size > budget:
+            yield chunk_prefix + ', '.join(packed) + suffix
+            packed = []
+            size = len(key)
+        packed.append(key)
+
+    if len(packed) > 0:
+        yield chunk_prefix + ', '.join(packed) + suffix
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Microbenchmark for ingest_queue_upload.create_messages()
+
+Compares the messages/second of create_messages() against
+create_expected_messages() from the unit tests, which does the original
+per-tile work (rehashing the chunk key and re-encoding the full message for
+every tile), for one MAX_NUM_ITEMS_PER_LAMBDA slice of a large ingest.
+
+Sample usage (from this directory):
+
+    ./benchmark_create_messages.py
+    ./benchmark_create_messages.py --items 20000 --skip 1000000
+"""
+
+import argparse
+import contextlib
+import io
+import time
+
+import ingest_queue_upload as iqu
+from test_ingest_queue_upload import create_expected_messages
+
+def ingest_args(items, skip):
+    return {
+        "x_start": 0, "x_stop": 65536, "x_tile_size": 512,
+        "y_start": 0, "y_stop": 65536, "y_tile_size": 512,
+        "z_start": 0, "z_stop": 2048, "z_tile_size": 1,
+        "t_start": 0, "t_stop": 1, "t_tile_size": 1,
+        "project_info": ["12", "345", "6789"],
+        "ingest_queue": "https://queue.amazonaws.com/123456789012/ingest_queue",
+        "upload_queue": "https://queue.amazonaws.com/123456789012/upload_queue",
+        "job_id": 4321,
+        "resolution": 0,
+        "items_to_skip": skip,
+        "MAX_NUM_ITEMS_PER_LAMBDA": items,
+        "z_chunk_size": 16,
+    }
+
+def skip_messages(msgs, skip):
+    """Advance the reference generator, which doesn't support items_to_skip"""
+    for _ in range(skip):
+        next(msgs)
+    return msgs
+
+def rate(label, make_msgs, repeat):
+    best = None
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            msgs = make_msgs()
+            start = time.perf_counter()
+            count = sum(1 for _ in msgs)
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    print("{:>20}: {:>8} messages in {:.3f}s  {:>10.0f} messages/s".format(label, count, best, count / best))
+    return count / best
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Benchmark ingest upload queue message creation")
+    parser.add_argument('--items', type = int, default = 20000,
+                        help = 'MAX_NUM_ITEMS_PER_LAMBDA slice size')
+    parser.add_argument('--skip', type = int, default = 0,
+                        help = 'items_to_skip offset of the slice')
+    parser.add_argument('--repeat', type = int, default = 5,
+                        help = 'Number of runs, the fastest is reported')
+    args = parser.parse_args()
+
+    before = rate('before (reference)',
+                  lambda: skip_messages(create_expected_messages(ingest_args(args.items + args.skip, 0)), args.skip),
+                  args.repeat)
+    after = rate('after',
+                 lambda: iqu.create_messages(ingest_args(args.items, args.skip)),
+                 args.repeat)
+
+    print("{:>20}: {:.2f}x".format('speedup', after / before))
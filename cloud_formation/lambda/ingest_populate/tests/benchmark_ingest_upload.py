@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Offline throughput benchmark for ingest_queue_upload.handler()
+
+Runs the IngestUpload lambda handler against an in-memory stand-in for SQS
+across a matrix of tile / chunk geometries and items_to_skip offsets, and
+records for each run:
+    * tiles/second
+    * number of messages sent
+    * number of send_message_batch API calls
+    * peak Python memory allocated (tracemalloc)
+    * per-batch latency percentiles
+
+Passing --packed benchmarks the version 2 (multi-tile) message format.
+
+The stand-in can add a simulated round trip latency per API call (--latency)
+so that the effect of the concurrent senders is visible.
+
+Results are written as JSON (--output). Passing a previous results file with
+--compare prints the change in tiles/second for each run, so regressions
+show up when the results are committed and reviewed.
+
+Sample usage (from this directory):
+
+    ./benchmark_ingest_upload.py --output benchmark_ingest_upload.json
+    ./benchmark_ingest_upload.py --latency 20 --compare benchmark_ingest_upload.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import threading
+import time
+import tracemalloc
+from unittest import mock
+
+import ingest_queue_upload as iqu
+
+# name: (x_tile_size, y_tile_size, z_chunk_size, x_stop, y_stop, z_stop)
+GEOMETRIES = {
+    'tiles-512-chunk-16': (512, 512, 16, 65536, 65536, 2048),
+    'tiles-1024-chunk-16': (1024, 1024, 16, 65536, 65536, 2048),
+    'tiles-512-chunk-1': (512, 512, 1, 65536, 65536, 2048),
+    'tiles-4096-chunk-64': (4096, 4096, 64, 65536, 65536, 2048),
+}
+
+# Fractions of the total tile count used as items_to_skip
+OFFSETS = [0.0, 0.5, 0.99]
+
+class FakeSQS(object):
+    """Thread safe in-memory stand-in for the boto3 SQS client"""
+
+    def __init__(self, latency = 0):
+        """
+        Args:
+            latency (float): Seconds to sleep for each API call
+        """
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.messages = 0
+        self.batch_latencies = []
+
+    def send_message_batch(self, QueueUrl, Entries):
+        start = time.perf_counter()
+        if self.latency:
+            time.sleep(self.latency)
+
+        with self.lock:
+            self.calls += 1
+            self.messages += len(Entries)
+            self.batch_latencies.append(time.perf_counter() - start)
+
+        return {'Successful': [{'Id': entry['Id']} for entry in Entries]}
+
+def ingest_args(geometry, items, offset, packed=False):
+    x_tile, y_tile, z_chunk, x_stop, y_stop, z_stop = GEOMETRIES[geometry]
+    args = {
+        "x_start": 0, "x_stop": x_stop, "x_tile_size": x_tile,
+        "y_start": 0, "y_stop": y_stop, "y_tile_size": y_tile,
+        "z_start": 0, "z_stop": z_stop, "z_tile_size": 1,
+        "t_start": 0, "t_stop": 1, "t_tile_size": 1,
+        "project_info": ["12", "345", "6789"],
+        "ingest_queue": "https://queue.amazonaws.com/123456789012/ingest_queue",
+        "upload_queue": "https://queue.amazonaws.com/123456789012/upload_queue",
+        "job_id": 4321,
+        "resolution": 0,
+        "items_to_skip": 0,
+        "MAX_NUM_ITEMS_PER_LAMBDA": items,
+        "z_chunk_size": z_chunk,
+        "packed_messages": packed,
+    }
+    # The geometries are a whole number of tiles in X and Y, and have one time sample
+    tiles = (x_stop // x_tile) * (y_stop // y_tile) * z_stop
+    args['items_to_skip'] = int(tiles * offset)
+    return args
+
+def percentile(values, pct):
+    values = sorted(values)
+    if len(values) == 0:
+        return None
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+def run(geometry, items, offset, latency, packed=False):
+    args = ingest_args(geometry, items, offset, packed)
+    sqs = FakeSQS(latency)
+
+    tracemalloc.start()
+    with mock.patch.object(iqu.boto3, 'client', return_value=sqs), \
+         contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        tiles = iqu.handler(args, None)
+        elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'geometry': geometry,
+        'items_to_skip': args['items_to_skip'],
+        'tiles': tiles,
+        'messages': sqs.messages,
+        'seconds': round(elapsed, 4),
+        'tiles_per_second': round(tiles / elapsed, 1),
+        'api_calls': sqs.calls,
+        'peak_memory_bytes': peak,
+        'batch_latency_ms': {
+            'p50': round(percentile(sqs.batch_latencies, 50) * 1000, 3),
+            'p90': round(percentile(sqs.batch_latencies, 90) * 1000, 3),
+            'p99': round(percentile(sqs.batch_latencies, 99) * 1000, 3),
+        },
+    }
+
+def run_key(result):
+    return '{} @ {}'.format(result['geometry'], result['items_to_skip'])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Offline benchmark of the IngestUpload lambda")
+    parser.add_argument('--items', type = int, default = 20000,
+                        help = 'MAX_NUM_ITEMS_PER_LAMBDA for each run')
+    parser.add_argument('--latency', type = float, default = 0,
+                        help = 'Simulated SQS round trip latency in milliseconds')
+    parser.add_argument('--packed', action = 'store_true',
+                        help = 'Send version 2 (multi-tile) messages')
+    parser.add_argument('--geometry', choices = list(GEOMETRIES), nargs = '+',
+                        default = list(GEOMETRIES),
+                        help = 'Geometries to run')
+    parser.add_argument('--output', '-o',
+                        help = 'File to write the JSON results to')
+    parser.add_argument('--compare', '-c',
+                        help = 'Previous JSON results to compare against')
+    args = parser.parse_args()
+
+    results = {
+        'config': {
+            'items': args.items,
+            'latency_ms': args.latency,
+            'packed': args.packed,
+            'max_in_flight': iqu.SQS_MAX_IN_FLIGHT,
+            'python': platform.python_version(),
+        },
+        'runs': [],
+    }
+
+    previous = {}
+    if args.compare:
+        with open(args.compare) as fh:
+            previous = { run_key(result): result for result in json.load(fh)['runs'] }
+
+    fmt = '{:<36} {:>8} {:>8} {:>10} {:>6} {:>10} {:>9}'
+    print(fmt.format('Run', 'Tiles', 'Messages', 'Tiles/s', 'Calls', 'Peak KB', 'Change'))
+    for geometry in args.geometry:
+        for offset in OFFSETS:
+            result = run(geometry, args.items, offset, args.latency / 1000, args.packed)
+            results['runs'].append(result)
+
+            change = ''
+            if run_key(result) in previous:
+                # DP NOTE: Older results only have messages_per_second, which
+                #          was the same as tiles/second for version 1 messages
+                before = previous[run_key(result)]
+                ratio = result['tiles_per_second'] / before.get('tiles_per_second', before.get('messages_per_second'))
+                change = '{:+.1f}%'.format((ratio - 1) * 100)
+
+            print(fmt.format(run_key(result),
+                             result['tiles'],
+                             result['messages'],
+                             '{:.0f}'.format(result['tiles_per_second']),
+                             result['api_calls'],
+                             result['peak_memory_bytes'] // 1024,
+                             change))
+
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=2)
+            fh.write('\n')
@@ -20,7 +20,51 @@ import ingest_queue_upload as iqu
 import hashlib
 import json
 import math
+import threading
 import unittest
+import unittest.mock
+
+# Ingest job used by the tests, use dict(ARGS, key=value) to change an argument
+ARGS = {
+    "x_start": 0, "x_stop": 2560, "x_tile_size": 512,
+    "y_start": 0, "y_stop": 2052, "y_tile_size": 512,
+    "z_start": 0, "z_stop": 33, "z_tile_size": 1,
+    "t_start": 0, "t_stop": 2, "t_tile_size": 1,
+    "project_info": ["3", "3", "3"],
+    "ingest_queue": "https://queue.amazonaws.com/ingest",
+    "upload_queue": "https://queue.amazonaws.com/upload",
+    "job_id": 11,
+    "resolution": 0,
+    "items_to_skip": 0,
+    'MAX_NUM_ITEMS_PER_LAMBDA': 500000,
+    'z_chunk_size': 16
+}
+
+class FakeSQS(object):
+    """Thread safe in-memory stand-in for the boto3 SQS client"""
+
+    def __init__(self, fail = 0):
+        """
+        Args:
+            fail (int): Number of send_message_batch calls that report their
+                        first two entries as failed
+        """
+        self.fail = fail
+        self.lock = threading.Lock()
+        self.calls = [] # Entry Ids sent in each call
+
+    @property
+    def messages(self):
+        return sum(len(ids) for ids in self.calls)
+
+    def send_message_batch(self, QueueUrl, Entries):
+        ids = [entry['Id'] for entry in Entries]
+        with self.lock:
+            self.calls.append(ids)
+            failed = ids[:2] if len(self.calls) <= self.fail else []
+
+        return {'Successful': [{'Id': id} for id in ids if id not in failed],
+                'Failed': [{'Id': id} for id in failed]}
 
 class TestIngestQueueUploadLambda(unittest.TestCase):
 
@@ -120,6 +164,67 @@ class TestIngestQueueUploadLambda(unittest.TestCase):
                                 # Verify set has no left over tiles.
                                 self.assertEqual(len(msg_set_copy), 0)
 
+    def test_messages_match_reference(self):
+        """The precomputed message prefixes should produce the exact same JSON"""
+        self.assertEqual(list(iqu.create_messages(ARGS)),
+                         list(create_expected_messages(ARGS)))
+
+    def test_packed_messages_match_single_tile_messages(self):
+        """Unpacking the version 2 messages should give the version 1 messages"""
+        args = dict(ARGS)
+        for skip, max_items in [(0, 500000), (7, 100), (1000, 333)]:
+            for max_size in [iqu.SQS_MAX_MESSAGE_SIZE, 1024]:
+                with self.subTest(skip=skip, max_items=max_items, max_size=max_size):
+                    args.update(items_to_skip=skip, MAX_NUM_ITEMS_PER_LAMBDA=max_items)
+
+                    with unittest.mock.patch.object(iqu, 'SQS_MAX_MESSAGE_SIZE', max_size):
+                        packed = list(iqu.create_messages(args, packed=True))
+
+                    unpacked = []
+                    for msg_json in packed:
+                        self.assertLessEqual(len(msg_json), max_size)
+
+                        msg = json.loads(msg_json)
+                        self.assertEqual(msg.pop('version'), iqu.PACKED_MESSAGE_VERSION)
+                        for tile_key in msg.pop('tile_keys'):
+                            unpacked.append(json.dumps(dict(msg, tile_key=tile_key)))
+
+                    self.assertEqual(unpacked, list(iqu.create_messages(args)))
+                    self.assertLess(len(packed), len(unpacked))
+
+    def test_handler_returns_tile_count(self):
+        """The handler should return the number of tiles, with or without packing"""
+        args = dict(ARGS, items_to_skip=7, MAX_NUM_ITEMS_PER_LAMBDA=1000)
+        for packed in [False, True]:
+            with self.subTest(packed=packed):
+                sqs = FakeSQS()
+                with unittest.mock.patch.object(iqu.boto3, 'client', return_value=sqs):
+                    tiles = iqu.handler(dict(args, packed_messages=packed), None)
+
+                self.assertEqual(tiles, 1000)
+                if packed:
+                    self.assertLess(sqs.messages, tiles)
+                else:
+                    self.assertEqual(sqs.messages, tiles)
+
+    def test_create_batches_limits_batch_size(self):
+        """A batch should never be larger than SQS_MAX_MESSAGE_SIZE"""
+        msgs = ['x' * 100] * 25
+        with unittest.mock.patch.object(iqu, 'SQS_MAX_MESSAGE_SIZE', 350):
+            batches = list(iqu.create_batches(msgs))
+
+        self.assertEqual([len(b) for b in batches], [3] * 8 + [1])
+
+    def test_send_batch_retries_failed_entries(self):
+        """Only the entries that failed should be resent"""
+        sqs = FakeSQS(fail=1)
+        batch = next(iqu.create_batches(str(i) for i in range(iqu.SQS_BATCH_SIZE)))
+        with unittest.mock.patch.object(iqu.time, 'sleep'):
+            sent = iqu.send_batch(sqs, 'url', batch)
+
+        self.assertEqual(sent, iqu.SQS_BATCH_SIZE)
+        self.assertEqual(sqs.calls[1], ['0', '1'])
+
     def generate_chunk_tile_key(self, msg_json):
         """
         Generate a key to track messages for testing.
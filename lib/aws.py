@@ -1166,6 +1166,61 @@ def lambda_connect_sqs(session, lambda_name, sqs_arn, batch_size=10, enabled=Tru
         print("Warning: failed to connect queue to lambda.  Does connection already exist (printing error below)?")
         print(f"\t{ex}\n")
 
+def lambda_enable_sqs(session, lambda_name, sqs_arn, enabled=True, wait=True):
+    """
+    Enables or disables the existing event source mapping(s) between an SQS
+    queue and the lambda function.  While disabled, messages stay in the queue
+    and are not passed to the lambda.
+
+    Args:
+        session (Session): boto3.session.Session object
+        lambda_name (str): name of the lambda function
+        sqs_arn (str): ARN of the connected queue
+        enabled (bool): Whether the connection should be on
+        wait (bool): Wait until the change has taken effect
+
+    Returns:
+        (list[str]): UUIDs of the event source mappings that were updated
+    """
+    if session is None:
+        return None
+
+    client = session.client("lambda")
+    paginator = client.get_paginator('list_event_source_mappings')
+    mappings = [mapping
+                for page in paginator.paginate(FunctionName=lambda_name, EventSourceArn=sqs_arn)
+                for mapping in page['EventSourceMappings']]
+
+    if len(mappings) == 0:
+        print(f"Warning: {sqs_arn} is not connected to {lambda_name}")
+
+    target = 'Enabled' if enabled else 'Disabled'
+    for mapping in mappings:
+        # A mapping cannot be updated while it is still applying a previous change
+        state = _lambda_wait_sqs(client, mapping['UUID'])
+        if state != target:
+            client.update_event_source_mapping(UUID=mapping['UUID'], Enabled=enabled)
+
+    if wait:
+        for mapping in mappings:
+            _lambda_wait_sqs(client, mapping['UUID'])
+
+    return [mapping['UUID'] for mapping in mappings]
+
+def _lambda_wait_sqs(client, uuid, delay=5, max_attempts=60):
+    """Wait for an event source mapping to leave any transitional state
+
+    Returns:
+        (str): Final state of the mapping
+    """
+    for _ in range(max_attempts):
+        state = client.get_event_source_mapping(UUID=uuid)['State']
+        if state not in ('Creating', 'Enabling', 'Disabling', 'Updating'):
+            return state
+        time.sleep(delay)
+
+    raise BossManageError(f"Event source mapping {uuid} is still {state}")
+
 def dynamo_scan(session, table_name):
     if session is None:
         return None
@@ -1257,6 +1312,67 @@ def activate_data_pipeline(session, id):
     client.activate_pipeline(pipelineId = id,
                              startTimestamp = datetime.utcnow())
 
+def data_pipeline_status(client, id):
+    """Get the health status of a Data Pipeline
+
+    Args:
+        client (DataPipeline.Client): boto3 datapipeline client
+        id (str): Data Pipeline id
+
+    Returns:
+        (None|str): None if the pipeline has not run yet, else HEALTHY or ERROR
+    """
+    resp = client.describe_pipelines(pipelineIds=[id])
+    status = [f['stringValue']
+              for f in resp['pipelineDescriptionList'][0]['fields']
+              if f['key'] == '@healthStatus']
+
+    if len(status) == 0:
+        return None
+    else:
+        return status[0]
+
+def data_pipeline_objects(client, id, sphere='INSTANCE'):
+    """Get the fields of all of a Data Pipeline's objects
+
+    Args:
+        client (DataPipeline.Client): boto3 datapipeline client
+        id (str): Data Pipeline id
+        sphere (str): COMPONENT, INSTANCE, or ATTEMPT
+
+    Returns:
+        (list[dict]): Dictionary of field key to string value for each object
+    """
+    paginator = client.get_paginator('query_objects')
+    ids = [object_id
+           for page in paginator.paginate(pipelineId=id, sphere=sphere)
+           for object_id in page['ids']]
+
+    objects = []
+    for i in range(0, len(ids), 25): # describe_objects limit
+        resp = client.describe_objects(pipelineId=id,
+                                       objectIds=ids[i:i+25])
+        for obj in resp['pipelineObjects']:
+            fields = {f['key']: f.get('stringValue', f.get('refValue'))
+                      for f in obj['fields']}
+            fields['@name'] = obj['name']
+            objects.append(fields)
+    return objects
+
+def data_pipeline_errors(client, id):
+    """Get the failure reasons for a Data Pipeline's object instances
+
+    Args:
+        client (DataPipeline.Client): boto3 datapipeline client
+        id (str): Data Pipeline id
+
+    Returns:
+        (list[str]): Failure reasons
+    """
+    return [obj['@failureReason']
+            for obj in data_pipeline_objects(client, id)
+            if '@failureReason' in obj]
+
 def get_existing_stacks(bosslet_config):
     client = bosslet_config.session.client('cloudformation')
     suffix = "".join([x.capitalize() for x in bosslet_config.INTERNAL_DOMAIN.split('.')])
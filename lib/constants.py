@@ -65,7 +65,6 @@ def repo_path(*args):
 LAMBDA_DIR = repo_path('cloud_formation', 'lambda')
 DNS_LAMBDA = LAMBDA_DIR + '/updateRoute53/index.py'
 VAULT_LAMBDA = LAMBDA_DIR + '/monitors/chk_vault.py'
-INGEST_LAMBDA = LAMBDA_DIR + '/ingest_populate/ingest_queue_upload.py'
 DOWNSAMPLE_DLQ_LAMBDA = LAMBDA_DIR + '/downsample/dlq.py'
 DELETE_ENI_LAMBDA = LAMBDA_DIR + '/delete-eni/delete_eni.py'
 
@@ -124,6 +123,8 @@ CACHE_MANAGER_TYPE = "t3.micro"
 VAULT_TYPE = "t3.micro"
 ACTIVITIES_TYPE = "t3.micro"
 AUTH_TYPE = "t3.micro"
+DDB_BACKUP_TYPE = "m4.large"
+DDB_BACKUP_DURATION = "6 Hours" # Data Pipeline terminateAfter for the instance
 
 
 ########################
@@ -0,0 +1,313 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Library for tuning the annotation indexing fan-out parameters per channel.
+
+The parameters passed to Index.Start (see bin/run_indexing.py) control how
+the work of indexing a channel is split into SQS messages and step function
+executions.  estimate_channel() samples the s3index table to estimate the
+size and id density of a channel, tune_params() picks parameters for that
+estimate, and simulate() models the messages, executions, and DynamoDB
+writes of a parameter set, so that settings can be compared offline.
+"""
+
+import math
+import random
+
+# Parameters used for every channel before tuning
+DEFAULT_PARAMS = {
+    # Max number of cuboid keys to pull from s3index Dynamo table in 1 request.
+    'max_items': 200,
+    # Number of object ids to include in a single SQS message.
+    'num_ids_per_msg': 20,
+    # Number of ids in each chunk that Index.FanoutIdWriters enqueues at a time.
+    'id_chunk_size': 20,
+    # Seconds Index.FanoutIdWriters waits after enqueuing each chunk / before retrying.
+    'wait_time': 5,
+    # Write units consumed updating an id index entry before a new entry is created.
+    'id_index_new_chunk_threshold': 100,
+}
+
+# (min, max) allowed for each parameter
+# max_items is bounded by the 1MB Dynamo query page, num_ids_per_msg by the
+# indexWriteIdLambda timeout, and id_chunk_size by the step function payload size
+PARAM_LIMITS = {
+    'max_items': (50, 1000),
+    'num_ids_per_msg': (5, 100),
+    'id_chunk_size': (5, 500),
+    'wait_time': (1, 30),
+    'id_index_new_chunk_threshold': (50, 400),
+}
+
+# Candidates and limits used by tune_params()
+NUM_IDS_PER_MSG_CANDIDATES = [5, 10, 20, 40, 60, 100]
+ID_CHUNK_MULTIPLES = [1, 2, 5, 10]
+MAX_ID_WRITER_SECONDS = 30 # indexWriteIdLambda timeout is 120 seconds
+MAX_FANOUT_SECONDS = 600 # Index.FanoutIdWriters timeout is 1800 seconds
+MAX_ENTRIES_PER_ID = 10 # Id index entries that have to be read to look up an id
+
+# Global secondary index of the s3index table keyed by channel lookup key
+S3_INDEX_LOOKUP_KEY_INDEX = 'lookup-key-index'
+
+# Model constants used by simulate()
+SQS_BATCH_SIZE = 10
+MORTON_ID_BYTES = 20 # Size of one morton id in an id index entry's set
+ID_INDEX_ITEM_BYTES = 100 # Size of an id index entry without any morton ids
+ID_WRITE_SECONDS = 0.02 # Time to update one id in indexWriteIdLambda
+ENQUEUE_SECONDS = 0.5 # Time for one EnqueueCuboidIds call
+
+# Approximate state transitions per execution of each step function
+TRANSITIONS = {
+    'find_cuboids_page': 4,
+    'cuboid_supervisor': 10,
+    'fanout_chunk': 4,
+    'id_writer': 6,
+}
+
+# Approximate us-east-1 list prices, in dollars
+PRICE_PER_TRANSITION = 0.025 / 1000
+PRICE_PER_SQS_REQUEST = 0.40 / 1000000
+PRICE_PER_WRITE_UNIT = 1.25 / 1000000 # On demand
+
+def clamp(params):
+    """Limit each parameter to its PARAM_LIMITS range
+
+    Args:
+        params (dict): Indexing parameters
+
+    Returns:
+        dict: New dictionary of limited parameters
+    """
+    limited = dict(params)
+    for key, (low, high) in PARAM_LIMITS.items():
+        if key in limited:
+            limited[key] = max(low, min(high, int(limited[key])))
+    return limited
+
+def estimate_channel(bosslet_config, lookup_key, max_pages=20, sample_size=100, seed=None):
+    """Estimate the number of cuboids and ids per cuboid in a channel
+
+    The cuboid count is exact if all of the channel's keys fit in max_pages
+    query pages, otherwise it is a lower bound. The ids per cuboid are
+    averaged over a random sample of cuboids, using the id sets written to
+    the s3index table by a previous indexing run. If the channel has not been
+    indexed before, ids_per_cuboid is None.
+
+    Args:
+        bosslet_config (BossConfiguration): Bosslet configuration object
+        lookup_key (str): Channel lookup key (coll&exp&chan&res)
+        max_pages (int): Max number of s3index query pages to read
+        sample_size (int): Number of cuboids to read the id sets of
+        seed (int): Random seed for selecting the sample
+
+    Returns:
+        dict: {
+            'cuboids': int,
+            'cuboids_exact': bool,
+            'ids_per_cuboid': float|None,
+            'sampled': int, # Number of cuboids with an id set
+        }
+    """
+    table = bosslet_config.names.s3_index.ddb
+    ddb = bosslet_config.session.client('dynamodb')
+
+    query = {
+        'TableName': table,
+        'IndexName': S3_INDEX_LOOKUP_KEY_INDEX,
+        'KeyConditionExpression': '#lookupkey = :lookupkey',
+        'ExpressionAttributeNames': {'#lookupkey': 'lookup-key'},
+        'ExpressionAttributeValues': {':lookupkey': {'S': lookup_key}},
+    }
+
+    keys = []
+    exact = False
+    for _ in range(max_pages):
+        resp = ddb.query(**query)
+        keys.extend({'object-key': item['object-key'], 'version-node': item['version-node']}
+                    for item in resp['Items'])
+
+        if 'LastEvaluatedKey' not in resp:
+            exact = True
+            break
+        query['ExclusiveStartKey'] = resp['LastEvaluatedKey']
+
+    sample = random.Random(seed).sample(keys, min(sample_size, len(keys)))
+    sizes = []
+    for i in range(0, len(sample), 100): # BatchGetItem limit
+        request = {table: {'Keys': sample[i:i+100],
+                           'ProjectionExpression': '#idset',
+                           'ExpressionAttributeNames': {'#idset': 'id-set'}}}
+        while request:
+            resp = ddb.batch_get_item(RequestItems=request)
+            for item in resp['Responses'].get(table, []):
+                if 'id-set' in item:
+                    sizes.append(len(list(item['id-set'].values())[0]))
+            request = resp.get('UnprocessedKeys')
+
+    return {
+        'cuboids': len(keys),
+        'cuboids_exact': exact,
+        'ids_per_cuboid': sum(sizes) / len(sizes) if len(sizes) > 0 else None,
+        'sampled': len(sizes),
+    }
+
+def tune_params(profile):
+    """Pick indexing parameters for a channel
+
+    The candidate parameter sets are compared with simulate(). The cheapest
+    set whose Index.IdWriter and Index.FanoutIdWriters durations stay within
+    MAX_ID_WRITER_SECONDS and MAX_FANOUT_SECONDS is used, and the smallest
+    id index chunk threshold that keeps each id within MAX_ENTRIES_PER_ID
+    entries. If the id density is unknown only max_items is tuned.
+
+    Args:
+        profile (dict): Result of estimate_channel()
+
+    Returns:
+        dict: Indexing parameters, within PARAM_LIMITS
+    """
+    params = dict(DEFAULT_PARAMS)
+
+    # Fewer, larger s3index pages for channels with many cuboids
+    params = clamp(dict(params, max_items = math.ceil(profile['cuboids'] / 100)))
+
+    density = profile['ids_per_cuboid']
+    cuboids = max(1, profile['cuboids'])
+    if density is None:
+        return clamp(params)
+
+    def score(candidate):
+        result = simulate(cuboids, density, candidate)
+        if (result['id_writer_seconds'] > MAX_ID_WRITER_SECONDS or
+            result['fanout_seconds'] > MAX_FANOUT_SECONDS):
+            return None
+        # Ties go to the smaller messages, which spread the writes over more executions
+        return (result['cost'], result['id_writer_seconds'])
+
+    best = None
+    for num_ids in NUM_IDS_PER_MSG_CANDIDATES:
+        for multiple in ID_CHUNK_MULTIPLES:
+            candidate = clamp(dict(params,
+                                   num_ids_per_msg = num_ids,
+                                   id_chunk_size = num_ids * multiple))
+            # Only back off briefly when a cuboid's ids fit in a single chunk
+            if density <= candidate['id_chunk_size']:
+                candidate['wait_time'] = PARAM_LIMITS['wait_time'][0]
+
+            candidate_score = score(candidate)
+            if candidate_score is not None and (best is None or candidate_score < best[0]):
+                best = (candidate_score, candidate)
+
+    if best is not None:
+        params = best[1]
+
+    low, high = PARAM_LIMITS['id_index_new_chunk_threshold']
+    for threshold in range(low, high + 1, low):
+        result = simulate(cuboids, density, dict(params, id_index_new_chunk_threshold = threshold))
+        if result['id_index_entries'] <= MAX_ENTRIES_PER_ID * result['id_updates'] / max(1, density):
+            params['id_index_new_chunk_threshold'] = threshold
+            break
+    else:
+        params['id_index_new_chunk_threshold'] = high
+
+    return clamp(params)
+
+def simulate(cuboids, ids_per_cuboid, params, cuboids_per_id=None, write_capacity=None):
+    """Model the work done by indexing a channel with the given parameters
+
+    The model assumes every cuboid has ids_per_cuboid ids and every id
+    appears in cuboids_per_id cuboids. Each (id, cuboid) pair is one update
+    of the id's id index entry, which grows by one morton id per update until
+    the entry has consumed id_index_new_chunk_threshold write units.
+
+    Args:
+        cuboids (int): Number of cuboids in the channel
+        ids_per_cuboid (float): Average number of ids in each cuboid
+        params (dict): Indexing parameters (see DEFAULT_PARAMS)
+        cuboids_per_id (float): Average number of cuboids each id is in, defaults to ids_per_cuboid
+        write_capacity (int): Write units per second the id index can sustain, used to estimate the duration
+
+    Returns:
+        dict: Counts of messages, executions, writes, an approximate cost in
+              dollars, and (if write_capacity is given) the duration in seconds
+    """
+    params = dict(DEFAULT_PARAMS, **params)
+    ids_per_cuboid = max(0, ids_per_cuboid)
+    if cuboids_per_id is None:
+        cuboids_per_id = max(1, ids_per_cuboid)
+
+    # Each chunk of ids is enqueued separately, so a message never spans chunks
+    chunks_per_cuboid = math.ceil(ids_per_cuboid / params['id_chunk_size'])
+    full_chunks, remainder = divmod(ids_per_cuboid, params['id_chunk_size'])
+    id_msgs_per_cuboid = (int(full_chunks) * math.ceil(params['id_chunk_size'] / params['num_ids_per_msg']) +
+                          math.ceil(remainder / params['num_ids_per_msg']))
+
+    find_pages = max(1, math.ceil(cuboids / params['max_items']))
+    cuboid_msgs = cuboids
+    id_msgs = cuboids * id_msgs_per_cuboid
+    id_writers = id_msgs
+    updates = cuboids * ids_per_cuboid
+    unique_ids = updates / cuboids_per_id
+
+    # Write units consumed by the updates of one id
+    wcu_per_id = 0
+    chunks_per_id = 1
+    chunk_wcu = 0
+    mortons = 0
+    for _ in range(int(math.ceil(cuboids_per_id))):
+        wcu = math.ceil((ID_INDEX_ITEM_BYTES + MORTON_ID_BYTES * (mortons + 1)) / 1024)
+        wcu_per_id += wcu
+        chunk_wcu += wcu
+        mortons += 1
+        if chunk_wcu >= params['id_index_new_chunk_threshold']:
+            chunks_per_id += 1
+            chunk_wcu = 0
+            mortons = 0
+    write_units = unique_ids * wcu_per_id
+
+    transitions = (find_pages * TRANSITIONS['find_cuboids_page'] +
+                   cuboids * TRANSITIONS['cuboid_supervisor'] +
+                   cuboids * chunks_per_cuboid * TRANSITIONS['fanout_chunk'] +
+                   id_writers * TRANSITIONS['id_writer'])
+
+    # Send (batched), receive, and delete for each message
+    sqs_requests = (math.ceil(cuboid_msgs / SQS_BATCH_SIZE) + 2 * cuboid_msgs +
+                    math.ceil(id_msgs_per_cuboid / SQS_BATCH_SIZE) * cuboids + 2 * id_msgs)
+
+    cost = (transitions * PRICE_PER_TRANSITION +
+            sqs_requests * PRICE_PER_SQS_REQUEST +
+            write_units * PRICE_PER_WRITE_UNIT)
+
+    result = {
+        'find_cuboids_pages': find_pages,
+        'cuboid_messages': cuboid_msgs,
+        'id_messages': id_msgs,
+        'cuboid_supervisor_executions': cuboids,
+        'id_writer_executions': id_writers,
+        'state_transitions': transitions,
+        'sqs_requests': sqs_requests,
+        'id_updates': int(updates),
+        'id_index_entries': int(math.ceil(unique_ids * chunks_per_id)),
+        'write_units': int(write_units),
+        'cost': round(cost, 2),
+        # Time a single Index.FanoutIdWriters and Index.IdWriter take
+        'fanout_seconds': chunks_per_cuboid * (ENQUEUE_SECONDS + params['wait_time']),
+        'id_writer_seconds': params['num_ids_per_msg'] * ID_WRITE_SECONDS,
+    }
+
+    if write_capacity:
+        result['seconds'] = int(write_units / write_capacity)
+
+    return result
@@ -0,0 +1,69 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Library for splitting the population of an ingest job's upload queue into
+slices that can run in parallel.
+
+Each slice is an IngestUpload lambda invocation (see
+cloud_formation/lambda/ingest_populate/ingest_queue_upload.py) with the same
+arguments except for items_to_skip and MAX_NUM_ITEMS_PER_LAMBDA.  The tile
+count is computed in closed form, so planning does not enumerate the tiles.
+"""
+
+import math
+
+def tile_count(args):
+    """
+    Compute the total number of tiles the IngestUpload lambda enqueues for an
+    ingest job, ignoring items_to_skip and MAX_NUM_ITEMS_PER_LAMBDA.
+
+    Args:
+        args (dict): IngestUpload lambda arguments.
+
+    Returns:
+        (int): Number of tiles in the ingest job.
+    """
+    factor = lambda v: math.ceil((args[v + '_stop'] - args[v + '_start']) / args[v + '_tile_size'])
+
+    # Z is iterated by chunk, but every z slice within a chunk is a tile
+    return factor('t') * (args['z_stop'] - args['z_start']) * factor('y') * factor('x')
+
+def plan_slices(args, num_slices):
+    """
+    Split an ingest job into disjoint slices that can be populated in parallel.
+
+    More than num_slices slices are planned if needed to keep each slice at or
+    below the job's MAX_NUM_ITEMS_PER_LAMBDA.
+
+    Args:
+        args (dict): IngestUpload lambda arguments.
+        num_slices (int): Desired number of slices.
+
+    Returns:
+        (dict): {
+            'total_tiles': int,
+            'MAX_NUM_ITEMS_PER_LAMBDA': int, # Size of every slice except (possibly) the last
+            'items_to_skip': [int, ...], # Start of each slice
+        }
+    """
+    total = tile_count(args)
+    num_slices = max(num_slices, math.ceil(total / args['MAX_NUM_ITEMS_PER_LAMBDA']), 1)
+    per_slice = max(math.ceil(total / num_slices), 1)
+
+    return {
+        'total_tiles': total,
+        'MAX_NUM_ITEMS_PER_LAMBDA': per_slice,
+        'items_to_skip': list(range(0, total, per_slice)),
+    }
@@ -25,6 +25,11 @@ import yaml
 import os
 import tempfile
 import pathlib
+import importlib.util
+import threading
+import time
+import random
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pprint import pprint
 
 # Location of settings files for ndingest.
@@ -33,6 +38,78 @@ NDINGEST_SETTINGS_FOLDER = const.repo_path('salt_stack', 'salt', 'ndingest', 'fi
 # Template used for ndingest settings.ini generation.
 NDINGEST_SETTINGS_TEMPLATE = NDINGEST_SETTINGS_FOLDER + '/settings.ini.apl'
 
+# Location of the lambda build script, which contains the build hash logic
+BUILD_LAMBDA_SCRIPT = const.repo_path('salt_stack', 'salt', 'lambda-dev', 'files', 'build_lambda.py')
+
+# Per-run caches of the parsed lambda.yml files, lambda_dirs() results, and
+# layer version ARNs, as these are looked up for every lambda added to a
+# CloudFormation template
+# DP NOTE: Cached values are shared, so callers should not modify them
+CACHE_LOCK = threading.RLock()
+LAMBDA_CONFIGS = {}
+LAMBDA_DIRS = {}
+LAYER_ARNS = {}
+BUILD_LAMBDA = None
+
+def clear_caches():
+    """Clear the cached lambda configuration and layer ARNs"""
+    with CACHE_LOCK:
+        LAMBDA_CONFIGS.clear()
+        LAMBDA_DIRS.clear()
+        LAYER_ARNS.clear()
+
+def load_build_lambda():
+    """Import salt_stack/salt/lambda-dev/files/build_lambda.py as a module
+
+    Returns:
+        module: The build_lambda module
+    """
+    global BUILD_LAMBDA
+    with CACHE_LOCK:
+        if BUILD_LAMBDA is None:
+            spec = importlib.util.spec_from_file_location('build_lambda', BUILD_LAMBDA_SCRIPT)
+            BUILD_LAMBDA = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(BUILD_LAMBDA)
+        return BUILD_LAMBDA
+
+def zip_build_hash(zipname):
+    """Compute the build hash of the given lambda code zip
+
+    DP NOTE: Must match what salt_stack/salt/lambda-dev/files/build_lambda.py does
+             when computing the starting hash of the staging directory
+
+    Args:
+        zipname (str|Path): Path to the zip file that will be sent to the build process
+
+    Returns:
+        str: Hex digest of the zip file's contents
+    """
+    build_lambda = load_build_lambda()
+    with tempfile.TemporaryDirectory() as staging_dir:
+        build_lambda.unzip(zipname, staging_dir)
+        return build_lambda.tree_hash(staging_dir)
+
+def code_zip_current(bosslet_config, lambda_config, zipname):
+    """Check if the lambda code zip in S3 was built from the same inputs
+
+    Args:
+        bosslet_config: Bosslet configuration object
+        lambda_config (dict): Lambda configuration data
+        zipname (str|Path): Path to the zip file that will be sent to the build process
+
+    Returns:
+        bool: If the S3 object's build-hash metadata matches the zip file's hash
+    """
+    s3 = bosslet_config.session.client('s3')
+    try:
+        resp = s3.head_object(Bucket = bosslet_config.LAMBDA_BUCKET,
+                              Key = code_zip(bosslet_config, lambda_config))
+        existing_hash = resp['Metadata']['build-hash']
+    except Exception:
+        return False # If there was an error with the check just rebuild
+
+    return existing_hash == zip_build_hash(zipname)
+
 def load_lambda_config(lambda_dir):
     """Load the lambda.yml config file
 
@@ -43,9 +120,12 @@ def load_lambda_config(lambda_dir):
     Returns:
         dict: Dictionary of configuration file data
     """
-    lambda_config = const.repo_path('cloud_formation', 'lambda', lambda_dir, 'lambda.yml')
-    with open(lambda_config, 'r') as fh:
-        return yaml.full_load(fh.read())
+    with CACHE_LOCK:
+        if lambda_dir not in LAMBDA_CONFIGS:
+            lambda_config = const.repo_path('cloud_formation', 'lambda', lambda_dir, 'lambda.yml')
+            with open(lambda_config, 'r') as fh:
+                LAMBDA_CONFIGS[lambda_dir] = yaml.full_load(fh.read())
+        return LAMBDA_CONFIGS[lambda_dir]
 
 def lambda_dirs(bosslet_config):
     """Create a mapping of lambda name to lambda directory
@@ -59,6 +139,14 @@ def lambda_dirs(bosslet_config):
     Returns:
         dict: Mapping of lambda name to lambda directory
     """
+    with CACHE_LOCK:
+        key = bosslet_config.INTERNAL_DOMAIN
+        if key not in LAMBDA_DIRS:
+            LAMBDA_DIRS[key] = _lambda_dirs(bosslet_config)
+        return LAMBDA_DIRS[key]
+
+def _lambda_dirs(bosslet_config):
+    """Implementation of lambda_dirs() without caching"""
     n = bosslet_config.names
     # DP NOTE: Values must be the name of a directory under cloud_formation/lambdas/
     return {
@@ -82,6 +170,7 @@ def lambda_dirs(bosslet_config):
         n.delete_tile_index_entry.lambda_: 'multi_lambda',
         n.start_sfn.lambda_: 'multi_lambda',
         n.downsample_volume.lambda_: 'multi_lambda',
+        n.ingest_lambda.lambda_: 'ingest_populate',
         n.dynamo_lambda.lambda_: 'dynamodb-lambda-autoscale'
     }
 
@@ -117,11 +206,20 @@ def get_layer_arns(bosslet_config, layer_dirs):
 
     layers = []
     for layer_dir in layer_dirs:
-        layer_config = load_lambda_config(layer_dir)
-        layer_name = (layer_config['name'] + '.' + bosslet_config.INTERNAL_DOMAIN).replace('.', '-')
+        key = (bosslet_config.INTERNAL_DOMAIN, layer_dir)
+        with CACHE_LOCK:
+            arn = LAYER_ARNS.get(key)
+
+        if arn is None:
+            layer_config = load_lambda_config(layer_dir)
+            layer_name = (layer_config['name'] + '.' + bosslet_config.INTERNAL_DOMAIN).replace('.', '-')
+
+            resp = client.list_layer_versions(LayerName=layer_name)
+            arn = resp['LayerVersions'][0]['LayerVersionArn']
+
+            with CACHE_LOCK:
+                LAYER_ARNS[key] = arn
 
-        resp = client.list_layer_versions(LayerName=layer_name)
-        arn = resp['LayerVersions'][0]['LayerVersionArn']
         layers.append(arn)
 
     return layers
@@ -157,28 +255,152 @@ def s3_config(bosslet_config, lambda_name, lambda_handler):
             config['runtime'],
             layers)
 
-def update_lambda_code(bosslet_config):
+# Maximum number of lambdas to update at the same time
+MAX_CONCURRENT_UPDATES = 8
+
+# Error codes from update_function_code that are retried
+UPDATE_RETRY_ERRORS = ('ResourceConflictException',
+                       'TooManyRequestsException',
+                       'ThrottlingException')
+UPDATE_RETRIES = 6
+
+def _update_function_code(client, lambda_name, bucket, key):
+    """Update a lambda's code, retrying on conflicts and throttling, and wait
+    for the update to finish
+
+    Args:
+        client: Boto3 Lambda client
+        lambda_name (str): Name of the lambda to update
+        bucket (str): S3 bucket containing the code zip
+        key (str): S3 key of the code zip
+
+    Returns:
+        dict: Summary of the update with the keys 'name', 'version', 'status',
+              'attempts', 'seconds', and 'error'
+    """
+    result = {
+        'name': lambda_name,
+        'version': None,
+        'status': 'Failed',
+        'attempts': 0,
+        'seconds': 0,
+        'error': None,
+    }
+    start = time.time()
+
+    try:
+        delay = 1
+        while True:
+            result['attempts'] += 1
+            try:
+                resp = client.update_function_code(FunctionName=lambda_name,
+                                                   S3Bucket=bucket,
+                                                   S3Key=key,
+                                                   Publish=True)
+                break
+            except botocore.exceptions.ClientError as ex:
+                code = ex.response['Error']['Code']
+                if code not in UPDATE_RETRY_ERRORS or result['attempts'] > UPDATE_RETRIES:
+                    raise
+
+                # Exponential backoff with jitter, so updates don't retry in lock step
+                time.sleep(delay + random.uniform(0, delay))
+                delay *= 2
+
+        result['version'] = resp['Version']
+
+        waiter = client.get_waiter('function_updated')
+        waiter.wait(FunctionName=lambda_name)
+
+        result['status'] = 'Successful'
+    except (botocore.exceptions.ClientError, botocore.exceptions.WaiterError) as ex:
+        result['error'] = str(ex)
+
+    result['seconds'] = time.time() - start
+    return result
+
+def update_lambda_code(bosslet_config, max_workers = MAX_CONCURRENT_UPDATES):
     """Update all lambdas that use the multilambda zip file.
 
     Args:
         bosslet_config: Bosslet configuration object
+        max_workers (int): Maximum number of lambdas to update at the same time
+
+    Raises:
+        BossManageError: If any of the lambdas could not be updated
     """
     uses_multilambda = [k for k, v in lambda_dirs(bosslet_config).items()
                           if v == 'multi_lambda']
     config = load_lambda_config('multi_lambda')
+    key = code_zip(bosslet_config, config)
     client = bosslet_config.session.client('lambda')
-    for lambda_name in uses_multilambda:
-        try:
-            resp = client.update_function_code(
-                FunctionName=lambda_name,
-                S3Bucket=bosslet_config.LAMBDA_BUCKET,
-                S3Key=code_zip(bosslet_config, config),
-                Publish=True)
-            print(resp)
-        except botocore.exceptions.ClientError as ex:
-            print('Error updating {}: {}'.format(lambda_name, ex))
-
-BUILT_ZIPS = []
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        results = pool.map(lambda name: _update_function_code(client,
+                                                              name,
+                                                              bosslet_config.LAMBDA_BUCKET,
+                                                              key),
+                           uses_multilambda)
+        results = list(results)
+
+    width = max(len(result['name']) for result in results)
+    fmt = '{:<' + str(width) + '}  {:>7}  {:<10}  {:>8}  {:>7}'
+    print(fmt.format('Lambda', 'Version', 'Status', 'Attempts', 'Seconds'))
+    for result in sorted(results, key=lambda r: r['name']):
+        print(fmt.format(result['name'],
+                         result['version'] or '-',
+                         result['status'],
+                         result['attempts'],
+                         '{:.1f}'.format(result['seconds'])))
+
+    failed = [result for result in results if result['error'] is not None]
+    for result in failed:
+        console.error('Error updating {}: {}'.format(result['name'], result['error']))
+
+    if failed:
+        raise BossManageError("Problem updating lambda function code: {}".format(
+                              ', '.join(result['name'] for result in failed)))
+
+# Maximum number of lambda code zips to build at the same time
+MAX_CONCURRENT_BUILDS = 4
+
+# To prevent rebuilding a lambda code zip multiple times during an individual execution memorize what has been built
+BUILT_ZIPS = set()
+BUILT_ZIPS_LOCK = threading.Lock()
+
+# Files in a lambda directory that are not copied into the code zip
+# (*.min.py files, created by utils.python_minifiy(), are also skipped)
+ZIP_EXCLUDE = ('tests', '__pycache__')
+
+# create_ndingest_settings() writes into the repository, so only one build can generate it at a time
+NDINGEST_SETTINGS_LOCK = threading.Lock()
+
+# If each lambda build server accepts a per build staging name, by server address
+# DP NOTE: A build server salted before staging names were added only reads
+#          ~/staging/<domain>.zip, so builds on it have to run one at a time
+BUILD_SERVER_STAGING = {}
+BUILD_SERVER_LOCK = threading.Lock()
+LEGACY_BUILD_LOCK = threading.Lock()
+
+def build_server_staging(ssh, server):
+    """Check if the lambda build server accepts a staging name argument
+
+    Both build.sh needs to forward all of its arguments and build_lambda.py needs
+    to read the staging name. The result is cached for each server.
+
+    Args:
+        ssh (SSHConnection): Connection to the lambda build server
+        server (str): Address of the lambda build server
+
+    Returns:
+        bool: If the build server supports concurrent builds
+    """
+    with BUILD_SERVER_LOCK:
+        if server not in BUILD_SERVER_STAGING:
+            ret = ssh.cmd('grep -qF "staging name" ~/build_lambda.py && grep -qF "\\$@" ~/build.sh')
+            BUILD_SERVER_STAGING[server] = ret == 0
+        return BUILD_SERVER_STAGING[server]
+
 def load_lambdas_on_s3(bosslet_config, lambda_name = None, lambda_dir = None):
     """Package up the lambda files and send them through the lambda build process
     where the lambda code zip is produced and uploaded to S3
@@ -191,6 +413,8 @@ def load_lambdas_on_s3(bosslet_config, lambda_name = None, lambda_dir = None):
     NOTE: If lambda_name and lambda_dir are both None then lambda_dir is set to
           'multi_lambda' for backwards compatibility
 
+    NOTE: The lambda's layers are built concurrently with the lambda's code zip
+
     Args:
         bosslet_config (BossConfiguration): Configuration object of the stack the
                                             lambda will be deployed into
@@ -215,65 +439,167 @@ def load_lambdas_on_s3(bosslet_config, lambda_name = None, lambda_dir = None):
             console.error("Cannot build a lambda that doesn't use a code zip file")
             return None
 
-    # To prevent rebuilding a lambda code zip multiple times during an individual execution memorize what has been built
-    if lambda_dir in BUILT_ZIPS:
-        console.debug('Lambda code {} already built recently, skipping...'.format(lambda_dir))
-        return
-    BUILT_ZIPS.append(lambda_dir)
+    build_code_zips(bosslet_config, [lambda_dir])
 
-    lambda_dir = pathlib.Path(const.repo_path('cloud_formation', 'lambda', lambda_dir))
-    lambda_config = lambda_dir / 'lambda.yml'
-    with lambda_config.open() as fh:
-        lambda_config = yaml.full_load(fh.read())
+def load_all_lambdas_on_s3(bosslet_config, lambda_names, max_workers = MAX_CONCURRENT_BUILDS):
+    """Build the code zips for multiple lambdas concurrently
 
-    if lambda_config.get('layers'):
-        for layer in lambda_config['layers']:
+    Args:
+        bosslet_config (BossConfiguration): Configuration object of the stack the
+                                            lambdas will be deployed into
+        lambda_names (list[str]): Names of the lambdas to build
+        max_workers (int): Maximum number of code zips to build at the same time
+
+    Raises:
+        BossManageError: If there was a problem with building any of the lambda code zips
+    """
+    mapping = lambda_dirs(bosslet_config)
+    dirs = []
+    for lambda_name in lambda_names:
+        if lambda_name in mapping:
+            dirs.append(mapping[lambda_name])
+        else:
+            console.error("Cannot build lambda {} as it doesn't use a code zip file".format(lambda_name))
+
+    build_code_zips(bosslet_config, dirs, max_workers)
+
+def _expand_layers(lambda_dirs_):
+    """Add the layers used by the given lambda directories
+
+    Args:
+        lambda_dirs_ (list[str]): Names of directories in `cloud_formation/lambda/`
+
+    Returns:
+        list[str]: Unique lambda and layer directory names, layers first
+    """
+    expanded = []
+    for lambda_dir in lambda_dirs_:
+        for layer in load_lambda_config(lambda_dir).get('layers') or []:
             # Layer names should end with `layer`
             if not layer.endswith('layer'):
                 console.warning("Layer '{}' doesn't conform to naming conventions".format(layer))
 
-            load_lambdas_on_s3(bosslet_config, lambda_dir=layer)
+            if layer not in expanded:
+                expanded.append(layer)
+
+        if lambda_dir not in expanded:
+            expanded.append(lambda_dir)
+
+    return expanded
+
+def build_code_zips(bosslet_config, lambda_dirs_, max_workers = MAX_CONCURRENT_BUILDS):
+    """Build the given lambda code zips, and any layers they use, concurrently
+
+    Each code zip is only built once per execution, even if requested by multiple
+    callers or threads.
+
+    Args:
+        bosslet_config (BossConfiguration): Configuration object of the stack the
+                                            lambdas will be deployed into
+        lambda_dirs_ (list[str]): Names of directories in `cloud_formation/lambda/`
+        max_workers (int): Maximum number of code zips to build at the same time
+
+    Raises:
+        BossManageError: If there was a problem with building any of the lambda code zips
+    """
+    to_build = []
+    with BUILT_ZIPS_LOCK:
+        for lambda_dir in _expand_layers(lambda_dirs_):
+            if lambda_dir in BUILT_ZIPS:
+                console.debug('Lambda code {} already built recently, skipping...'.format(lambda_dir))
+            else:
+                BUILT_ZIPS.add(lambda_dir)
+                to_build.append(lambda_dir)
+
+    if len(to_build) == 0:
+        return
+
+    if len(to_build) == 1:
+        _build_code_zip(bosslet_config, to_build[0])
+        return
+
+    start = time.time()
+    errors = []
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = { pool.submit(_build_code_zip, bosslet_config, lambda_dir): lambda_dir
+                    for lambda_dir in to_build }
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as ex:
+                console.error('[{}] {}'.format(futures[future], ex))
+                errors.append(futures[future])
+
+    console.info("Built {} lambda code zips in {:.0f} seconds".format(len(to_build) - len(errors),
+                                                                      time.time() - start))
+    if errors:
+        raise BossManageError("Problem building lambda code zips: {}".format(', '.join(errors)))
+
+def _build_code_zip(bosslet_config, lambda_dir):
+    """Build a single lambda code zip
+
+    Args:
+        bosslet_config (BossConfiguration): Configuration object of the stack the
+                                            lambda will be deployed into
+        lambda_dir (str): Name of the directory in `cloud_formation/lambda/` that
+                          contains the `lambda.yml` configuration file for the lambda
+
+    Raises:
+        BossManageError: If there was a problem with building the lambda code zip or
+                         uploading it to the given S3 bucket
+    """
+    prefix = '[{}] '.format(lambda_dir)
+    lambda_config = load_lambda_config(lambda_dir)
+    lambda_dir = pathlib.Path(const.repo_path('cloud_formation', 'lambda', lambda_dir))
 
-    console.debug("Building {} lambda code zip".format(lambda_dir))
+    console.debug(prefix + "Building {} lambda code zip".format(lambda_dir))
 
     domain = bosslet_config.INTERNAL_DOMAIN
     tempname = tempfile.NamedTemporaryFile(delete=True)
     zipname = pathlib.Path(tempname.name + '.zip')
     tempname.close()
-    console.debug('Using temp zip file: {}'.format(zipname))
-
-    cwd = os.getcwd()
+    console.debug(prefix + 'Using temp zip file: {}'.format(zipname))
 
     # Copy the lambda files into the zip
     for filename in lambda_dir.glob('*'):
+        if filename.name in ZIP_EXCLUDE or filename.name.endswith('.min.py'):
+            continue
         zip.write_to_zip(str(filename), zipname, arcname=filename.name)
 
     # Copy the other files that should be included
+    # DP NOTE: Full paths are used instead of changing the working directory
+    #          as the working directory is shared between build threads
     if lambda_config.get('include'):
         for src in lambda_config['include']:
             dst = lambda_config['include'][src]
             src_path, src_file = src.rsplit('/', 1)
 
-            os.chdir(const.repo_path(src_path))
-
             # Generate dynamic configuration files, as needed
             if src_file == 'ndingest.git':
-                with open(NDINGEST_SETTINGS_TEMPLATE, 'r') as tmpl:
+                with NDINGEST_SETTINGS_LOCK, open(NDINGEST_SETTINGS_TEMPLATE, 'r') as tmpl:
                     # Generate settings.ini file for ndingest.
                     create_ndingest_settings(bosslet_config, tmpl)
 
-            zip.write_to_zip(src_file, zipname, arcname=dst)
-            os.chdir(cwd)
+            src = os.path.join(const.repo_path(src_path), src_file)
+            zip.write_to_zip(src, zipname, arcname=dst)
+
+    # Check the input hash locally, to skip copying the zip to the build process
+    if code_zip_current(bosslet_config, lambda_config, zipname):
+        console.info(prefix + "Input hash matches existing S3 object, not rebuilding")
+        os.remove(zipname)
+        return
 
     # Currently any Docker CLI compatible container setup can be used (like podman)
     CONTAINER_CMD = '{EXECUTABLE} run --rm -it --env AWS_ACCESS_KEY_ID={AWS_ACCESS_KEY_ID} --env AWS_SECRET_ACCESS_KEY={AWS_SECRET_ACCESS_KEY} --volume {HOST_DIR}:/var/task/ lambci/lambda:build-{RUNTIME} {CMD}'
     #CONTAINER_CMD = '{EXECUTABLE} run --rm -it --volume {HOST_DIR}:/var/task/ lambci/lambda:build-{RUNTIME} {CMD}'
 
-    #BUILD_CMD = 'python3 {PREFIX}/build_lambda.py {DOMAIN} {BUCKET}'
-    BUILD_CMD = '{PREFIX}/build.sh {DOMAIN} {BUCKET}'
+    #BUILD_CMD = 'python3 {PREFIX}/build_lambda.py {DOMAIN} {BUCKET} {STAGING}'
+    BUILD_CMD = '{PREFIX}/build.sh {DOMAIN} {BUCKET} {STAGING}'
     BUILD_ARGS = {
         'DOMAIN': domain,
         'BUCKET': bosslet_config.LAMBDA_BUCKET,
+        # Each build needs its own staging zip / directory so builds can run concurrently
+        'STAGING': '{}.{}'.format(domain, lambda_dir.name),
     }
 
     # DP NOTE: not sure if this should be in the bosslet_config, as it is more about the local dev
@@ -283,17 +609,16 @@ def load_lambdas_on_s3(bosslet_config, lambda_name = None, lambda_dir = None):
     lambda_build_server = bosslet_config.LAMBDA_SERVER
     if lambda_build_server is None:
         staging_target = pathlib.Path(const.repo_path('salt_stack', 'salt', 'lambda-dev', 'files', 'staging'))
-        if not staging_target.exists():
-            staging_target.mkdir()
+        staging_target.mkdir(exist_ok=True)
 
-        console.debug("Copying build zip to {}".format(staging_target))
-        staging_zip = staging_target / (domain + '.zip')
+        console.debug(prefix + "Copying build zip to {}".format(staging_target))
+        staging_zip = staging_target / (BUILD_ARGS['STAGING'] + '.zip')
         try:
             zipname.rename(staging_zip)
         except OSError:
             # rename only works within the same filesystem
             # Using the shell version, as using copy +  chmod doesn't always work depending on the filesystem
-            utils.run('mv {} {}'.format(zipname, staging_zip), shell=True)
+            utils.run('mv {} {}'.format(zipname, staging_zip), shell=True, prefix=prefix)
 
         # Provide the AWS Region and Credentials (for S3 upload) via environmental variables
         env_extras = { 'AWS_REGION': bosslet_config.REGION,
@@ -306,7 +631,7 @@ def load_lambdas_on_s3(bosslet_config, lambda_name = None, lambda_dir = None):
             if bosslet_config.PROFILE is not None:
                 env_extras['AWS_PROFILE'] = bosslet_config.PROFILE
 
-            console.info("calling build lambda on localhost")
+            console.info(prefix + "calling build lambda on localhost")
         else:
             # Cannot set the profile as the container will not have the credentials file
             # So extract the underlying keys and provide those instead
@@ -325,10 +650,10 @@ def load_lambdas_on_s3(bosslet_config, lambda_name = None, lambda_dir = None):
                                        RUNTIME = lambda_config['runtime'],
                                        CMD = CMD)
 
-            console.info("calling build lambda in {}".format(container_executable))
+            console.info(prefix + "calling build lambda in {}".format(container_executable))
 
         try:
-            utils.run(CMD, env_extras=env_extras)
+            utils.run(CMD, env_extras=env_extras, prefix=prefix)
         except Exception as ex:
             raise BossManageError("Problem building {} lambda code zip: {}".format(lambda_dir, ex))
         finally:
@@ -343,18 +668,34 @@ def load_lambdas_on_s3(bosslet_config, lambda_name = None, lambda_dir = None):
         bastions = [bosslet_config.outbound_bastion] if bosslet_config.outbound_bastion else []
         ssh = SSHConnection(ssh_target, bastions)
 
-        console.debug("Copying build zip to lambda-build-server")
-        target_file = '~/staging/{}.zip'.format(domain)
-        ret = ssh.scp(zipname, target_file, upload=True)
-        console.debug("scp return code: " + str(ret))
+        if build_server_staging(ssh, lambda_build_server):
+            build_lock = threading.Lock() # Not shared, builds run concurrently
+        else:
+            console.warning(prefix + "Lambda build server doesn't support concurrent builds, re-salt it to update build.sh and build_lambda.py")
+            build_lock = LEGACY_BUILD_LOCK
+            BUILD_ARGS['STAGING'] = domain
+            CMD = BUILD_CMD.format(**BUILD_ARGS)
 
-        os.remove(zipname)
+        with build_lock:
+            console.debug(prefix + "Copying build zip to lambda-build-server")
+            target_file = '~/staging/{}.zip'.format(BUILD_ARGS['STAGING'])
+            ret = ssh.scp(zipname, target_file, upload=True)
+            console.debug(prefix + "scp return code: " + str(ret))
+
+            os.remove(zipname)
 
-        console.info("calling build lambda on lambda-build-server")
-        ret = ssh.cmd(CMD)
+            console.info(prefix + "calling build lambda on lambda-build-server")
+            ret = ssh.cmd(CMD, prefix=prefix)
         if ret != 0:
             raise BossManageError("Problem building {} lambda code zip: Return code: {}".format(lambda_dir, ret))
 
+    if lambda_config.get('is_layer', False):
+        # A new layer version was published, so the cached ARN is out of date
+        with CACHE_LOCK:
+            LAYER_ARNS.pop((domain, lambda_dir.name), None)
+
+    console.info(prefix + "Finished building lambda code zip")
+
 def create_ndingest_settings(bosslet_config, fp):
     """Create the settings.ini file for ndingest.
 
@@ -438,6 +779,56 @@ def download_lambda_zip(bosslet_config, lambda_name, path):
             layer_config = load_lambda_config(layer)
             download(code_zip(bosslet_config, layer_config))
 
+# Maximum unzipped size of a lambda's code and layers
+LAMBDA_UNZIPPED_LIMIT = 250 * 1024 * 1024
+
+def analyze_lambda_zip(bosslet_config, lambda_name, zip_path = None):
+    """
+    Report the uncompressed size of a lambda code zip, and its layers, by top level
+    package and file type, and the files that the build_lambda.py slimming stage
+    would remove.
+
+    Args:
+        bosslet_config: Bosslet configuration object
+        lambda_name (str): Name of the lambda to analyze
+        zip_path (optional[str]): Local code zip to analyze instead of downloading
+                                  the lambda's code zip from S3
+    """
+    build_lambda = load_build_lambda()
+    lambda_dir = lambda_dirs(bosslet_config)[lambda_name]
+    lambda_config = load_lambda_config(lambda_dir)
+
+    zip_names = [code_zip(bosslet_config, lambda_config)]
+    for layer in lambda_config.get('layers') or []:
+        zip_names.append(code_zip(bosslet_config, load_lambda_config(layer)))
+
+    s3 = bosslet_config.session.client('s3')
+    total = 0
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for zip_name in zip_names:
+            if zip_path is not None and zip_name == zip_names[0]:
+                local_zip = zip_path
+            else:
+                local_zip = os.path.join(temp_dir, zip_name)
+                s3.download_file(bosslet_config.LAMBDA_BUCKET, zip_name, local_zip)
+
+            unzip_dir = os.path.join(temp_dir, zip_name + '.d')
+            os.mkdir(unzip_dir)
+            build_lambda.unzip(local_zip, unzip_dir)
+
+            console.blue("\n{}".format(zip_name))
+            report = build_lambda.analyze_tree(unzip_dir)
+            build_lambda.print_analysis(report)
+            total += report['total']
+
+    print()
+    msg = "Total unzipped size {} of {} limit".format(build_lambda.format_size(total),
+                                                      build_lambda.format_size(LAMBDA_UNZIPPED_LIMIT))
+    if total > LAMBDA_UNZIPPED_LIMIT * 0.9:
+        console.warning(msg)
+    else:
+        console.info(msg)
+
 def upload_lambda_zip(bosslet_config, path):
     """
     Upload a  multilambda.domain.zip to the S3 bucket.  Useful when
@@ -23,6 +23,7 @@ import random
 from contextlib import contextmanager
 
 from .exceptions import SSHError, SSHTunnelError
+from . import utils
 
 # Needed to prevent ssh from asking about the fingerprint from new machines
 SSH_OPTIONS = "-o UserKnownHostsFile=/dev/null -o StrictHostKeyChecking=no -o PubkeyAcceptedKeyTypes=+ssh-rsa -q"
@@ -356,17 +357,21 @@ class SSHConnection(object):
             cmd("command to execute")
         """
         with self._connect() as target:
-            def cmd(command):
+            def cmd(command, prefix=None):
                 ssh_cmd_str = "ssh -i {} {} -p {} {}@{} '{}'" \
                                     .format(target.key, SSH_OPTIONS, target.port, target.user, target.ip, command)
 
-                ret = subprocess.call(shlex.split(ssh_cmd_str))
+                if prefix is None:
+                    ret = subprocess.call(shlex.split(ssh_cmd_str))
+                else:
+                    # Capture the output to prefix each line
+                    ret = utils.run(ssh_cmd_str, checkreturn=False, prefix=prefix)
                 check_ssh(ret)
                 return ret
 
             yield cmd
 
-    def cmd(self, command = None):
+    def cmd(self, command = None, prefix = None):
         """Create SSH tunnel(s) through bastion machine(s) and execute a command over
         SSH.
 
@@ -379,13 +384,16 @@ class SSHConnection(object):
             command (None|string) : Command to execute on remote_ip. If command is
                                     None, then prompt the user for the command to
                                     execute.
+            prefix (None|string) : String to prepend to each line of output, used to
+                                   identify the output of commands that are run
+                                   concurrently.
         """
 
         if command is None:
             command = input("command: ")
 
         with self.cmds() as cmd:
-            return cmd(command)
+            return cmd(command, prefix)
 
     @contextmanager
     def tunnel(self):
@@ -0,0 +1,75 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import unittest
+
+# Allow unit test files to import the target library modules
+cur_dir = os.path.dirname(os.path.realpath(__file__))
+parent_dir = os.path.normpath(os.path.join(cur_dir, '..', '..'))
+sys.path.append(parent_dir)
+
+from lib import index_tuning
+
+
+class TestIndexTuning(unittest.TestCase):
+    def profile(self, cuboids, ids_per_cuboid):
+        return {
+            'cuboids': cuboids,
+            'cuboids_exact': True,
+            'ids_per_cuboid': ids_per_cuboid,
+            'sampled': 100,
+        }
+
+    def test_simulate_counts(self):
+        params = dict(index_tuning.DEFAULT_PARAMS, num_ids_per_msg = 10, id_chunk_size = 25)
+        result = index_tuning.simulate(1000, 60, params)
+
+        # Chunks of 25, 25, 10 ids => 3 + 3 + 1 messages per cuboid
+        self.assertEqual(result['id_messages'], 7000)
+        self.assertEqual(result['id_writer_executions'], 7000)
+        self.assertEqual(result['cuboid_messages'], 1000)
+        self.assertEqual(result['find_cuboids_pages'], 5)
+        self.assertEqual(result['id_updates'], 60000)
+
+    def test_simulate_duration(self):
+        result = index_tuning.simulate(1000, 10, index_tuning.DEFAULT_PARAMS, write_capacity = 100)
+        self.assertEqual(result['seconds'], result['write_units'] // 100)
+
+    def test_tune_params_within_limits(self):
+        for cuboids in [0, 10, 100000, 10000000]:
+            for density in [None, 1, 20, 500, 100000]:
+                with self.subTest(cuboids = cuboids, density = density):
+                    params = index_tuning.tune_params(self.profile(cuboids, density))
+
+                    self.assertEqual(set(params), set(index_tuning.DEFAULT_PARAMS))
+                    for key, (low, high) in index_tuning.PARAM_LIMITS.items():
+                        self.assertGreaterEqual(params[key], low)
+                        self.assertLessEqual(params[key], high)
+
+    def test_tune_params_unknown_density(self):
+        params = index_tuning.tune_params(self.profile(100000, None))
+        for key in ['num_ids_per_msg', 'id_chunk_size', 'wait_time', 'id_index_new_chunk_threshold']:
+            self.assertEqual(params[key], index_tuning.DEFAULT_PARAMS[key])
+
+    def test_tune_params_not_worse_than_default(self):
+        for density in [1, 20, 500, 5000]:
+            with self.subTest(density = density):
+                params = index_tuning.tune_params(self.profile(100000, density))
+                tuned = index_tuning.simulate(100000, density, params)
+                default = index_tuning.simulate(100000, density, index_tuning.DEFAULT_PARAMS)
+
+                self.assertLessEqual(tuned['cost'], default['cost'])
+                self.assertLessEqual(tuned['id_writer_seconds'], index_tuning.MAX_ID_WRITER_SECONDS)
@@ -0,0 +1,84 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import random
+import sys
+import unittest
+
+# Allow unit test files to import the target library modules
+cur_dir = os.path.dirname(os.path.realpath(__file__))
+parent_dir = os.path.normpath(os.path.join(cur_dir, '..', '..'))
+sys.path.append(parent_dir)
+sys.path.append(os.path.join(parent_dir, 'cloud_formation', 'lambda', 'ingest_populate'))
+
+from lib import ingest_slices
+import ingest_queue_upload as iqu
+
+
+class TestIngestSlices(unittest.TestCase):
+    def tile_keys(self, args):
+        return [json.loads(msg)['tile_key'] for msg in iqu.create_messages(args)]
+
+    def test_plan_slices_cover_all_tiles(self):
+        """
+        Property test of plan_slices() against the IngestUpload lambda.  For
+        randomly generated (but reproducible) ingest geometries, the planned
+        total must equal the number of tiles the lambda enqueues and the
+        planned slices must produce every tile exactly once.
+        """
+        rand = random.Random(42)
+        for _ in range(40):
+            args = {
+                "x_start": 0, "x_stop": rand.randint(1, 2600), "x_tile_size": rand.choice([256, 512, 1024]),
+                "y_start": 0, "y_stop": rand.randint(1, 2600), "y_tile_size": rand.choice([256, 512, 1024]),
+                "z_start": 0, "z_stop": rand.randint(1, 40), "z_tile_size": 1,
+                "t_start": 0, "t_stop": rand.randint(1, 3), "t_tile_size": 1,
+                "project_info": ["3", "3", "3"],
+                "ingest_queue": "https://queue.amazonaws.com/...",
+                "upload_queue": "https://queue.amazonaws.com/...",
+                "job_id": 11,
+                "resolution": 0,
+                "items_to_skip": 0,
+                'MAX_NUM_ITEMS_PER_LAMBDA': rand.randint(1, 3000),
+                'z_chunk_size': 16
+            }
+            num_slices = rand.randint(1, 8)
+
+            with self.subTest(args=args, num_slices=num_slices):
+                expected = self.tile_keys(dict(args, MAX_NUM_ITEMS_PER_LAMBDA=10**9))
+
+                plan = ingest_slices.plan_slices(args, num_slices)
+                self.assertEqual(plan['total_tiles'], len(expected))
+                self.assertLessEqual(plan['MAX_NUM_ITEMS_PER_LAMBDA'], args['MAX_NUM_ITEMS_PER_LAMBDA'])
+                self.assertGreaterEqual(len(plan['items_to_skip']), min(num_slices, len(expected)))
+
+                actual = []
+                for skip in plan['items_to_skip']:
+                    actual.extend(self.tile_keys(dict(args,
+                                                      items_to_skip=skip,
+                                                      MAX_NUM_ITEMS_PER_LAMBDA=plan['MAX_NUM_ITEMS_PER_LAMBDA'])))
+
+                self.assertEqual(actual, expected)
+
+    def test_tile_count_partial_tiles(self):
+        """Partial tiles at the edge of the volume should be counted"""
+        args = {
+            "x_start": 0, "x_stop": 1025, "x_tile_size": 512,
+            "y_start": 0, "y_stop": 512, "y_tile_size": 512,
+            "z_start": 0, "z_stop": 17, "z_tile_size": 1,
+            "t_start": 0, "t_stop": 2, "t_tile_size": 1,
+        }
+        self.assertEqual(ingest_slices.tile_count(args), 3 * 1 * 17 * 2)
@@ -226,7 +226,7 @@ def parse_hostname(hostname):
 
     return (idx, machine, bosslet_name)
 
-def run(cmd, input=None, env_extras=None, checkreturn=True, shell=False, **kwargs):
+def run(cmd, input=None, env_extras=None, checkreturn=True, shell=False, prefix='', **kwargs):
     """Run a command and stream the output
 
     Args:
@@ -234,6 +234,8 @@ def run(cmd, input=None, env_extras=None, checkreturn=True, shell=False, **kwarg
         input (optional[str]): String with data to sent to the processes stdin
         env_extras (optional[dict]): Dictionary of extra environmental variable to provide
         checkreturn (bool): If the return code should be checked and an exception raised if not zero
+        prefix (str): String to prepend to each line of output, used to identify the
+                      output of commands that are run concurrently
         kwargs: Other arguments to pass to the Popen constructor
 
     Return:
@@ -264,7 +266,7 @@ def run(cmd, input=None, env_extras=None, checkreturn=True, shell=False, **kwarg
         proc.stdin.close()
 
     for line in proc.stdout:
-        print(line.decode('utf8'), end='', flush=True)
+        print(prefix + line.decode('utf8'), end='', flush=True)
 
     while proc.poll() is None:
         time.sleep(1) # sometimes stdout is closed before the process has completely finished
@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# A script to backup and restore DynamoDB tables without an EMR cluster
+#
+# Each table is exported using a parallel segmented scan. Every segment is
+# written as a gzip compressed JSON Lines shard (one item per line, in the
+# DynamoDB attribute value format with binary values base64 encoded) that is
+# streamed to S3 using a multipart upload. A manifest.json with the item count
+# and SHA256 checksum of each shard is written last, so a backup without a
+# manifest is incomplete.
+#
+# Restore verifies each shard against the manifest before loading it (the
+# shard is spooled to a local temporary file) and loads the items using
+# parallel BatchWriteItem calls, retrying any unprocessed items.
+#
+# Layout:
+#   <destination>/<table>/manifest.json
+#   <destination>/<table>/part-00000.jsonl.gz
+#   ...
+#
+# The destination can be a s3://bucket/prefix URI or a local directory, and
+# --endpoint-url can point at DynamoDB Local, for testing without AWS.
+#
+# Usage: ddb.py (backup|restore) destination table [table ...]
+
+import argparse
+import base64
+import gzip
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import boto3
+
+MANIFEST_VERSION = 1
+MANIFEST = 'manifest.json'
+
+# Number of parallel scan segments / shards per table
+DEFAULT_SEGMENTS = 8
+
+# Size of each multipart upload part (S3 requires at least 5MB)
+PART_SIZE = 16 * 1024 * 1024
+
+# Maximum number of items in a BatchWriteItem call
+BATCH_SIZE = 25
+
+# Seconds to wait before resubmitting unprocessed items
+MIN_BACKOFF = 0.05
+MAX_BACKOFF = 20
+
+def encode_value(value):
+    """Convert a DynamoDB attribute value into a JSON serializable value"""
+    type_, data = next(iter(value.items()))
+    if type_ == 'B':
+        data = base64.b64encode(data).decode('ascii')
+    elif type_ == 'BS':
+        data = [base64.b64encode(d).decode('ascii') for d in data]
+    elif type_ == 'M':
+        data = {k: encode_value(v) for k, v in data.items()}
+    elif type_ == 'L':
+        data = [encode_value(v) for v in data]
+    return {type_: data}
+
+def decode_value(value):
+    """Reverse of encode_value"""
+    type_, data = next(iter(value.items()))
+    if type_ == 'B':
+        data = base64.b64decode(data)
+    elif type_ == 'BS':
+        data = [base64.b64decode(d) for d in data]
+    elif type_ == 'M':
+        data = {k: decode_value(v) for k, v in data.items()}
+    elif type_ == 'L':
+        data = [decode_value(v) for v in data]
+    return {type_: data}
+
+class ShardWriter(object):
+    """File like object that checksums the data written to a shard"""
+    def __init__(self):
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.size += len(data)
+        self.sha256.update(data)
+        self._write(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+class FileWriter(ShardWriter):
+    def __init__(self, path):
+        super().__init__()
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        self.fh = open(path, 'wb')
+
+    def _write(self, data):
+        self.fh.write(data)
+
+    def close(self):
+        self.fh.close()
+
+    def abort(self):
+        self.fh.close()
+        os.remove(self.fh.name)
+
+class S3Writer(ShardWriter):
+    """Streams the shard to S3 as a multipart upload"""
+    def __init__(self, client, bucket, key):
+        super().__init__()
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.buffer = bytearray()
+        self.parts = []
+        self.upload_id = client.create_multipart_upload(Bucket = bucket,
+                                                        Key = key)['UploadId']
+
+    def _write(self, data):
+        self.buffer.extend(data)
+        if len(self.buffer) >= PART_SIZE:
+            self._upload_part()
+
+    def _upload_part(self):
+        number = len(self.parts) + 1
+        resp = self.client.upload_part(Bucket = self.bucket,
+                                       Key = self.key,
+                                       UploadId = self.upload_id,
+                                       PartNumber = number,
+                                       Body = bytes(self.buffer))
+        self.parts.append({'ETag': resp['ETag'], 'PartNumber': number})
+        self.buffer = bytearray()
+
+    def close(self):
+        if len(self.buffer) > 0 or len(self.parts) == 0:
+            self._upload_part()
+        self.client.complete_multipart_upload(Bucket = self.bucket,
+                                              Key = self.key,
+                                              UploadId = self.upload_id,
+                                              MultipartUpload = {'Parts': self.parts})
+
+    def abort(self):
+        self.client.abort_multipart_upload(Bucket = self.bucket,
+                                           Key = self.key,
+                                           UploadId = self.upload_id)
+
+class ShardReader(object):
+    """File like object that checksums the data read from a shard"""
+    def __init__(self, fh):
+        self.fh = fh
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size = -1):
+        data = self.fh.read(size) if size is not None and size >= 0 else self.fh.read()
+        self.sha256.update(data)
+        return data
+
+    def drain(self):
+        """Read the rest of the shard, so the checksum covers all of it"""
+        while len(self.read(PART_SIZE)) > 0:
+            pass
+        self.fh.close()
+
+    def verified(self, entry):
+        """Copy the shard into a temporary file and check it against the manifest
+
+        Args:
+            entry (dict): Manifest entry for the shard
+
+        Returns:
+            (file): Temporary file holding the shard, positioned at the start
+        """
+        tmp = tempfile.TemporaryFile()
+        try:
+            while True:
+                data = self.read(PART_SIZE)
+                if len(data) == 0:
+                    break
+                tmp.write(data)
+            self.fh.close()
+
+            if self.sha256.hexdigest() != entry['sha256']:
+                raise Exception("{}: checksum does not match the manifest".format(entry['key']))
+        except:
+            tmp.close()
+            raise
+
+        tmp.seek(0)
+        return tmp
+
+class Location(object):
+    """A s3://bucket/prefix URI or local directory holding backups"""
+    def __init__(self, uri, session):
+        if uri.startswith('s3://'):
+            self.bucket, _, self.prefix = uri[5:].partition('/')
+            self.prefix = self.prefix.strip('/')
+            self.client = session.client('s3')
+        else:
+            self.bucket = None
+            self.prefix = uri
+
+    def _key(self, name):
+        if self.bucket is None:
+            return os.path.join(self.prefix, name)
+        return '/'.join(p for p in (self.prefix, name) if p)
+
+    def writer(self, name):
+        if self.bucket is None:
+            return FileWriter(self._key(name))
+        return S3Writer(self.client, self.bucket, self._key(name))
+
+    def reader(self, name):
+        if self.bucket is None:
+            return ShardReader(open(self._key(name), 'rb'))
+        resp = self.client.get_object(Bucket = self.bucket, Key = self._key(name))
+        return ShardReader(resp['Body'])
+
+    def write_json(self, name, data):
+        body = json.dumps(data, indent = 2, sort_keys = True).encode('utf-8')
+        if self.bucket is None:
+            with open(self._key(name), 'wb') as fh:
+                fh.write(body)
+        else:
+            self.client.put_object(Bucket = self.bucket, Key = self._key(name), Body = body)
+
+    def read_json(self, name):
+        reader = self.reader(name)
+        data = json.loads(reader.read().decode('utf-8'))
+        reader.fh.close()
+        return data
+
+def backup_segment(client, location, table, segment, segments):
+    """Export one scan segment of a table into a shard
+
+    Returns:
+        (dict): Manifest entry for the shard
+    """
+    name = '{}/part-{:05d}.jsonl.gz'.format(table, segment)
+    writer = location.writer(name)
+    count = 0
+    try:
+        with gzip.GzipFile(fileobj = writer, mode = 'wb') as gz:
+            paginator = client.get_paginator('scan')
+            for page in paginator.paginate(TableName = table,
+                                           Segment = segment,
+                                           TotalSegments = segments):
+                for item in page['Items']:
+                    item = {k: encode_value(v) for k, v in item.items()}
+                    gz.write(json.dumps(item, separators = (',', ':')).encode('utf-8'))
+                    gz.write(b'\n')
+                    count += 1
+        writer.close()
+    except:
+        writer.abort()
+        raise
+
+    return {
+        'key': name.split('/', 1)[1],
+        'items': count,
+        'bytes': writer.size,
+        'sha256': writer.sha256.hexdigest(),
+    }
+
+def backup_table(session, location, table, segments, endpoint_url=None):
+    client = session.client('dynamodb', endpoint_url = endpoint_url)
+    desc = client.describe_table(TableName = table)['Table']
+
+    print("Backing up {} (~{} items) using {} segments".format(table, desc['ItemCount'], segments))
+    start = time.time()
+    with ThreadPoolExecutor(max_workers = segments) as executor:
+        shards = list(executor.map(lambda s: backup_segment(client, location, table, s, segments),
+                                   range(segments)))
+
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'table': table,
+        'created': datetime.utcnow().isoformat() + 'Z',
+        'key_schema': desc['KeySchema'],
+        'attribute_definitions': desc['AttributeDefinitions'],
+        'items': sum(shard['items'] for shard in shards),
+        'bytes': sum(shard['bytes'] for shard in shards),
+        'shards': shards,
+    }
+    location.write_json('{}/{}'.format(table, MANIFEST), manifest)
+
+    print("Backed up {} items ({} bytes) from {} in {:.0f} seconds".format(
+            manifest['items'], manifest['bytes'], table, time.time() - start))
+    return manifest
+
+def write_batch(client, table, requests):
+    """Write the requests, resubmitting unprocessed items with backoff"""
+    delay = MIN_BACKOFF
+    while len(requests) > 0:
+        resp = client.batch_write_item(RequestItems = {table: requests})
+        requests = resp.get('UnprocessedItems', {}).get(table, [])
+        if len(requests) > 0:
+            time.sleep(delay)
+            delay = min(delay * 2, MAX_BACKOFF)
+
+def restore_shard(client, location, table, shard):
+    """Load one shard into the table
+
+    The shard is verified before any of its items are written, so a corrupt
+    shard is never partially restored.
+
+    Returns:
+        (int): Number of items written
+    """
+    reader = location.reader('{}/{}'.format(table, shard['key']))
+    entry = dict(shard, key = '{}/{}'.format(table, shard['key']))
+    count = 0
+    batch = []
+    with reader.verified(entry) as fh, gzip.GzipFile(fileobj = fh, mode = 'rb') as gz:
+        for line in gz:
+            item = json.loads(line.decode('utf-8'))
+            item = {k: decode_value(v) for k, v in item.items()}
+            batch.append({'PutRequest': {'Item': item}})
+            if len(batch) == BATCH_SIZE:
+                write_batch(client, table, batch)
+                count += len(batch)
+                batch = []
+    if len(batch) > 0:
+        write_batch(client, table, batch)
+        count += len(batch)
+
+    if count != shard['items']:
+        raise Exception("{}: restored {} items, manifest has {}".format(entry['key'], count, shard['items']))
+    return count
+
+def restore_table(session, location, table, workers, endpoint_url=None):
+    client = session.client('dynamodb', endpoint_url = endpoint_url)
+    manifest = location.read_json('{}/{}'.format(table, MANIFEST))
+    if manifest['version'] != MANIFEST_VERSION:
+        raise Exception("{}: unsupported manifest version {}".format(table, manifest['version']))
+
+    print("Restoring {} items into {} from {} shards".format(manifest['items'], table, len(manifest['shards'])))
+    start = time.time()
+    with ThreadPoolExecutor(max_workers = workers) as executor:
+        count = sum(executor.map(lambda s: restore_shard(client, location, table, s),
+                                 manifest['shards']))
+
+    print("Restored {} items into {} in {:.0f} seconds".format(count, table, time.time() - start))
+    return count
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Backup or restore DynamoDB tables")
+    parser.add_argument('action', choices = ['backup', 'restore'])
+    parser.add_argument('destination', help = 's3://bucket/prefix or local directory')
+    parser.add_argument('tables', nargs = '+', help = 'DynamoDB table names')
+    parser.add_argument('--segments', type = int, default = DEFAULT_SEGMENTS,
+                        help = 'Parallel scan segments (backup) or workers (restore) per table')
+    parser.add_argument('--region', default = None, help = 'AWS region')
+    parser.add_argument('--endpoint-url', default = None,
+                        help = 'DynamoDB endpoint, for using DynamoDB Local')
+    args = parser.parse_args()
+
+    session = boto3.session.Session(region_name = args.region)
+    location = Location(args.destination, session)
+
+    for table in args.tables:
+        if args.action == 'backup':
+            backup_table(session, location, table, args.segments, args.endpoint_url)
+        else:
+            restore_table(session, location, table, args.segments, args.endpoint_url)
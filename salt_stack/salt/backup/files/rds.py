@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# A script to backup and restore a RDS MySQL database using parallel
+# mysqldump / mysql streams. Replaces rds.sh, which is kept to restore
+# backups taken before this script existed.
+#
+# Backup:
+#   * The schema is dumped into schema.sql.gz and the triggers into
+#     triggers.sql.gz
+#   * The tables are split into --workers groups of about the same size and
+#     each group is dumped by its own mysqldump --single-transaction into a
+#     gzip compressed shard
+#   * For a consistent snapshot across the groups, another session holds
+#     LOCK TABLES ... READ on every table until each mysqldump has started
+#     its transaction, so no writes can happen between the snapshots
+#   * A manifest.json with the size and SHA256 checksum of each shard is
+#     written last, so a backup without a manifest is incomplete
+#
+# Restore:
+#   * The schema is loaded without the secondary indexes and foreign keys
+#   * The shards are verified and loaded in parallel
+#   * The deferred indexes and foreign keys are added back, one ALTER TABLE
+#     per table, in parallel
+#   * The triggers are created last, so they don't fire for the restored rows
+#
+# Usage: rds.py (backup|restore) hostname.domain.tld destination
+
+import argparse
+import gzip
+import json
+import os
+import re
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import boto3
+
+# Shared with the DynamoDB backup script
+from ddb import Location
+
+# Version 2 added the separate triggers file
+MANIFEST_VERSION = 2
+MANIFEST = 'manifest.json'
+SCHEMA = 'schema.sql.gz'
+TRIGGERS = 'triggers.sql.gz'
+
+# Number of parallel dump / restore streams
+DEFAULT_WORKERS = 4
+
+# Size of the chunks read from / written to the mysql processes
+CHUNK_SIZE = 1024 * 1024
+
+# Seconds to wait for all of the dumps to start their transactions
+SNAPSHOT_TIMEOUT = 300
+
+# Written by mysqldump after it has started its transaction
+DATA_MARKER = b'-- Dumping data for table'
+
+# Vault paths containing the database credentials
+VAULT_PATHS = {
+    'endpoint-db': 'secret/endpoint/django/db',
+    'auth-db': 'secret/keycloak/db',
+}
+
+# CREATE TABLE lines that can be added after the data is loaded
+DEFERRABLE = ('KEY ', 'UNIQUE KEY ', 'FULLTEXT KEY ', 'SPATIAL KEY ', 'CONSTRAINT ')
+
+def option_value(value):
+    """Quote a value for a MySQL option file"""
+    value = value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '"{}"'.format(value)
+
+class MySQL(object):
+    """Builds mysql / mysqldump commands for a database
+
+    The credentials are written to a defaults file, so they are not visible
+    in the process list.
+    """
+    def __init__(self, host, user, password, database):
+        self.database = database
+        fd, self.defaults = tempfile.mkstemp(suffix = '.cnf')
+        with os.fdopen(fd, 'w') as fh:
+            fh.write("[client]\nhost={}\nuser={}\npassword={}\n".format(option_value(host),
+                                                                      option_value(user),
+                                                                      option_value(password)))
+
+    def command(self, program, *args):
+        return [program, '--defaults-extra-file=' + self.defaults] + list(args)
+
+    def query(self, sql):
+        """Run the SQL and return the rows of tab separated columns"""
+        output = subprocess.check_output(self.command('mysql', '--batch', '--skip-column-names',
+                                                      '-e', sql, self.database),
+                                         universal_newlines = True)
+        return [line.split('\t') for line in output.splitlines()]
+
+    def close(self):
+        os.remove(self.defaults)
+
+def load_credentials(hostname):
+    """Read the database credentials from Vault"""
+    from bossutils.vault import Vault
+
+    name, domain = hostname.split('.', 1)
+    path = VAULT_PATHS.get(name)
+    if path is None:
+        raise Exception("Unsupported hostname {}".format(hostname))
+
+    # create a basic boss.config so that bossutils.vault
+    # can correctly connect to and authenticate to Vault
+    with open("/etc/boss/boss.config", "w") as fh:
+        fh.write("""[system]
+type = backup
+
+[vault]
+url = http://vault.{}:8200
+token =
+""".format(domain))
+
+    creds = Vault().read_dict(path)
+    return creds['user'], creds['password'], creds['name']
+
+def split_tables(sizes, workers):
+    """Split the tables into groups of about the same total size
+
+    Args:
+        sizes (dict): Mapping of table name to size in bytes
+        workers (int): Maximum number of groups
+
+    Returns:
+        (list[list[str]]): Table groups
+    """
+    groups = [[] for _ in range(min(workers, len(sizes)))]
+    totals = [0] * len(groups)
+    for table in sorted(sizes, key = lambda t: sizes[t], reverse = True):
+        i = totals.index(min(totals))
+        groups[i].append(table)
+        totals[i] += sizes[table]
+    return groups
+
+def dump_stream(proc, location, name, started = None):
+    """Compress the output of a mysqldump process into a shard
+
+    Args:
+        proc (Popen): mysqldump process
+        location (Location): Backup location
+        name (str): Shard name
+        started (Event): Set once mysqldump has started its transaction
+
+    Returns:
+        (dict): Manifest entry for the shard
+    """
+    writer = location.writer(name)
+    head = b''
+    try:
+        with gzip.GzipFile(fileobj = writer, mode = 'wb') as gz:
+            while True:
+                chunk = proc.stdout.read(CHUNK_SIZE)
+                if len(chunk) == 0:
+                    break
+                if started is not None and not started.is_set():
+                    head = head[-len(DATA_MARKER):] + chunk
+                    if DATA_MARKER in head:
+                        started.set()
+                gz.write(chunk)
+
+        if proc.wait() != 0:
+            raise Exception("mysqldump for {} exited with {}".format(name, proc.returncode))
+        writer.close()
+    except:
+        proc.kill()
+        writer.abort()
+        raise
+    finally:
+        if started is not None:
+            started.set() # don't leave backup() waiting on a failed dump
+
+    return {
+        'key': name,
+        'bytes': writer.size,
+        'sha256': writer.sha256.hexdigest(),
+    }
+
+def backup(mysql, location, workers):
+    start = time.time()
+    rows = mysql.query("SELECT table_name, data_length + index_length, table_rows "
+                       "FROM information_schema.tables "
+                       "WHERE table_schema = DATABASE() AND table_type = 'BASE TABLE'")
+    sizes = {row[0]: int(row[1] or 0) for row in rows}
+    estimates = {row[0]: int(row[2] or 0) for row in rows}
+    groups = split_tables(sizes, workers)
+    print("Backing up {} tables from {} using {} streams".format(len(sizes), mysql.database, len(groups)))
+
+    lock = subprocess.Popen(mysql.command('mysql', '--batch', '--skip-column-names', '--unbuffered', mysql.database),
+                            stdin = subprocess.PIPE,
+                            stdout = subprocess.PIPE,
+                            universal_newlines = True)
+    try:
+        if len(sizes) > 0:
+            tables = ', '.join('`{}` READ'.format(table) for table in sizes)
+            lock.stdin.write("LOCK TABLES {};\nSELECT 'locked';\n".format(tables))
+            lock.stdin.flush()
+            if lock.stdout.readline().strip() != 'locked':
+                raise Exception("Could not lock the tables for a consistent snapshot")
+
+        # Schema is dumped while no DDL / writes can happen
+        # Triggers are dumped separately, so restore() can create them after
+        # the data is loaded
+        schema = subprocess.Popen(mysql.command('mysqldump', '--no-data', '--single-transaction',
+                                                '--routines', '--skip-triggers', mysql.database),
+                                  stdout = subprocess.PIPE)
+        schema = dump_stream(schema, location, SCHEMA)
+        triggers = subprocess.Popen(mysql.command('mysqldump', '--no-data', '--no-create-info',
+                                                  '--single-transaction', '--triggers', mysql.database),
+                                    stdout = subprocess.PIPE)
+        triggers = dump_stream(triggers, location, TRIGGERS)
+
+        with ThreadPoolExecutor(max_workers = max(1, len(groups))) as executor:
+            futures = []
+            events = []
+            for i, group in enumerate(groups):
+                proc = subprocess.Popen(mysql.command('mysqldump', '--opt', '--single-transaction',
+                                                      '--no-create-info', '--skip-triggers',
+                                                      mysql.database, *group),
+                                        stdout = subprocess.PIPE)
+                event = threading.Event()
+                futures.append(executor.submit(dump_stream, proc, location,
+                                               'data-{:03d}.sql.gz'.format(i), event))
+                events.append(event)
+
+            deadline = time.time() + SNAPSHOT_TIMEOUT
+            for event in events:
+                if not event.wait(max(0, deadline - time.time())):
+                    raise Exception("Timeout waiting for the dumps to start their transactions")
+
+            lock.stdin.write("UNLOCK TABLES;\n")
+            lock.stdin.close()
+            lock.wait()
+            print("Snapshot taken after {:.0f} seconds".format(time.time() - start))
+
+            shards = [future.result() for future in futures]
+    finally:
+        if lock.poll() is None:
+            lock.kill()
+
+    for shard, group in zip(shards, groups):
+        shard['tables'] = group
+
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'database': mysql.database,
+        'created': datetime.utcnow().isoformat() + 'Z',
+        'schema': schema,
+        'triggers': triggers,
+        'tables': {table: {'bytes': sizes[table], 'rows_estimate': estimates[table]}
+                   for table in sizes},
+        'shards': shards,
+    }
+    location.write_json(MANIFEST, manifest)
+
+    print("Backed up {} bytes (compressed) in {:.0f} seconds".format(
+            schema['bytes'] + triggers['bytes'] + sum(shard['bytes'] for shard in shards),
+            time.time() - start))
+    return manifest
+
+def defer_indexes(schema):
+    """Remove the secondary indexes and foreign keys from CREATE TABLE statements
+
+    Indexes on an AUTO_INCREMENT column are kept, as MySQL requires them.
+
+    Args:
+        schema (str): mysqldump schema output
+
+    Returns:
+        (tuple): Modified schema, and a mapping of table name to the
+                 ALTER TABLE clauses needed to add the indexes back
+    """
+    lines = []
+    deferred = {}
+    table = None
+    for line in schema.splitlines():
+        if table is None:
+            match = re.match(r'CREATE TABLE `([^`]+)` \($', line)
+            if match:
+                table = match.group(1)
+                body = []
+            lines.append(line)
+            continue
+
+        if not line.startswith(')'):
+            body.append(line.strip().rstrip(','))
+            continue
+
+        auto = [re.match(r'`([^`]+)`', l).group(0)
+                for l in body if l.startswith('`') and ' AUTO_INCREMENT' in l]
+        kept = []
+        clauses = []
+        for l in body:
+            # Foreign keys can always be deferred, other keys only if they
+            # don't index the AUTO_INCREMENT column
+            columns = '' if l.startswith('CONSTRAINT ') else l[l.find('('):]
+            if l.startswith(DEFERRABLE) and not any(col in columns for col in auto):
+                clauses.append('ADD ' + l)
+            else:
+                kept.append(l)
+        if len(clauses) > 0:
+            deferred[table] = clauses
+
+        lines.append(',\n'.join('  ' + l for l in kept))
+        lines.append(line)
+        table = None
+
+    return '\n'.join(lines) + '\n', deferred
+
+def verify(reader, entry):
+    reader.drain()
+    if reader.sha256.hexdigest() != entry['sha256']:
+        raise Exception("{}: checksum does not match the manifest".format(entry['key']))
+
+def read_sql(location, entry):
+    """Read and verify a (small) compressed SQL file, like the schema"""
+    reader = location.reader(entry['key'])
+    with gzip.GzipFile(fileobj = reader, mode = 'rb') as gz:
+        sql = gz.read().decode('utf-8')
+    verify(reader, entry)
+    return sql
+
+def load_shard(mysql, location, shard):
+    """Load a compressed shard through the mysql client"""
+    reader = location.reader(shard['key'])
+    proc = subprocess.Popen(mysql.command('mysql', mysql.database),
+                            stdin = subprocess.PIPE)
+    try:
+        with gzip.GzipFile(fileobj = reader, mode = 'rb') as gz:
+            while True:
+                chunk = gz.read(CHUNK_SIZE)
+                if len(chunk) == 0:
+                    break
+                proc.stdin.write(chunk)
+        proc.stdin.close()
+        if proc.wait() != 0:
+            raise Exception("mysql load of {} exited with {}".format(shard['key'], proc.returncode))
+    except:
+        proc.kill()
+        raise
+    verify(reader, shard)
+    print("Loaded {}".format(', '.join(shard['tables'])))
+
+def add_indexes(mysql, table, clauses):
+    mysql.query("SET FOREIGN_KEY_CHECKS=0; ALTER TABLE `{}` {}".format(table, ', '.join(clauses)))
+    print("Added {} indexes / foreign keys to {}".format(len(clauses), table))
+
+def restore(mysql, location, workers):
+    start = time.time()
+    manifest = location.read_json(MANIFEST)
+    if manifest['version'] > MANIFEST_VERSION:
+        raise Exception("Unsupported manifest version {}".format(manifest['version']))
+
+    # Read everything but the data first, so a bad backup fails before
+    # anything is loaded
+    schema, deferred = defer_indexes(read_sql(location, manifest['schema']))
+    if 'triggers' in manifest:
+        triggers = read_sql(location, manifest['triggers'])
+    else:
+        print("Version 1 backup, the triggers are part of the schema")
+        triggers = None
+
+    print("Restoring schema for {} tables".format(len(manifest['tables'])))
+    subprocess.run(mysql.command('mysql', mysql.database),
+                   input = schema.encode('utf-8'),
+                   check = True)
+
+    with ThreadPoolExecutor(max_workers = workers) as executor:
+        for _ in executor.map(lambda s: load_shard(mysql, location, s), manifest['shards']):
+            pass
+        print("Data loaded after {:.0f} seconds".format(time.time() - start))
+
+        for _ in executor.map(lambda t: add_indexes(mysql, t, deferred[t]), deferred):
+            pass
+
+    if triggers is not None:
+        print("Creating triggers")
+        subprocess.run(mysql.command('mysql', mysql.database),
+                       input = triggers.encode('utf-8'),
+                       check = True)
+
+    print("Restored {} in {:.0f} seconds".format(mysql.database, time.time() - start))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Backup or restore a RDS database")
+    parser.add_argument('action', choices = ['backup', 'restore'])
+    parser.add_argument('hostname', help = 'RDS hostname (ex: endpoint-db.integration.boss)')
+    parser.add_argument('destination', help = 's3://bucket/prefix or local directory')
+    parser.add_argument('--workers', type = int, default = DEFAULT_WORKERS,
+                        help = 'Number of parallel dump / restore streams')
+    parser.add_argument('--region', default = None, help = 'AWS region')
+    args = parser.parse_args()
+
+    session = boto3.session.Session(region_name = args.region)
+    location = Location(args.destination, session)
+
+    user, password, database = load_credentials(args.hostname)
+    mysql = MySQL(args.hostname, user, password, database)
+    try:
+        if args.action == 'backup':
+            backup(mysql, location, args.workers)
+        else:
+            restore(mysql, location, args.workers)
+    finally:
+        mysql.close()
@@ -18,6 +18,9 @@
 # maintain the target RDS instance. Designed to be executed
 # by AWS Data Pipeline, which will handle moving data
 # into and out of the EC2 instance
+#
+# NOTE: Backups are now made by rds.py, this script is kept to restore
+#       backups made before rds.py existed
 
 # Usage: ./rds.sh (backup|restore) hostname.domain.tld
 
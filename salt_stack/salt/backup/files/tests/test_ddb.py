@@ -0,0 +1,152 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gzip
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+# Allow unit test files to import the backup scripts
+cur_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.normpath(os.path.join(cur_dir, '..')))
+
+import ddb
+
+ITEM = {
+    'key': {'S': 'abc'},
+    'count': {'N': '12'},
+    'blob': {'B': b'\x00\xffdata'},
+    'blobs': {'BS': [b'\x01', b'\x02\x03']},
+    'flag': {'BOOL': True},
+    'nothing': {'NULL': True},
+    'names': {'SS': ['a', 'b']},
+    'nested': {'M': {
+        'inner': {'B': b'\xde\xad'},
+        'list': {'L': [{'B': b'\xbe\xef'}, {'N': '1'}, {'M': {'deep': {'BS': [b'\x00']}}}]},
+    }},
+}
+
+class FakeDynamoDB(object):
+    """Stand-in for the DynamoDB client methods used by ddb.py"""
+    def __init__(self, items = None, unprocessed = 0):
+        self.items = list(items or [])
+        self.written = []
+        self.unprocessed = unprocessed # Number of batch_write_item calls that only write half
+        self.lock = threading.Lock()
+
+    def describe_table(self, TableName):
+        return {'Table': {'ItemCount': len(self.items),
+                          'KeySchema': [{'AttributeName': 'key', 'KeyType': 'HASH'}],
+                          'AttributeDefinitions': [{'AttributeName': 'key', 'AttributeType': 'S'}]}}
+
+    def get_paginator(self, operation):
+        assert operation == 'scan'
+        return self
+
+    def paginate(self, TableName, Segment, TotalSegments):
+        items = self.items[Segment::TotalSegments]
+        # Two pages per segment
+        yield {'Items': items[:len(items) // 2]}
+        yield {'Items': items[len(items) // 2:]}
+
+    def batch_write_item(self, RequestItems):
+        (table, requests), = RequestItems.items()
+        with self.lock:
+            if self.unprocessed > 0 and len(requests) > 1:
+                self.unprocessed -= 1
+                half = len(requests) // 2
+                self.written.extend(r['PutRequest']['Item'] for r in requests[:half])
+                return {'UnprocessedItems': {table: requests[half:]}}
+            self.written.extend(r['PutRequest']['Item'] for r in requests)
+        return {'UnprocessedItems': {}}
+
+class FakeSession(object):
+    def __init__(self, client):
+        self.client_ = client
+
+    def client(self, service, endpoint_url = None):
+        return self.client_
+
+def key(item):
+    return item['key']['S']
+
+class TestEncoding(unittest.TestCase):
+    def test_round_trip(self):
+        encoded = {k: ddb.encode_value(v) for k, v in ITEM.items()}
+
+        # Must be JSON serializable
+        encoded = json.loads(json.dumps(encoded))
+
+        self.assertEqual({k: ddb.decode_value(v) for k, v in encoded.items()}, ITEM)
+
+    def test_binary_is_base64(self):
+        self.assertEqual(ddb.encode_value({'B': b'\x00\xff'}), {'B': 'AP8='})
+        self.assertEqual(ddb.encode_value({'BS': [b'\x00\xff']}), {'BS': ['AP8=']})
+
+class TestBackupRestore(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.location = ddb.Location(self.dir, None)
+        self.items = [dict(ITEM, key = {'S': 'item-{:03d}'.format(i)}) for i in range(137)]
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def backup(self, segments = 4):
+        with mock.patch('sys.stdout'):
+            return ddb.backup_table(FakeSession(FakeDynamoDB(self.items)), self.location, 'table', segments)
+
+    def restore(self, client, workers = 3):
+        with mock.patch('sys.stdout'), mock.patch.object(ddb.time, 'sleep'):
+            return ddb.restore_table(FakeSession(client), self.location, 'table', workers)
+
+    def test_backup_restore(self):
+        manifest = self.backup()
+
+        self.assertEqual(manifest['items'], len(self.items))
+        self.assertEqual(len(manifest['shards']), 4)
+        self.assertTrue(os.path.exists(os.path.join(self.dir, 'table', ddb.MANIFEST)))
+
+        client = FakeDynamoDB(unprocessed = 3)
+        count = self.restore(client)
+
+        self.assertEqual(count, len(self.items))
+        self.assertEqual(sorted(client.written, key = key), self.items)
+
+    def test_corrupt_shard_not_restored(self):
+        manifest = self.backup()
+
+        # Replace the first shard with a valid gzip file with different items
+        shard = manifest['shards'][0]
+        with gzip.open(os.path.join(self.dir, 'table', shard['key']), 'wb') as gz:
+            gz.write(b'{"key": {"S": "bogus"}}\n')
+
+        client = FakeDynamoDB()
+        with self.assertRaisesRegex(Exception, 'checksum does not match'):
+            self.restore(client, workers = 1)
+
+        self.assertNotIn({'key': {'S': 'bogus'}}, client.written)
+
+    def test_item_count_checked(self):
+        manifest = self.backup(segments = 1)
+        manifest['shards'][0]['items'] += 1
+        self.location.write_json('table/' + ddb.MANIFEST, manifest)
+
+        with self.assertRaisesRegex(Exception, 'manifest has {}'.format(len(self.items) + 1)):
+            self.restore(FakeDynamoDB())
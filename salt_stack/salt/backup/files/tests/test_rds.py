@@ -0,0 +1,134 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import configparser
+import os
+import sys
+import unittest
+
+# Allow unit test files to import the backup scripts
+cur_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.normpath(os.path.join(cur_dir, '..')))
+
+import rds
+
+SCHEMA = """-- MySQL dump
+/*!40101 SET NAMES utf8 */;
+CREATE TABLE `child` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `parent_id` int(11) NOT NULL,
+  `name` varchar(255) NOT NULL,
+  `note` text,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `child_name` (`name`),
+  KEY `child_parent_id` (`parent_id`),
+  FULLTEXT KEY `child_note` (`note`),
+  CONSTRAINT `child_parent_fk` FOREIGN KEY (`parent_id`) REFERENCES `parent` (`id`)
+) ENGINE=InnoDB AUTO_INCREMENT=10 DEFAULT CHARSET=utf8;
+CREATE TABLE `parent` (
+  `id` int(11) NOT NULL,
+  `name` varchar(255) NOT NULL,
+  PRIMARY KEY (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+"""
+
+class TestDeferIndexes(unittest.TestCase):
+    def test_secondary_keys_deferred(self):
+        schema, deferred = rds.defer_indexes(SCHEMA)
+
+        self.assertEqual(deferred, {
+            'child': ['ADD UNIQUE KEY `child_name` (`name`)',
+                      'ADD KEY `child_parent_id` (`parent_id`)',
+                      'ADD FULLTEXT KEY `child_note` (`note`)',
+                      'ADD CONSTRAINT `child_parent_fk` FOREIGN KEY (`parent_id`) REFERENCES `parent` (`id`)'],
+        })
+        self.assertIn("""CREATE TABLE `child` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `parent_id` int(11) NOT NULL,
+  `name` varchar(255) NOT NULL,
+  `note` text,
+  PRIMARY KEY (`id`)
+) ENGINE=InnoDB AUTO_INCREMENT=10 DEFAULT CHARSET=utf8;""", schema)
+
+    def test_other_statements_unchanged(self):
+        schema, _ = rds.defer_indexes(SCHEMA)
+
+        self.assertTrue(schema.startswith("-- MySQL dump\n/*!40101 SET NAMES utf8 */;\n"))
+        self.assertIn("""CREATE TABLE `parent` (
+  `id` int(11) NOT NULL,
+  `name` varchar(255) NOT NULL,
+  PRIMARY KEY (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;""", schema)
+
+    def test_auto_increment_keys_kept(self):
+        """MySQL requires the AUTO_INCREMENT column to be the first column of a key"""
+        schema, deferred = rds.defer_indexes("""CREATE TABLE `log` (
+  `seq` int(11) NOT NULL AUTO_INCREMENT,
+  `host` varchar(64) NOT NULL,
+  `ts` datetime NOT NULL,
+  PRIMARY KEY (`host`,`ts`),
+  KEY `log_seq` (`seq`),
+  UNIQUE KEY `log_seq_host` (`seq`,`host`),
+  KEY `log_ts` (`ts`)
+) ENGINE=InnoDB;
+""")
+
+        self.assertEqual(deferred, {'log': ['ADD KEY `log_ts` (`ts`)']})
+        self.assertIn("  KEY `log_seq` (`seq`),\n  UNIQUE KEY `log_seq_host` (`seq`,`host`)\n)", schema)
+
+    def test_foreign_key_referencing_auto_increment_column_deferred(self):
+        """Only the key's own columns matter, not the referenced columns"""
+        _, deferred = rds.defer_indexes("""CREATE TABLE `node` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `parent_id` int(11) DEFAULT NULL,
+  PRIMARY KEY (`id`),
+  CONSTRAINT `node_parent_fk` FOREIGN KEY (`parent_id`) REFERENCES `node` (`id`)
+) ENGINE=InnoDB;
+""")
+
+        self.assertEqual(deferred, {
+            'node': ['ADD CONSTRAINT `node_parent_fk` FOREIGN KEY (`parent_id`) REFERENCES `node` (`id`)'],
+        })
+
+class TestSplitTables(unittest.TestCase):
+    def test_balanced_groups(self):
+        sizes = {'a': 100, 'b': 500, 'c': 300, 'd': 50, 'e': 250}
+        groups = rds.split_tables(sizes, 2)
+
+        self.assertEqual(sorted(t for g in groups for t in g), sorted(sizes))
+        self.assertEqual(sorted(sum(sizes[t] for t in g) for g in groups), [600, 600])
+
+    def test_fewer_tables_than_workers(self):
+        self.assertEqual(rds.split_tables({'a': 1, 'b': 2}, 8), [['b'], ['a']])
+
+    def test_no_tables(self):
+        self.assertEqual(rds.split_tables({}, 4), [])
+
+class TestMySQL(unittest.TestCase):
+    def test_defaults_file_escapes_values(self):
+        password = 'p"a\\ss#;w\'ord'
+        mysql = rds.MySQL('db.example.com', 'user', password, 'boss')
+        try:
+            with open(mysql.defaults) as fh:
+                contents = fh.read()
+        finally:
+            mysql.close()
+
+        self.assertIn('password="p\\"a\\\\ss#;w\'ord"\n', contents)
+
+        # The unescaped value should round trip through the option file syntax
+        parser = configparser.ConfigParser()
+        parser.read_string(contents)
+        value = parser['client']['password'][1:-1]
+        self.assertEqual(value.replace('\\"', '"').replace('\\\\', '\\'), password)
@@ -1,6 +1,6 @@
 #!/bin/bash
 
 python3 -m pip install boto3 PyYaml
-# domain bucket
-python3 /var/task/build_lambda.py $1 $2
+# domain bucket [staging name]
+python3 /var/task/build_lambda.py "$@"
 
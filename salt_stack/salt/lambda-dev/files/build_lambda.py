@@ -21,8 +21,32 @@ import shlex
 import shutil
 import subprocess
 import pathlib
+import platform
+import tempfile
+import hashlib
+import struct
 import importlib
+import functools
+from concurrent.futures import ThreadPoolExecutor
 
+# Number of threads used to hash the files in the staging directory
+HASH_WORKERS = 8
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# Directory where wheels built for python_packages are kept between builds
+# DP NOTE: When building in a container this directory is on the volume mounted
+#          from the host and on the lambda build server it is in the home directory.
+#          Delete the directory to force all dependencies to be rebuilt.
+WHEEL_CACHE_DIR = pathlib.Path(__file__).parent / 'wheel_cache'
+
+# Categories of files that are not needed at runtime, which are removed
+# if `slim` is set in the lambda.yml
+SLIM_CATEGORIES = ('tests', 'docs', 'pyc', 'debug')
+SLIM_TEST_DIRS = ('test', 'tests')
+# DP NOTE: Doc directories that contain Python code (like botocore/docs/) are
+#          imported at runtime, so only their .md / .rst files are removed
+SLIM_DOC_DIRS = ('doc', 'docs')
+SLIM_DOC_EXTENSIONS = ('.md', '.rst')
 
 
 def upload_to_s3(zip_file, target_name, bucket, metadata={}):
@@ -87,6 +111,334 @@ def unzip(zippath, path):
                 os.chmod(full_path, perms)
     
 
+def file_sha1(path):
+    """Compute the SHA1 hex digest of the given file
+
+    Args:
+        path (str|Path): Path to the file to hash
+
+    Returns:
+        str: Hex digest of the file contents
+    """
+    h = hashlib.sha1()
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(HASH_BLOCK_SIZE), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def tree_files(path):
+    """List all of the regular files under the given directory
+
+    Note: Symlinks are not followed or included, matching `find . -type f`
+
+    Args:
+        path (str|Path): Directory to search
+
+    Returns:
+        list[bytes]: Relative paths of the files, sorted bytewise so that the
+                     ordering doesn't depend on the host's locale
+    """
+    path = os.fsencode(path)
+    files = []
+    for root, dirs, filenames in os.walk(path):
+        for filename in filenames:
+            full_path = os.path.join(root, filename)
+            if os.path.isfile(full_path) and not os.path.islink(full_path):
+                files.append(os.path.relpath(full_path, path))
+    files.sort()
+    return files
+
+def tree_hash(path, workers=HASH_WORKERS):
+    """Compute the build hash of all of the files under the given directory
+
+    Note: The result is identical to running
+          `find . -type f -print0 | sort -z | xargs -0 sha1sum | sha1sum`
+          in the directory (under the C locale), so that hashes stored in
+          S3 metadata by earlier builds remain valid
+
+    Note: This function is also used by lib/lambdas.py to check whether a
+          code zip needs to be rebuilt, so it cannot depend on any
+          non-standard library
+
+    Args:
+        path (str|Path): Directory to hash
+        workers (int): Number of threads used to hash the files
+
+    Returns:
+        str: Hex digest of the directory contents
+    """
+    root = os.fsencode(path)
+    files = tree_files(root)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        digests = pool.map(lambda f: file_sha1(os.path.join(root, f)), files)
+
+        h = hashlib.sha1()
+        for filename, digest in zip(files, digests):
+            h.update(digest.encode() + b'  ./' + filename + b'\n')
+    return h.hexdigest()
+
+def wheel_cache_key(runtime, requirement):
+    """Compute the wheel cache key for a set of requirements
+
+    Args:
+        runtime (str): Lambda runtime the wheels are being built for
+        requirement (str): Identifier for the requirement set, which must change
+                           when the requirements (or local repository) change
+
+    Returns:
+        str: Hex digest used as the name of the cache directory
+    """
+    h = hashlib.sha1()
+    for part in (runtime,
+                 platform.python_version(),
+                 platform.machine(),
+                 requirement):
+        h.update(part.encode() + b'\n')
+    return h.hexdigest()
+
+def install_cached(location, pip_args, runtime, requirement):
+    """Install packages into the given location from the wheel cache
+
+    If the wheels for the requirement are not cached then they are built using
+    `pip wheel` and added to the cache before being installed
+
+    Args:
+        location (Path): Directory to install the packages into
+        pip_args (str): Requirements to pass to pip (package names, a local
+                        repository path, or `-r <requirements file>`)
+        runtime (str): Lambda runtime the wheels are being built for
+        requirement (str): Identifier for the requirement set, see wheel_cache_key()
+
+    Returns:
+        tuple[bool, list[str]]: If the wheels were found in the cache and the names of the wheels
+    """
+    cache_dir = WHEEL_CACHE_DIR / runtime / wheel_cache_key(runtime, requirement)
+    hit = cache_dir.exists()
+
+    if not hit:
+        cache_dir.parent.mkdir(parents=True, exist_ok=True)
+
+        # Build into a temporary directory and rename, so that a failed or
+        # concurrent build never leaves a partial cache entry
+        build_dir = pathlib.Path(tempfile.mkdtemp(dir=str(cache_dir.parent)))
+        try:
+            run('python3 -m pip wheel -w {} {}'.format(build_dir, pip_args))
+            try:
+                build_dir.rename(cache_dir)
+            except OSError:
+                pass # Another build populated the cache entry first
+        finally:
+            if build_dir.exists():
+                shutil.rmtree(build_dir)
+
+    wheels = sorted(str(wheel) for wheel in cache_dir.glob('*.whl'))
+    run('python3 -m pip install --no-index --find-links {} -t {} {}'.format(cache_dir,
+                                                                            location,
+                                                                            ' '.join(wheels)))
+
+    return hit, [os.path.basename(wheel) for wheel in wheels]
+
+def has_debug_symbols(path):
+    """Check if the given ELF shared library contains debug sections
+
+    Note: Only 64 bit little endian ELF files (Lambda's x86_64 platform) are supported
+
+    Args:
+        path (str): Path to the file to check
+
+    Returns:
+        bool: If the file contains any `.debug*` sections
+    """
+    with open(path, 'rb') as fh:
+        header = fh.read(64)
+        if len(header) < 64 or header[:6] != b'\x7fELF\x02\x01':
+            return False
+
+        shoff, = struct.unpack_from('<Q', header, 0x28)
+        shentsize, shnum, shstrndx = struct.unpack_from('<HHH', header, 0x3A)
+        if shoff == 0 or shnum == 0 or shstrndx >= shnum:
+            return False
+
+        fh.seek(shoff)
+        sections = fh.read(shentsize * shnum)
+        if len(sections) < shentsize * shnum:
+            return False
+
+        # Read the section name string table
+        strtab_offset, strtab_size = struct.unpack_from('<QQ', sections, shstrndx * shentsize + 0x18)
+        fh.seek(strtab_offset)
+        strtab = fh.read(strtab_size)
+
+        for i in range(shnum):
+            name_offset, = struct.unpack_from('<I', sections, i * shentsize)
+            if strtab[name_offset:].startswith(b'.debug'):
+                return True
+
+    return False
+
+@functools.lru_cache(maxsize=None)
+def has_python_files(path):
+    """Check if the given directory, or any of its subdirectories, contains Python source
+
+    Args:
+        path (str): Directory to check
+
+    Returns:
+        bool: If any `.py` file exists under the directory
+    """
+    for _, _, files in os.walk(path):
+        if any(name.endswith('.py') for name in files):
+            return True
+    return False
+
+def slim_category(root, relpath):
+    """Determine if a file is not needed at runtime and can be removed by the slimming stage
+
+    Args:
+        root (str): Directory containing the file
+        relpath (str): Path of the file relative to root
+
+    Returns:
+        optional[str]: One of SLIM_CATEGORIES or None if the file is needed
+    """
+    parts = relpath.split(os.sep)
+    dirs, name = parts[:-1], parts[-1]
+    ext = os.path.splitext(name)[1].lower()
+
+    if any(d in SLIM_TEST_DIRS for d in dirs):
+        return 'tests'
+
+    if ext in SLIM_DOC_EXTENSIONS:
+        return 'docs'
+
+    for i, d in enumerate(dirs):
+        if d in SLIM_DOC_DIRS and not has_python_files(os.path.join(root, *dirs[:i+1])):
+            return 'docs'
+
+    if ext == '.pyc':
+        # Both `__pycache__/module.cpython-37.pyc` and `module.pyc` are duplicates
+        # of `module.py`, if it exists
+        if dirs and dirs[-1] == '__pycache__':
+            dirs = dirs[:-1]
+        source = os.path.join(root, *dirs, name.split('.')[0] + '.py')
+        if os.path.exists(source):
+            return 'pyc'
+
+    if name.endswith('.so') or '.so.' in name:
+        if has_debug_symbols(os.path.join(root, relpath)):
+            return 'debug'
+
+    return None
+
+def analyze_tree(path):
+    """Compute the uncompressed size of a lambda code directory
+
+    Args:
+        path (str|Path): Directory to analyze
+
+    Returns:
+        dict: Dictionary with the keys
+              'total' (int): Total size in bytes
+              'files' (int): Number of files
+              'packages' (dict[str, int]): Size of each top level file or directory
+              'types' (dict[str, int]): Size of each file extension
+              'flagged' (dict[str, list[tuple[str, int]]]): Files in each of SLIM_CATEGORIES
+    """
+    path = str(path)
+    report = {
+        'total': 0,
+        'files': 0,
+        'packages': {},
+        'types': {},
+        'flagged': { category: [] for category in SLIM_CATEGORIES },
+    }
+
+    for relpath in tree_files(path):
+        relpath = os.fsdecode(relpath)
+        size = os.path.getsize(os.path.join(path, relpath))
+
+        parts = relpath.split(os.sep)
+        package = parts[0] if len(parts) > 1 else '(root)'
+        ext = os.path.splitext(parts[-1])[1].lower() or '(none)'
+        if '.so.' in parts[-1]:
+            ext = '.so'
+
+        report['total'] += size
+        report['files'] += 1
+        report['packages'][package] = report['packages'].get(package, 0) + size
+        report['types'][ext] = report['types'].get(ext, 0) + size
+
+        category = slim_category(path, relpath)
+        if category is not None:
+            report['flagged'][category].append((relpath, size))
+
+    return report
+
+def format_size(size):
+    """Format a byte count as a human readable string"""
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return '{:.1f}{}'.format(size, unit)
+        size /= 1024
+    return '{:.1f}GB'.format(size)
+
+def print_analysis(report, top=20):
+    """Print the results of analyze_tree()
+
+    Args:
+        report (dict): Results from analyze_tree()
+        top (int): Number of packages and file types to display
+    """
+    print("Total: {} in {} files".format(format_size(report['total']), report['files']))
+
+    for title, key in (('Package', 'packages'), ('File type', 'types')):
+        print()
+        print("{:<40} {:>10} {:>6}".format(title, 'Size', '%'))
+        items = sorted(report[key].items(), key=lambda item: item[1], reverse=True)
+        for name, size in items[:top]:
+            print("{:<40} {:>10} {:>5.1f}%".format(name,
+                                                   format_size(size),
+                                                   100 * size / max(report['total'], 1)))
+
+    print()
+    print("{:<40} {:>10} {:>6}".format('Removable by slimming', 'Size', 'Files'))
+    for category, files in report['flagged'].items():
+        print("{:<40} {:>10} {:>6}".format(category,
+                                           format_size(sum(size for _, size in files)),
+                                           len(files)))
+
+def slim_tree(path, categories=SLIM_CATEGORIES):
+    """Remove files that are not needed at runtime from a lambda code directory
+
+    Files in the 'tests', 'docs', and 'pyc' categories are deleted and shared
+    libraries in the 'debug' category have their debug symbols stripped
+
+    Args:
+        path (str|Path): Directory to slim
+        categories (list[str]): Which of SLIM_CATEGORIES to remove
+
+    Returns:
+        tuple[int, int]: Size of the directory before and after slimming
+    """
+    path = str(path)
+    report = analyze_tree(path)
+
+    for category in categories:
+        for relpath, _ in report['flagged'][category]:
+            full_path = os.path.join(path, relpath)
+            if category == 'debug':
+                run('strip --strip-debug {}'.format(shlex.quote(full_path)))
+            else:
+                os.remove(full_path)
+
+    # Remove any directories left empty
+    for root, dirs, files in os.walk(path, topdown=False):
+        if root != path and not os.listdir(root):
+            os.rmdir(root)
+
+    return report['total'], analyze_tree(path)['total']
+
 def load_config(staging_dir):
     """Load the lambda configuration file from the given directory
 
@@ -194,12 +546,14 @@ if __name__ == '__main__':
     cur_dir = pathlib.Path(__file__).parent
     os.chdir(cur_dir)
 
-    if len(sys.argv) != 3:
-        print("Usage: {} <domain name> <bucket name>".format(sys.argv[0]))
+    if len(sys.argv) not in (3, 4):
+        print("Usage: {} <domain name> <bucket name> [staging name]".format(sys.argv[0]))
         sys.exit(-1)
 
     domain = sys.argv[1]
     bucket = sys.argv[2]
+    # The staging name allows multiple builds to run at the same time
+    staging_name = sys.argv[3] if len(sys.argv) == 4 else domain
 
     # Not all AWS Lambda containers have these libraries installed
     # verify that they are installed before importing them
@@ -217,8 +571,8 @@ if __name__ == '__main__':
     import boto3
     import yaml
 
-    zip_file = cur_dir / 'staging' / (domain + '.zip')
-    staging_dir = cur_dir / 'staging' / domain
+    zip_file = cur_dir / 'staging' / (staging_name + '.zip')
+    staging_dir = cur_dir / 'staging' / staging_name
 
     # Remove the old build directory
     if staging_dir.exists():
@@ -230,7 +584,7 @@ if __name__ == '__main__':
 
     staging_dir.mkdir()
     unzip(zip_file, staging_dir)
-    starting_hash = script_stdout('find . -type f -print0 | sort -z | xargs -0 sha1sum | sha1sum').split()[0]
+    starting_hash = tree_hash(staging_dir)
 
     lambda_config = load_config(staging_dir)
 
@@ -263,8 +617,7 @@ if __name__ == '__main__':
 
     # Install Python Packages
     if lambda_config.get('python_packages'):
-        cmd_req = 'python3 -m pip install -t {location} -r {requirements}'
-        cmd_pkgs = 'python3 -m pip install -t {location} {packages}'
+        runtime = lambda_config['runtime']
 
         entries = lambda_config['python_packages']
         if type(entries) == list: # list of packages, convert to the dict format with
@@ -272,14 +625,21 @@ if __name__ == '__main__':
             entries = { entry : '.'
                         for entry in entries }
 
+        cache_results = []
         packages = {}
         for entry in entries:
             if (staging_dir / entry).is_file(): # pointing to requirements file
-                run(cmd_req.format(location = staging_dir / entries[entry],
-                                   requirements = staging_dir / entry))
+                requirement = 'requirements:' + file_sha1(staging_dir / entry)
+                result = install_cached(staging_dir / entries[entry],
+                                        '-r {}'.format(staging_dir / entry),
+                                        runtime, requirement)
+                cache_results.append((entry, result))
             elif (staging_dir / entry).is_dir(): # pointing to a local repository
-                run(cmd_pkgs.format(location = staging_dir / entries[entry],
-                                    packages = staging_dir / entry))
+                requirement = 'repository:' + tree_hash(staging_dir / entry)
+                result = install_cached(staging_dir / entries[entry],
+                                        staging_dir / entry,
+                                        runtime, requirement)
+                cache_results.append((entry, result))
             else:
                 location = entries[entry]
                 if location not in packages:
@@ -287,14 +647,37 @@ if __name__ == '__main__':
                 packages[location].append(entry)
 
         for loc, pkgs in packages.items():
-            run(cmd_pkgs.format(location = staging_dir / loc,
-                                packages = ' '.join(pkgs)))
+            requirement = 'packages:' + ' '.join(sorted(pkgs))
+            result = install_cached(staging_dir / loc,
+                                    ' '.join(pkgs),
+                                    runtime, requirement)
+            cache_results.append((' '.join(pkgs), result))
+
+        print("----------------------------------------------------------------------------------")
+        print("Wheel cache results")
+        for entry, (hit, wheels) in cache_results:
+            print("{} {}".format('HIT ' if hit else 'MISS', entry))
+            for wheel in wheels:
+                print("         {}".format(wheel))
 
     # Run Manual Commands
     if lambda_config.get('manual_commands'):
         for cmd in lambda_config['manual_commands']:
             script(cmd)
 
+    # Remove files not needed at runtime
+    # DP NOTE: `slim` can be True, to remove all categories, or a list of categories
+    if lambda_config.get('slim') and 'output_file' not in lambda_config:
+        categories = lambda_config['slim']
+        if categories is True:
+            categories = SLIM_CATEGORIES
+
+        before, after = slim_tree(staging_dir, categories)
+        print("----------------------------------------------------------------------------------")
+        print("Slimmed ({}) from {} to {}".format(', '.join(categories),
+                                                format_size(before),
+                                                format_size(after)))
+
     target_name = lambda_config['name'] + '.' + domain
     if 'output_file' in lambda_config:
         # The lambda build process may create its own code zip, so use that instead
@@ -0,0 +1,70 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import tempfile
+import unittest
+
+# Allow unit test files to import the build script
+cur_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.normpath(os.path.join(cur_dir, '..')))
+
+import build_lambda
+
+class TestSlimTree(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def create(self, relpath, data='x = 1\n'):
+        path = os.path.join(self.root, *relpath.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as fh:
+            fh.write(data)
+
+    def exists(self, relpath):
+        return os.path.exists(os.path.join(self.root, *relpath.split('/')))
+
+    def test_python_docs_package_kept(self):
+        """botocore/docs/ is imported by botocore.client, so it must survive slimming"""
+        self.create('botocore/__init__.py')
+        self.create('botocore/client.py', 'from botocore.docs.docstring import ClientMethodDocstring\n')
+        self.create('botocore/docs/__init__.py')
+        self.create('botocore/docs/docstring.py')
+        self.create('botocore/docs/bcdoc/__init__.py')
+        self.create('botocore/docs/README.rst', 'docs\n')
+
+        build_lambda.slim_tree(self.root, ['docs'])
+
+        self.assertTrue(self.exists('botocore/docs/__init__.py'))
+        self.assertTrue(self.exists('botocore/docs/docstring.py'))
+        self.assertTrue(self.exists('botocore/docs/bcdoc/__init__.py'))
+        self.assertFalse(self.exists('botocore/docs/README.rst'))
+
+    def test_plain_docs_removed(self):
+        """Doc directories without Python code are removed"""
+        self.create('package/__init__.py')
+        self.create('package/docs/index.html', '<html></html>\n')
+        self.create('package/docs/images/logo.png', 'png\n')
+        self.create('package/README.md', 'readme\n')
+
+        build_lambda.slim_tree(self.root, ['docs'])
+
+        self.assertTrue(self.exists('package/__init__.py'))
+        self.assertFalse(self.exists('package/docs'))
+        self.assertFalse(self.exists('package/README.md'))
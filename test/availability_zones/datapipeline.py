@@ -28,29 +28,6 @@ from lib import configuration
 from lib import datapipeline
 from lib.exceptions import BossManageError
 
-def pipeline_status(bosslet_config, pipeline_id):
-    client = bosslet_config.session.client('datapipeline')
-    resp = client.describe_pipelines(pipelineIds=[pipeline_id])
-    status = [f['stringValue']
-              for f in resp['pipelineDescriptionList'][0]['fields']
-              if f['key'] == '@healthStatus']
-
-    if len(status) == 0:
-        return None
-    else:
-        return status[0]
-
-def pipeline_errors(bosslet_config, pipeline_id):
-    client = bosslet_config.session.client('datapipeline')
-    resp = client.query_objects(pipelineId=pipeline_id,
-                                sphere='INSTANCE') # COMPONENT, INSTANCE, or ATTEMPT
-    resp = client.describe_objects(pipelineId=pipeline_id,
-                                   objectIds=resp['ids'])
-    errors = [field['stringValue']
-              for obj in resp['pipelineObjects']
-              for field in obj['fields'] if field['key'] == '@failureReason']
-    return errors
-
 bosslet_config = configuration.BossConfiguration('test.boss')
 config = cloudformation.CloudFormationConfiguration('test', bosslet_config)
 
@@ -95,10 +72,11 @@ else:
     print("Activating test pipeline")
     pipeline_id = aws.get_data_pipeline_id(bosslet_config.session, 'test.' + bosslet_config.INTERNAL_DOMAIN)
     aws.activate_data_pipeline(bosslet_config.session, pipeline_id)
+    client = bosslet_config.session.client('datapipeline')
 
     print("Waiting for pipeline ", end='', flush=True)
     while True:
-        status = pipeline_status(bosslet_config, pipeline_id)
+        status = aws.data_pipeline_status(client, pipeline_id)
         if status is not None:
             break
         print(".", end='', flush=True)
@@ -107,7 +85,7 @@ else:
 
     if status == 'ERROR':
         print("Errors:")
-        for error in pipeline_errors(bosslet_config, pipeline_id):
+        for error in aws.data_pipeline_errors(client, pipeline_id):
             if 'create' not in error:
                 continue
             print("\t> {}".format(error))
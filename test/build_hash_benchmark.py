@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Script for benchmarking the lambda build hash against the original shell pipeline.
+
+By default a synthetic staging directory the size of the multilambda (about
+15,000 files and 300MB uncompressed) is created in a temporary directory. An
+existing staging directory or unzipped code zip can be used instead by passing
+its path with `--dir`.
+
+Sample usage:
+
+    ./build_hash_benchmark.py
+    ./build_hash_benchmark.py --dir ../salt_stack/salt/lambda-dev/files/staging/integration.boss
+"""
+
+import argparse
+import os
+import random
+import subprocess
+import tempfile
+import time
+
+import alter_path
+from lib import lambdas
+
+SHELL_HASH = 'find . -type f -print0 | sort -z | xargs -0 sha1sum | sha1sum'
+
+def create_tree(path, num_files, total_mb, seed=0):
+    """Fill the given directory with a nested tree of random files
+
+    File sizes are skewed so that most files are small (Python source) and
+    a few files are large (shared libraries), similar to a lambda code zip.
+
+    Args:
+        path (str): Directory to populate
+        num_files (int): Number of files to create
+        total_mb (int): Approximate total size of all files in MB
+        seed (int): Random seed, so runs are reproducible
+    """
+    rand = random.Random(seed)
+    weights = [rand.paretovariate(1.2) for _ in range(num_files)]
+    scale = (total_mb * 1024 * 1024) / sum(weights)
+
+    for i, weight in enumerate(weights):
+        dirname = os.path.join(path, 'pkg{}'.format(i % 40), 'mod{}'.format(i % 7))
+        os.makedirs(dirname, exist_ok=True)
+        with open(os.path.join(dirname, 'file{}.py'.format(i)), 'wb') as fh:
+            fh.write(os.urandom(int(weight * scale)))
+
+def timed(func, *args, **kwargs):
+    start = time.monotonic()
+    result = func(*args, **kwargs)
+    return result, time.monotonic() - start
+
+def shell_hash(path):
+    proc = subprocess.run(['/bin/bash', '-c', SHELL_HASH],
+                          cwd = path,
+                          env = dict(os.environ, LC_ALL='C'),
+                          stdout = subprocess.PIPE,
+                          check = True)
+    return proc.stdout.decode().split()[0]
+
+def benchmark(path, workers):
+    build_lambda = lambdas.load_build_lambda()
+
+    expected, elapsed = timed(shell_hash, path)
+    print("{:>20}: {:.2f}s  {}".format('shell pipeline', elapsed, expected))
+
+    for count in workers:
+        result, elapsed = timed(build_lambda.tree_hash, path, workers=count)
+        label = 'tree_hash({})'.format(count)
+        print("{:>20}: {:.2f}s  {}".format(label, elapsed, result))
+
+        if result != expected:
+            print("ERROR: {} doesn't match the shell pipeline".format(label))
+            return 1
+
+    return 0
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Benchmark the lambda build hash")
+    parser.add_argument('--dir',
+                        help = 'Existing directory to hash instead of a synthetic tree')
+    parser.add_argument('--files',
+                        default = 15000,
+                        type = int,
+                        help = 'Number of files in the synthetic tree')
+    parser.add_argument('--size',
+                        default = 300,
+                        type = int,
+                        help = 'Size of the synthetic tree in MB')
+    parser.add_argument('--workers',
+                        default = [1, 4, 8, 16],
+                        type = int,
+                        nargs = '+',
+                        help = 'Thread counts to benchmark')
+
+    args = parser.parse_args()
+
+    if args.dir:
+        ret = benchmark(args.dir, args.workers)
+    else:
+        with tempfile.TemporaryDirectory() as path:
+            print("Creating {} files ({}MB) in {}".format(args.files, args.size, path))
+            create_tree(path, args.files, args.size)
+            ret = benchmark(path, args.workers)
+
+    exit(ret)
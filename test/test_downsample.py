@@ -17,11 +17,13 @@
 import argparse
 import blosc
 import boto3
-from boto3.dynamodb.conditions import Attr
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import json
 from multiprocessing.pool import Pool
+import numpy
 import os
 from sys import stdout
+import time
 
 import alter_path
 from lib import aws
@@ -72,12 +74,22 @@ using channel id 1234 and running in the integration stack.
 To run the test again with the same data, use:
 
     ./test_downsample.py --noupload -f 4096 4096 160 integration.boss 1234
+
+To load test the downsample, fill more of the frame using parallel uploads:
+
+    ./test_downsample.py -f 4096 4096 160 --extent 8 8 10 --seed 42 integration.boss 1234
 """
 
 # Format string for building the first part of step function's arn.
 SFN_ARN_PREFIX_FORMAT = 'arn:aws:states:{}:{}:stateMachine:'
 LAMBDA_ARN_FORMAT = 'arn:aws:lambda:{}:{}:function:{}'
 
+# Max number of items in a DynamoDB BatchWriteItem request
+DYNAMO_BATCH_SIZE = 25
+
+# Max number of keys in a S3 DeleteObjects request
+S3_DELETE_BATCH_SIZE = 1000
+
 def ceildiv(a, b):
     """
     Round up the result of a / b.
@@ -111,6 +123,55 @@ class S3Bucket(object):
         self.s3.put_object(Key=key, Body=data, Bucket=self.bucket)
 
 
+def generate_cube(work):
+    """
+    Create a cube filled with seeded random data.  Runs in a worker process.
+
+    Args:
+        work (tuple): (image_dict, morton, seed).  image_dict is from
+                      TestDownsample.get_image_dict().
+
+    Returns:
+        (int, bytes): Morton id and blosc compressed cube data.
+    """
+    image_dict, morton, seed = work
+
+    resource = BossResourceBasic()
+    resource.from_dict(image_dict)
+
+    cube = Cube.create_cube(resource, CUBOIDSIZE[0])
+    rng = numpy.random.RandomState((seed * 1000003 + morton) % 2**32)
+    cube.data = rng.randint(1, 255, size=cube.data.shape).astype(cube.data.dtype)
+    return morton, cube.to_blosc()
+
+def batch_write(session, table, requests, threads=16):
+    """
+    Write to a DynamoDB table using concurrent BatchWriteItem calls.
+
+    Args:
+        session (boto3.Session): Open session.
+        table (str): Name of the table.
+        requests (list[dict]): PutRequest / DeleteRequest items.
+        threads (int): Number of concurrent BatchWriteItem calls.
+    """
+    client = session.client('dynamodb')
+
+    def write(batch):
+        request = {table: batch}
+        delay = 0.1
+        while request:
+            resp = client.batch_write_item(RequestItems=request)
+            request = resp.get('UnprocessedItems')
+            if request:
+                # Throttled, back off before retrying the unprocessed items
+                time.sleep(delay)
+                delay = min(delay * 2, 10)
+
+    batches = [requests[i:i+DYNAMO_BATCH_SIZE] for i in range(0, len(requests), DYNAMO_BATCH_SIZE)]
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for future in [executor.submit(write, batch) for batch in batches]:
+            future.result()
+
 class TestDownsample(object):
 
     def __init__(self, bosslet_config, chan_id, frame):
@@ -193,11 +254,11 @@ class TestDownsample(object):
         start_args = {
             # resolution_hierarchy_sfn is used by the test script, but not by the
             # actual resolution hiearchy step function that the script invokes.
-            'resolution_hierarchy_sfn': '{}{}'.format(sfn_arn_prefix, names.sfn.resolution_hierarchy),
+            'resolution_hierarchy_sfn': '{}{}'.format(sfn_arn_prefix, names.resolution_hierarchy.sfn),
 
             'downsample_volume_lambda': LAMBDA_ARN_FORMAT.format(self.bosslet_config.REGION,
                                                                  self.bosslet_config.ACCOUNT_ID,
-                                                                 names.lambda_.downsample_volume)
+                                                                 names.downsample_volume.lambda_),
 
             'test': True,
 
@@ -207,8 +268,8 @@ class TestDownsample(object):
             'annotation_channel': False,
             'data_type': 'uint8',
 
-            's3_index': names.s3.s3_index,
-            's3_bucket': names.s3.cuboid_bucket,
+            's3_index': names.s3_index.ddb,
+            's3_bucket': names.cuboid_bucket.s3,
 
             'x_start': 0,
             'y_start': 0,
@@ -230,82 +291,176 @@ class TestDownsample(object):
 
         return start_args
 
-    def upload_data(self, args):
+    def upload_data(self, args, extent=None, seed=0, processes=None, threads=16):
         """
         Fill the coord frame with random data.
 
+        Cubes are generated and blosc compressed by a process pool and
+        uploaded by a thread pool.  The random data for each cube is seeded
+        from the seed and the cube's morton id, so the uploaded data is
+        reproducible.  An s3index entry is written for each cube.
+
         Args:
             args (dict): This should be the dict returned by get_downsample_args().
+            extent (XYZ|None): Number of cubes to fill in each dimension.  If
+                               None only the first 2x2x2 cubes are uploaded.
+            seed (int): Random seed.
+            processes (int|None): Number of processes generating cubes, defaults to the number of CPUs.
+            threads (int): Number of concurrent S3 uploads.
         """
-        cuboid_size = CUBOIDSIZE[0]
-        x_dim = cuboid_size[0]
-        y_dim = cuboid_size[1]
-        z_dim = cuboid_size[2]
-
+        if extent is None:
+            # DP HACK: uploading all cubes will take longer than the actual downsample
+            #          just upload the first volume worth of cubes.
+            #          The downsample volume lambda will only read these cubes when
+            #          passed the 'test' argument.
+            extent = XYZ(2, 2, 2)
+
+        image_dict = self.get_image_dict()
         resource = BossResourceBasic()
-        resource.from_dict(self.get_image_dict())
+        resource.from_dict(image_dict)
         resolution = 0
         ts = 0
         version = 0
+        lookup_key = '{}&{}'.format(image_dict['lookup_key'], resolution)
+
+        cubes = list(xyz_range(XYZ(0,0,0), extent))
+        work = [(image_dict, cube.morton, seed) for cube in cubes]
 
-        # DP HACK: uploading all cubes will take longer than the actual downsample
-        #          just upload the first volume worth of cubes.
-        #          The downsample volume lambda will only read these cubes when
-        #          passed the 'test' argument.
         bucket = S3Bucket(self.bosslet_config.session, args['s3_bucket'])
-        print('Uploading test data', end='', flush=True)
-        for cube in xyz_range(XYZ(0,0,0), XYZ(2,2,2)):
-            key = AWSObjectStore.generate_object_key(resource, resolution, ts, cube.morton)
-            key += "&0" # Add the version number
-            #print('morton: {}'.format(cube.morton))
-            #print('key: {}'.format(key))
-            #print("{} -> {} -> {}".format(cube, cube.morton, key))
-            cube = Cube.create_cube(resource, [x_dim, y_dim, z_dim])
-            cube.random()
-            data = cube.to_blosc()
-            bucket.put(key, data)
-            print('.', end='', flush=True)
+        index_keys = []
+        print('Uploading {} test cubes'.format(len(cubes)), end='', flush=True)
+        with Pool(processes) as pool, ThreadPoolExecutor(max_workers=threads) as executor:
+            in_flight = set()
+            for morton, data in pool.imap_unordered(generate_cube, work):
+                key = AWSObjectStore.generate_object_key(resource, resolution, ts, morton)
+                index_keys.append(key)
+
+                # Limit the compressed cubes held in memory while waiting on S3
+                if len(in_flight) >= threads * 2:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                        print('.', end='', flush=True)
+
+                in_flight.add(executor.submit(bucket.put, key + "&{}".format(version), data))
+
+            for future in in_flight:
+                future.result()
+                print('.', end='', flush=True)
         print(' Done uploading.')
 
-    def delete_data(self, args):
-        lookup_prefix = '&'.join([args['collection_id'], args['experiment_id'], args['channel_id']])
+        print('Writing {} S3 index keys'.format(len(index_keys)))
+        items = [{
+                    'object-key': {'S': key},
+                    'version-node': {'N': str(version)},
+                    'lookup-key': {'S': lookup_key},
+                 } for key in index_keys]
+        batch_write(self.bosslet_config.session, args['s3_index'],
+                    [{'PutRequest': {'Item': item}} for item in items],
+                    threads)
+
+    def find_index_keys(self, args, segments=16):
+        """
+        Find the s3index entries of the test channel, using a parallel
+        segmented scan.
+
+        Args:
+            args (dict): This should be the dict returned by get_downsample_args().
+            segments (int): Number of scan segments to read concurrently.
+
+        Returns:
+            (list[dict]): s3index keys ('object-key' and 'version-node').
+        """
+        client = self.bosslet_config.session.client('dynamodb')
+        # Include the trailing '&' so channel 1 doesn't match channel 10
+        lookup_prefix = '&'.join([args['collection_id'], args['experiment_id'], args['channel_id'], ''])
+
+        def scan(segment):
+            scan_args = {
+                'TableName': args['s3_index'],
+                'Segment': segment,
+                'TotalSegments': segments,
+                'ProjectionExpression': '#objectkey, #versionnode',
+                'FilterExpression': 'begins_with(#lookupkey, :prefix)',
+                'ExpressionAttributeNames': {
+                    '#objectkey': 'object-key',
+                    '#versionnode': 'version-node',
+                    '#lookupkey': 'lookup-key',
+                },
+                'ExpressionAttributeValues': {':prefix': {'S': lookup_prefix}},
+            }
+            keys = []
+            while True:
+                resp = client.scan(**scan_args)
+                keys.extend(resp['Items'])
+                if 'LastEvaluatedKey' not in resp:
+                    return keys
+                scan_args['ExclusiveStartKey'] = resp['LastEvaluatedKey']
+
+        with ThreadPoolExecutor(max_workers=segments) as executor:
+            return [key for keys in executor.map(scan, range(segments)) for key in keys]
+
+    def delete_data(self, args, keys=None, threads=16, scan_bucket=False):
+        """
+        Delete the test channel's cubes from the S3 cuboid bucket, using
+        concurrent DeleteObjects calls of up to 1000 keys.
+
+        Args:
+            args (dict): This should be the dict returned by get_downsample_args().
+            keys (list[dict]|None): Result of find_index_keys(), looked up if not given.
+            threads (int): Number of concurrent DeleteObjects calls.
+            scan_bucket (bool): Also list the whole bucket to find cubes without
+                                s3index entries.  This may take a long time.
+        """
+        if keys is None:
+            keys = self.find_index_keys(args, threads)
+
+        objects = ['{}&{}'.format(key['object-key']['S'], key['version-node']['N']) for key in keys]
+
+        if scan_bucket:
+            print("Listing S3 cuboid bucket, this may take a long time")
+            lookup_prefix = '&'.join([args['collection_id'], args['experiment_id'], args['channel_id'], ''])
+            # Keys are hash prefixed, so the whole bucket has to be listed
+            paginator = self.bosslet_config.session.client('s3').get_paginator('list_objects_v2')
+            for page in paginator.paginate(Bucket = args['s3_bucket']):
+                objects.extend(obj['Key'] for obj in page.get('Contents', [])
+                                          if lookup_prefix in obj['Key'])
+            objects = list(set(objects))
+
+        print("Deleting {} S3 test cubes".format(len(objects)))
 
         client = self.bosslet_config.session.client('s3')
-        args_ = { 'Bucket': args['s3_bucket'] }
-        resp = { 'KeyCount': 1 }
-        count = 0
-        spin = ['|', '/', '-', '\\']
-
-        print("Deleting S3 test cubes, this may take a long time")
-
-        while resp['KeyCount'] > 0:
-            resp = client.list_objects_v2(**args_)
-            args_['ContinuationToken'] = resp['NextContinuationToken']
-            print("\rDeleting Cubes: Querying", end='')
-            for obj in resp['Contents']:
-                if lookup_prefix in obj['Key']:
-                    count += 1
-                    print("\rDeleting Cubes: {}".format(spin[count % 4]), end='')
-                    client.delete_object(Bucket = args['s3_bucket'],
-                                         Key = obj['Key'])
-
-        print("Deleted {} cubes".format(count))
-
-
-    def delete_index_keys(self, args):
-        table = self.bosslet_config.session.resource('dynamodb').Table(args['s3_index'])
-        lookup_prefix = '&'.join([args['collection_id'], args['experiment_id'], args['channel_id']])
-
-        resp = {'Count': 1}
-        while resp['Count'] > 0:
-            resp = table.scan(FilterExpression = Attr('lookup-key').begins_with(lookup_prefix))
-            print("Removing {} S3 index keys".format(resp['Count']))
-            for item in resp['Items']:
-                key = {
-                    'object-key': item['object-key'],
-                    'version-node': item['version-node'],
-                }
-                table.delete_item(Key = key)
+        def delete(batch):
+            resp = client.delete_objects(Bucket = args['s3_bucket'],
+                                         Delete = {'Objects': [{'Key': key} for key in batch],
+                                                   'Quiet': True})
+            return resp.get('Errors', [])
+
+        batches = [objects[i:i+S3_DELETE_BATCH_SIZE] for i in range(0, len(objects), S3_DELETE_BATCH_SIZE)]
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            errors = [error for errors in executor.map(delete, batches) for error in errors]
+
+        for error in errors:
+            print("Failed to delete {}: {}".format(error['Key'], error['Message']))
+        print("Deleted {} cubes".format(len(objects) - len(errors)))
+
+    def delete_index_keys(self, args, keys=None, threads=16):
+        """
+        Delete the test channel's s3index entries, using concurrent
+        BatchWriteItem calls.
+
+        Args:
+            args (dict): This should be the dict returned by get_downsample_args().
+            keys (list[dict]|None): Result of find_index_keys(), looked up if not given.
+            threads (int): Number of concurrent BatchWriteItem calls.
+        """
+        if keys is None:
+            keys = self.find_index_keys(args, threads)
+
+        print("Removing {} S3 index keys".format(len(keys)))
+        batch_write(self.bosslet_config.session, args['s3_index'],
+                    [{'DeleteRequest': {'Key': key}} for key in keys],
+                    threads)
 
 def parse_args():
     """
@@ -327,6 +482,23 @@ def parse_args():
                         action='store_true',
                         default=False,
                         help="Don't upload any data to the channel")
+    parser.add_argument('--extent',
+                        nargs=3,
+                        type=int,
+                        default=None,
+                        help='Number of cubes to fill in X, Y, and Z (default: 2 2 2 in test mode)')
+    parser.add_argument('--seed',
+                        type=int,
+                        default=0,
+                        help='Random seed for the uploaded data (default: 0)')
+    parser.add_argument('--processes',
+                        type=int,
+                        default=None,
+                        help='Number of processes generating cubes (default: # of CPUs)')
+    parser.add_argument('--threads',
+                        type=int,
+                        default=16,
+                        help='Number of concurrent S3 / DynamoDB requests (default: 16)')
     parser.add_argument('--leave-index',
                         action = 'store_true',
                         default = False,
@@ -335,6 +507,10 @@ def parse_args():
                         action = 'store_true',
                         default = False,
                         help = 'Remove S3 cubes and S3 index table keys related to testing')
+    parser.add_argument('--scan-bucket',
+                        action = 'store_true',
+                        default = False,
+                        help = 'With --cleanup, also list the whole cuboid bucket to find cubes without S3 index keys (slow)')
     parser.add_bosslet()
     parser.add_argument(
         'channel_id',
@@ -352,15 +528,23 @@ if __name__ == '__main__':
     start_args = ds_test.get_downsample_args()
 
     if args.cleanup:
-        ds_test.delete_index_keys(session, start_args)
-        ds_test.delete_data(session, start_args)
+        keys = ds_test.find_index_keys(start_args, args.threads)
+        ds_test.delete_data(start_args, keys, args.threads, args.scan_bucket)
+        ds_test.delete_index_keys(start_args, keys, args.threads)
         import sys; sys.exit(0)
 
     if not args.leave_index:
-        ds_test.delete_index_keys(session, start_args)
+        ds_test.delete_index_keys(start_args, threads=args.threads)
+
+    extent = None
+    if args.extent is not None:
+        # Cubes outside of the test volume are only read when not in test mode
+        start_args['test'] = False
+        cuboid_size = CUBOIDSIZE[0]
+        extent = XYZ(*[min(e, ceildiv(f, c)) for e, f, c in zip(args.extent, args.frame, cuboid_size)])
 
     if not args.noupload:
-        ds_test.upload_data(start_args)
+        ds_test.upload_data(start_args, extent, args.seed, args.processes, args.threads)
 
     sfn = args.bosslet_config.session.client('stepfunctions')
     resp = sfn.start_execution(
@@ -368,3 +552,6 @@ if __name__ == '__main__':
         input=json.dumps(start_args)
     )
     print(resp)
+
+    print("Once finished, report the performance with")
+    print("    bin/downsample_report.py {} {}".format(args.bosslet_name, resp['executionArn']))